@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# This file is part of mkchromecast.
+
+"""Compares the CPU cost and latency of the Linux audio encoder backends.
+
+Each backend encodes the click track of latency_profiles.py, which stands in
+for parec: the ffmpeg and parec backends pipe it into an encoder process, and
+the pyav backend encodes it within the server process.  The Flask server
+streams the result to a local client, which measures the latency of every
+click, and we report the CPU time spent by the server and its pipeline
+processes (including the generator, which costs the same for every backend)
+as a share of one core.
+
+Requires ffmpeg in the PATH, the encoder binaries of the parec backend for the
+chosen codec (lame for mp3), and PyAV for the pyav backend.
+
+Example:
+    python3 benchmarks/encoder_backends.py --codec mp3 --clicks 20
+"""
+
+import argparse
+import multiprocessing
+import os
+import pathlib
+import shlex
+import statistics
+import sys
+import time
+
+import psutil
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mkchromecast import constants
+from mkchromecast import pipeline_builder
+from mkchromecast import stream_infra
+
+import latency_profiles
+
+_BACKENDS = ["ffmpeg", "parec", "pyav"]
+
+
+def _serve(backend_name: str, codec: str, period: float, port: int) -> None:
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    profile = constants.LATENCY_PROFILES["balanced"]
+    chunk_size = 64
+    fragment = pipeline_builder.capture_fragment_size(chunk_size)
+    settings = pipeline_builder.EncodeSettings(
+        codec=codec, adevice=None, bitrate=constants.DEFAULT_BITRATE,
+        frame_size=fragment,
+        samplerate=str(latency_profiles._SAMPLE_RATE), segment_time=None)
+    generator = [sys.executable, "-c", latency_profiles._GENERATOR,
+                 str(fragment), str(period)]
+
+    # Without a path for parec, the server runs the command as it is, instead
+    # of starting parec itself.
+    backend = stream_infra.BackendInfo(backend_name, None)
+    pyav_output = None
+    if backend_name == "pyav":
+        command = generator
+        pyav_output = pipeline_builder.Audio(
+            backend, "Linux", settings).pyav_output
+    else:
+        if backend_name == "ffmpeg":
+            backend.path = "ffmpeg"
+            encoder = latency_profiles._GeneratedAudio(
+                backend, "Linux", settings).command
+        else:
+            encoder = pipeline_builder.Audio(backend, "Linux", settings).command
+        command = ["sh", "-c",
+                   f"{shlex.join(generator)} | {shlex.join(encoder)}"]
+
+    stream_infra.FlaskServer.init_audio(
+        adevice=None, backend=backend, bitrate=constants.DEFAULT_BITRATE,
+        buffer_size=2 * chunk_size**2, codec=codec, command=command,
+        media_type=f"audio/{codec}", platform="Linux",
+        samplerate=str(latency_profiles._SAMPLE_RATE),
+        latency_profile=profile, pyav_output=pyav_output)
+    stream_infra.FlaskServer.run(host="127.0.0.1", port=port)
+
+
+def _cpu_seconds(process: psutil.Process) -> float:
+    """Returns the CPU time of a process and its running descendants."""
+    total = 0.0
+    for proc in [process, *process.children(recursive=True)]:
+        try:
+            times = proc.cpu_times()
+        except psutil.NoSuchProcess:
+            continue
+        total += times.user + times.system
+    return total
+
+
+def run_benchmark(backend: str, args) -> None:
+    port = latency_profiles._free_port()
+    proc = multiprocessing.Process(
+        target=_serve, args=(backend, args.codec, args.period, port))
+    proc.start()
+    try:
+        latency_profiles._wait_for_port(port)
+        server = psutil.Process(proc.pid)
+        cpu_before = _cpu_seconds(server)
+        start = time.monotonic()
+        latencies = latency_profiles._measure(port, args.codec, args.period,
+                                              args.clicks, args.warmup)
+        # The pipeline is still running, so its processes are counted.
+        cpu = _cpu_seconds(server) - cpu_before
+        elapsed = time.monotonic() - start
+    finally:
+        proc.terminate()
+        proc.join()
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"{backend:>7} {len(ms):>6} {statistics.median(ms):>10.1f} "
+          f"{p95:>10.1f} {100 * cpu / elapsed:>7.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--codec", default="mp3", choices=constants.ALL_CODECS)
+    parser.add_argument("--clicks", type=int, default=10,
+                        help="Number of clicks to measure per backend.")
+    parser.add_argument("--period", type=float, default=2.0,
+                        help="Seconds between clicks; must exceed the "
+                             "latency.")
+    parser.add_argument("--warmup", type=float, default=3.0,
+                        help="Seconds of stream to skip.")
+    parser.add_argument("--backends", nargs="+", default=_BACKENDS,
+                        choices=_BACKENDS)
+    args = parser.parse_args()
+
+    if "pyav" in args.backends and not stream_infra.has_pyav:
+        parser.error("the pyav backend needs PyAV: pip install av")
+
+    print(f"{'backend':>7} {'clicks':>6} {'median ms':>10} {'p95 ms':>10} "
+          f"{'CPU %':>7}")
+    for backend in args.backends:
+        run_benchmark(backend, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# This file is part of mkchromecast.
+
+"""Compares the file streamers of the video node backend with node.js.
+
+Each server sends the same file to one or more local clients, either whole or
+as a series of byte ranges, like a device that seeks.  We report throughput
+along with the CPU time spent in the server process.  node.js runs the old
+nodejs/html5-video-streamer.js, which always listens on port 5000; it is
+skipped when node isn't in the PATH.
+
+Example:
+    python3 benchmarks/file_streamers.py --size-mb 1024 --clients 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import pathlib
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mkchromecast import constants
+from mkchromecast import stream_infra
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+_NODE_STREAMER = _ROOT / "nodejs" / "html5-video-streamer.js"
+_NODE_PORT = 5000
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(server: str, path: str, port: int) -> None:
+    # Silences per-request logging from the servers.
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    stream_infra.FlaskServer.init_video(
+        chunk_size=0, command=[], media_type="video/mp4", file_path=path)
+    if server == "zerocopy":
+        stream_infra.ZeroCopyServer.run(host="127.0.0.1", port=port)
+    elif server == "asyncio":
+        stream_infra.AsyncioServer.run(host="127.0.0.1", port=port)
+    else:
+        stream_infra.FlaskServer.run(host="127.0.0.1", port=port)
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server didn't start listening on port {port}")
+
+
+def _get(port: int, headers: str, buf: bytearray) -> int:
+    """Sends one request, and returns the size of the response body."""
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(f"GET /stream HTTP/1.1\r\nHost: localhost\r\n{headers}"
+                     "Connection: close\r\n\r\n".encode("latin-1"))
+        received = b""
+        while b"\r\n\r\n" not in received:
+            size = sock.recv_into(buf)
+            if not size:
+                raise RuntimeError("The server closed the connection early")
+            received += bytes(buf[:size])
+        _, body = received.split(b"\r\n\r\n", 1)
+        total = len(body)
+        while size := sock.recv_into(buf):
+            total += size
+        return total
+
+
+def _fetch(port: int, args, size: int, received: list[int],
+           index: int) -> None:
+    buf = bytearray(1 << 20)
+    if not args.ranges:
+        received[index] = _get(port, "", buf)
+        return
+
+    # Every client seeks to the same places, so that servers are compared on
+    # the same requests.
+    rng = random.Random(index)
+    length = min(args.range_mb << 20, size)
+    total = 0
+    for _ in range(args.ranges):
+        start = rng.randrange(size - length + 1)
+        total += _get(port, f"Range: bytes={start}-{start + length - 1}\r\n",
+                      buf)
+    received[index] = total
+
+
+def _start(server: str, path: str) -> tuple[psutil.Popen, int]:
+    if server == "node":
+        proc = psutil.Popen([shutil.which("node"), str(_NODE_STREAMER), path],
+                            stdout=subprocess.DEVNULL)
+        return proc, _NODE_PORT
+
+    port = _free_port()
+    proc = multiprocessing.Process(target=_serve, args=(server, path, port))
+    proc.start()
+    return proc, port
+
+
+def run_benchmark(server: str, path: str, size: int, args) -> None:
+    proc, port = _start(server, path)
+    try:
+        _wait_for_port(port)
+        server_proc = psutil.Process(proc.pid)
+        cpu_before = server_proc.cpu_times()
+
+        received = [0] * args.clients
+        clients = [threading.Thread(target=_fetch,
+                                    args=(port, args, size, received, i))
+                   for i in range(args.clients)]
+        start = time.monotonic()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - start
+
+        cpu_after = server_proc.cpu_times()
+    finally:
+        proc.terminate()
+        if server == "node":
+            proc.wait()
+        else:
+            proc.join()
+
+    cpu = ((cpu_after.user - cpu_before.user)
+           + (cpu_after.system - cpu_before.system))
+    mbytes = sum(received) / (1 << 20)
+    print(f"{server:>9} {args.clients:>7} "
+          f"{mbytes / elapsed:>10.1f} {cpu:>8.2f} "
+          f"{cpu * 1024 / max(mbytes, 1):>11.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256,
+                        help="Size of the file that is served.")
+    parser.add_argument("--clients", type=int, default=1,
+                        help="Number of concurrent clients.")
+    parser.add_argument("--ranges", type=int, default=0,
+                        help="Number of byte ranges each client requests, "
+                             "instead of the whole file.")
+    parser.add_argument("--range-mb", type=int, default=16,
+                        help="Size of each byte range.")
+    parser.add_argument("--servers", nargs="+",
+                        default=["node"] + constants.STREAM_SERVERS,
+                        choices=["node"] + constants.STREAM_SERVERS)
+    args = parser.parse_args()
+
+    servers = args.servers
+    if "node" in servers and shutil.which("node") is None:
+        print("node isn't in the PATH, so it is skipped.", file=sys.stderr)
+        servers = [server for server in servers if server != "node"]
+
+    size = args.size_mb << 20
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "movie.mp4")
+        with open(path, "wb") as movie:
+            # Random data, so that nothing along the way can compress it.
+            for _ in range(args.size_mb):
+                movie.write(os.urandom(1 << 20))
+
+        print(f"{'server':>9} {'clients':>7} {'MiB/s':>10} "
+              f"{'CPU s':>8} {'CPU s/GiB':>11}")
+        for server in servers:
+            run_benchmark(server, path, size, args)
+
+
+if __name__ == "__main__":
+    main()
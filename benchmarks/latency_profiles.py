@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# This file is part of mkchromecast.
+
+"""Measures the end-to-end latency that each --latency-profile adds.
+
+A generator stands in for the capture device: it produces silent 16-bit stereo
+PCM in real time, handing it over one capture fragment at a time, with a click
+at the start of every period of the wall clock.  The profile's ffmpeg encoder
+and streaming server deliver that to a local client, which decodes the stream
+with ffmpeg and notes when each click arrives.  The reported latency includes
+the client's decoder, which adds roughly the same delay for every profile.
+
+Requires ffmpeg in the PATH.
+
+Example:
+    python3 benchmarks/latency_profiles.py --codec mp3 --clicks 20
+"""
+
+import argparse
+import multiprocessing
+import os
+import pathlib
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mkchromecast import constants
+from mkchromecast import pipeline_builder
+from mkchromecast import stream_infra
+
+_SAMPLE_RATE = 44100
+# Amplitude of the clicks, and the threshold for detecting them.
+_CLICK = 0x7FFF
+_THRESHOLD = 8000
+
+_GENERATOR = """
+import math, os, sys, time
+fragment, period = int(sys.argv[1]), float(sys.argv[2])
+rate = 44100
+frames = fragment // 4
+click_frames = rate // 100
+start = time.time()
+sent = 0
+while True:
+    t0 = start + sent / rate
+    t1 = start + (sent + frames) / rate
+    # Like a capture device, the fragment is only available once it's full.
+    delay = t1 - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    data = bytearray(frames * 4)
+    boundary = math.ceil(t0 / period) * period
+    if boundary < t1:
+        offset = round((boundary - t0) * rate)
+        end = min(frames, offset + click_frames)
+        data[offset * 4:end * 4] = b"\\xff\\x7f\\xff\\x7f" * (end - offset)
+    os.write(1, data)
+    sent += frames
+"""
+
+
+class _GeneratedAudio(pipeline_builder.Audio):
+    """Encodes PCM from stdin instead of a capture device."""
+
+    def _input_command(self) -> list[str]:
+        return [*self._low_delay_input_flags(),
+                "-f", "s16le",
+                "-ar", str(_SAMPLE_RATE),
+                "-ac", "2",
+                "-i", "pipe:0"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(server: str, profile_name: str, codec: str, period: float,
+           port: int) -> None:
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    profile = constants.LATENCY_PROFILES[profile_name]
+    chunk_size = 64
+    fragment = pipeline_builder.capture_fragment_size(chunk_size,
+                                                      profile.capture_ms)
+    backend = stream_infra.BackendInfo("ffmpeg", "ffmpeg")
+    settings = pipeline_builder.EncodeSettings(
+        codec=codec, adevice=None, bitrate=constants.DEFAULT_BITRATE,
+        frame_size=fragment, samplerate=str(_SAMPLE_RATE), segment_time=None,
+        low_delay=profile.low_delay)
+    encoder = _GeneratedAudio(backend, "Linux", settings).command
+    generator = [sys.executable, "-c", _GENERATOR, str(fragment), str(period)]
+    command = ["sh", "-c", f"{shlex.join(generator)} | {shlex.join(encoder)}"]
+
+    read_sizing = None
+    if profile.read_latency_ms is not None:
+        read_sizing = stream_infra.ReadSizing(
+            min_size=512, max_size=1024**2,
+            target_latency_ms=profile.read_latency_ms)
+    stream_infra.FlaskServer.init_audio(
+        adevice=None, backend=backend, bitrate=constants.DEFAULT_BITRATE,
+        buffer_size=2 * chunk_size**2, codec=codec, command=command,
+        media_type=f"audio/{codec}", platform="Linux",
+        samplerate=str(_SAMPLE_RATE), read_sizing=read_sizing,
+        latency_profile=profile)
+
+    if server == "zerocopy":
+        stream_infra.ZeroCopyServer.run(host="127.0.0.1", port=port)
+    elif server == "asyncio":
+        stream_infra.AsyncioServer.run(host="127.0.0.1", port=port)
+    else:
+        stream_infra.FlaskServer.run(host="127.0.0.1", port=port)
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server didn't start listening on port {port}")
+
+
+def _measure(port: int, codec: str, period: float, clicks: int,
+             warmup: float) -> list[float]:
+    """Returns the latency of each click in seconds."""
+    fmt = "adts" if codec == "aac" else codec
+    decoder = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error",
+         "-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0",
+         "-f", fmt, "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(_SAMPLE_RATE),
+         "-flush_packets", "1", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(b"GET /stream HTTP/1.1\r\nHost: localhost\r\n\r\n")
+
+    def forward():
+        # Strips the response headers, and feeds the body to the decoder.
+        body = b""
+        while b"\r\n\r\n" not in body:
+            body += sock.recv(4096)
+        try:
+            decoder.stdin.write(body.split(b"\r\n\r\n", 1)[1])
+            while data := sock.recv(65536):
+                decoder.stdin.write(data)
+                decoder.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+
+    threading.Thread(target=forward, daemon=True).start()
+
+    latencies: list[float] = []
+    ignore_until = time.time() + warmup
+    fd = decoder.stdout.fileno()
+    try:
+        while len(latencies) < clicks:
+            data = os.read(fd, 4096)
+            arrival = time.time()
+            if not data:
+                raise RuntimeError("The stream ended early")
+            if arrival < ignore_until:
+                continue
+
+            samples = memoryview(data[:len(data) // 2 * 2]).cast("h")
+            if any(abs(sample) > _THRESHOLD for sample in samples):
+                # Clicks start on multiples of the period.
+                latencies.append(arrival - arrival // period * period)
+                ignore_until = arrival + period / 2
+    finally:
+        sock.close()
+        decoder.kill()
+        decoder.wait()
+
+    return latencies
+
+
+def run_benchmark(server: str, profile: str, args) -> None:
+    port = _free_port()
+    proc = multiprocessing.Process(
+        target=_serve, args=(server, profile, args.codec, args.period, port))
+    proc.start()
+    try:
+        _wait_for_port(port)
+        latencies = _measure(port, args.codec, args.period, args.clicks,
+                             args.warmup)
+    finally:
+        proc.terminate()
+        proc.join()
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"{server:>9} {profile:>10} {len(ms):>6} "
+          f"{statistics.median(ms):>10.1f} {p95:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--codec", default="mp3", choices=constants.ALL_CODECS)
+    parser.add_argument("--clicks", type=int, default=10,
+                        help="Number of clicks to measure per profile.")
+    parser.add_argument("--period", type=float, default=2.0,
+                        help="Seconds between clicks; must exceed the "
+                             "latency.")
+    parser.add_argument("--warmup", type=float, default=3.0,
+                        help="Seconds of stream to skip, including any "
+                             "prewarm backlog.")
+    parser.add_argument("--servers", nargs="+", default=["flask"],
+                        choices=constants.STREAM_SERVERS)
+    parser.add_argument("--profiles", nargs="+",
+                        default=list(constants.LATENCY_PROFILES),
+                        choices=constants.LATENCY_PROFILES.keys())
+    args = parser.parse_args()
+
+    print(f"{'server':>9} {'profile':>10} {'clicks':>6} "
+          f"{'median ms':>10} {'p95 ms':>10}")
+    for server in args.servers:
+        for profile in args.profiles:
+            run_benchmark(server, profile, args)
+
+
+if __name__ == "__main__":
+    main()
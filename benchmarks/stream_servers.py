@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# This file is part of mkchromecast.
+
+"""Compares the CPU cost of the available streaming servers.
+
+Each server streams the output of a synthetic pipeline (`head -c SIZE
+/dev/zero`) to one or more local clients, and we report throughput along with
+the CPU time spent in the server process (excluding the pipeline itself).
+
+Example:
+    python3 benchmarks/stream_servers.py --size-mb 512 --clients 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import pathlib
+import socket
+import sys
+import threading
+import time
+
+import psutil
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from mkchromecast import constants
+from mkchromecast import stream_infra
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(server: str, mode: str, size: int, chunk_size: int, port: int):
+    # Silences per-request logging from the servers.
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    command = ["head", "-c", str(size), "/dev/zero"]
+    if mode == "video":
+        stream_infra.FlaskServer.init_video(
+            chunk_size=chunk_size, command=command, media_type="video/mp4")
+    else:
+        backend = stream_infra.BackendInfo("ffmpeg", "ffmpeg")
+        stream_infra.FlaskServer.init_audio(
+            adevice=None, backend=backend, bitrate=192,
+            buffer_size=chunk_size, codec="mp3", command=command,
+            media_type="audio/mpeg", platform="Linux", samplerate="44100")
+
+    if server == "zerocopy":
+        stream_infra.ZeroCopyServer.run(host="127.0.0.1", port=port)
+    elif server == "asyncio":
+        stream_infra.AsyncioServer.run(host="127.0.0.1", port=port)
+    else:
+        stream_infra.FlaskServer.run(host="127.0.0.1", port=port)
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server didn't start listening on port {port}")
+
+
+def _fetch(port: int, received: list[int], index: int) -> None:
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(b"GET /stream HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        total = 0
+        buf = bytearray(1 << 20)
+        while size := sock.recv_into(buf):
+            total += size
+        received[index] = total
+
+
+def run_benchmark(server: str, mode: str, args) -> None:
+    port = _free_port()
+    proc = multiprocessing.Process(
+        target=_serve,
+        args=(server, mode, args.size_mb << 20, args.chunk_size, port))
+    proc.start()
+    try:
+        _wait_for_port(port)
+        server_proc = psutil.Process(proc.pid)
+        cpu_before = server_proc.cpu_times()
+
+        received = [0] * args.clients
+        clients = [threading.Thread(target=_fetch, args=(port, received, i))
+                   for i in range(args.clients)]
+        start = time.monotonic()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.monotonic() - start
+
+        cpu_after = server_proc.cpu_times()
+    finally:
+        proc.terminate()
+        proc.join()
+
+    cpu = ((cpu_after.user - cpu_before.user)
+           + (cpu_after.system - cpu_before.system))
+    mbytes = sum(received) / (1 << 20)
+    print(f"{server:>9} {mode:>6} {args.clients:>7} "
+          f"{mbytes / elapsed:>10.1f} {cpu:>8.2f} "
+          f"{cpu * 1024 / max(mbytes, 1):>11.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256,
+                        help="Amount of data each pipeline produces.")
+    parser.add_argument("--chunk-size", type=int, default=2 * 64**2,
+                        help="Read size used by the servers.")
+    parser.add_argument("--clients", type=int, default=1,
+                        help="Number of concurrent clients.")
+    parser.add_argument("--servers", nargs="+", default=constants.STREAM_SERVERS,
+                        choices=constants.STREAM_SERVERS)
+    parser.add_argument("--modes", nargs="+", default=["video", "audio"],
+                        choices=["video", "audio"],
+                        help="video: one pipeline per client; audio: one "
+                             "shared pipeline.")
+    args = parser.parse_args()
+
+    print(f"{'server':>9} {'mode':>6} {'clients':>7} {'MiB/s':>10} "
+          f"{'CPU s':>8} {'CPU s/GiB':>11}")
+    for mode in args.modes:
+        for server in args.servers:
+            run_benchmark(server, mode, args)
+
+
+if __name__ == "__main__":
+    main()
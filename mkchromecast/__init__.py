@@ -1,5 +1,6 @@
 # This file is part of Mkchromecast.
 
+import importlib.util
 import os
 import platform
 import shlex
@@ -12,7 +13,7 @@ from mkchromecast import colors
 from mkchromecast import config
 from mkchromecast import constants
 from mkchromecast.constants import OpMode
-from mkchromecast.utils import terminate, check_url
+from mkchromecast.utils import terminate, check_url, seek_seconds
 from mkchromecast.resolution import resolutions
 
 class Mkchromecast:
@@ -87,7 +88,13 @@ class Mkchromecast:
         self.source_url: Optional[str] = args.source_url
         self.subtitles: Optional[str] = args.subtitles
         self.hijack: bool = args.hijack
-        self.device_name: Optional[str] = args.name
+        # --name takes a comma-separated list of devices to cast to together.
+        self.device_names: list[str] = []
+        if args.name:
+            self.device_names = [name.strip() for name in args.name.split(",")
+                                 if name.strip()]
+        self.device_name: Optional[str] = (
+            self.device_names[0] if self.device_names else None)
         self.port: int = args.port  # TODO(xsdg): Validate range 0..65535.
         self.fps: str = args.fps  # TODO(xsdg): Why is this typed as a str?
 
@@ -98,9 +105,29 @@ class Mkchromecast:
         self.screencast: bool = args.screencast
         self.display: Optional[str] = args.display
         self.vcodec: str = args.vcodec
+        if not 0 < args.video_cpu_budget <= 1:
+            print(colors.error("The video CPU budget must be more than 0, and "
+                               "at most 1"))
+            sys.exit(0)
+        self.video_cpu_budget: float = args.video_cpu_budget
+        self.device_generation: str = args.device_generation
+        if args.transcode_cache is not None and args.transcode_cache <= 0:
+            print(colors.error("The transcode cache size must be a positive "
+                               "integer"))
+            sys.exit(0)
+        self.transcode_cache: Optional[int] = args.transcode_cache
         self.loop: bool = args.loop
+        if args.seek is not None:
+            try:
+                seek_seconds(args.seek)
+            except ValueError:
+                print(colors.error("The seek time must be HH:MM:SS, MM:SS or "
+                                   f"seconds, not {args.seek}"))
+                sys.exit(0)
         self.seek: Optional[str] = args.seek
 
+        self.stream_server: str = args.stream_server
+
         self.control: bool = args.control
         self.tries: Optional[int] = args.tries
         self.videoarg: bool = args.video
@@ -123,6 +150,12 @@ class Mkchromecast:
                     print(f"- {backend}.")
                 sys.exit(0)
 
+            if (args.encoder_backend == "pyav"
+                    and importlib.util.find_spec("av") is None):
+                print(colors.error("The pyav backend needs PyAV, which can be "
+                                   "installed with: pip install av"))
+                sys.exit(0)
+
             # encoder_backend is reasonable.
             self.backend = args.encoder_backend
         else:
@@ -206,6 +239,23 @@ class Mkchromecast:
             sys.exit(0)
         self.chunk_size: int = args.chunk_size
 
+        if args.target_latency is not None and args.target_latency <= 0:
+            print(colors.error("Target latency must be a positive integer"))
+            sys.exit(0)
+        if not 0 < args.min_read_size <= args.max_read_size:
+            print(colors.error("Read sizes must be positive, and "
+                               "--min-read-size at most --max-read-size"))
+            sys.exit(0)
+        self.latency_profile: constants.LatencyProfile = (
+            constants.LATENCY_PROFILES[args.latency_profile])
+        self.target_latency: Optional[int]
+        if args.target_latency is not None:
+            self.target_latency = args.target_latency
+        else:
+            self.target_latency = self.latency_profile.read_latency_ms
+        self.min_read_size: int = args.min_read_size
+        self.max_read_size: int = args.max_read_size
+
         if args.sample_rate < 22050:
             print(colors.error("Sample rate must be at least 22050"))
             sys.exit(0)
@@ -218,12 +268,51 @@ class Mkchromecast:
         else:
             self.samplerate = args.sample_rate
 
+        if len(self.device_names) > 1 and self.videoarg:
+            print(colors.warning(
+                "Video can only be cast to one device.  Casting to "
+                f"{self.device_name}."))
+            self.device_names = self.device_names[:1]
+
+        self.prewarm: bool
+        if args.prewarm and self.backend == "node":
+            print(colors.warning(
+                "The --prewarm option is not available for the node backend.  "
+                "Ignoring it."))
+            self.prewarm = False
+        else:
+            self.prewarm = args.prewarm
+
         self.segment_time: Optional[int]
-        if args.segment_time and self.backend not in ["parec", "node"]:
+        if args.segment_time and self.backend not in ["parec", "pyav", "node"]:
             self.segment_time = args.segment_time
         else:
             self.segment_time = None
 
+        self.hls: bool = args.hls
+        if self.hls:
+            if self.backend != "ffmpeg":
+                print(colors.error("HLS needs the ffmpeg backend"))
+                sys.exit(0)
+            if self.videoarg:
+                if (self.operation not in {OpMode.SCREENCAST,
+                                           OpMode.INPUT_FILE}
+                        or self.command):
+                    print(colors.error("HLS video is only supported for "
+                                       "--screencast and -i files"))
+                    sys.exit(0)
+            elif self.operation != OpMode.AUDIOCAST:
+                print(colors.error("HLS audio is only supported when casting "
+                                   "the computer's audio"))
+                sys.exit(0)
+            elif self.codec not in constants.HLS_CODECS:
+                print(colors.error("Supported audio codecs with HLS are: "))
+                for codec in constants.HLS_CODECS:
+                    print(f"- {codec}")
+                sys.exit(0)
+            # Segments are written from the start anyway.
+            self.prewarm = False
+
         self.youtube_url: Optional[str]
         if not args.youtube:
             self.youtube_url = None
@@ -111,9 +111,11 @@ Parser.add_argument(
     default="64",
     help="""
     Set the chunk size base for streaming in the Flask server. Default to 64.
-    This option only works when using the ffmpeg backend. This number is the
-    base to set both the buffer_size (defined by 2 * chunk_size**2) in Flask
-    server and the frame_size (defined by 32 * chunk_size).
+    This option only works when using the ffmpeg backend, or the parec and pyav
+    backends when libpulse-simple is installed. This number is the base to set
+    both the buffer_size (defined by 2 * chunk_size**2) in Flask server and the
+    frame_size (defined by 32 * chunk_size), which is also the size of the
+    fragments that are captured at a time.
 
     Example:
 
@@ -196,6 +198,24 @@ _ActionGroup.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--device-generation",
+    type=str,
+    default=constants.DEFAULT_DEVICE_GENERATION,
+    choices=constants.DEVICE_GENERATIONS,
+    help=f"""
+    The generation of the Google Cast device that video files are cast to,
+    which decides what it can decode. Video and audio streams that the device
+    decodes are copied, and only the others are transcoded. Use gen1 for the
+    first and second generation Chromecast, gen3 for the third generation,
+    ultra for the Chromecast Ultra, and google-tv for the Chromecast with
+    Google TV. Defaults to {constants.DEFAULT_DEVICE_GENERATION}.
+
+    Example:
+        python mkchromecast.py --video -i "/path/to/file.mkv" --device-generation ultra
+    """,
+)
+
 Parser.add_argument(
     "--display",
     type=str,
@@ -217,9 +237,14 @@ Parser.add_argument(
         - node (default in macOS)
         - parec (default in Linux)
         - ffmpeg
+        - pyav (Linux only)
 
     Example:
         python mkchromecast.py --encoder-backend ffmpeg
+
+    The pyav backend captures audio with parec, like the parec backend, but
+    encodes it within mkchromecast instead of in a separate encoder process.
+    It needs PyAV, which can be installed with: pip install av
     """,
 )
 
@@ -233,6 +258,27 @@ Parser.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--hls",
+    action="store_true",
+    default=False,
+    help="""
+    Stream in HLS segments, instead of one long HTTP response. The encoder
+    writes a few seconds of audio or video per segment into memory (or a
+    temporary directory), and the Google Cast device plays them through a
+    playlist. Reconnecting and casting to several devices then only costs
+    serving files. The length of the segments is set with --segment-time, and
+    defaults to 2 seconds.
+
+    Example:
+        python mkchromecast.py --encoder-backend ffmpeg -c aac --hls
+        python mkchromecast.py --video --screencast --hls
+
+    This option needs the ffmpeg backend, and the aac or mp3 codecs for audio.
+    Video is supported for --screencast and -i files.
+    """,
+)
+
 Parser.add_argument(
     "--host",
     type=str,
@@ -262,6 +308,30 @@ _ActionGroup.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--latency-profile",
+    type=str,
+    default="balanced",
+    choices=constants.LATENCY_PROFILES.keys(),
+    help="""
+    Tune the whole audio chain, from capture through encoding to the streaming
+    server, for latency or for efficiency.
+    Possible profiles:
+        - low: Small capture buffers, no ffmpeg input probing or output
+          buffering, small server reads and a short prewarm backlog.  This
+          uses more CPU.
+        - balanced (default)
+        - throughput: Large capture buffers and server reads, and a long
+          prewarm backlog.  This uses the least CPU.
+
+    Example:
+        python mkchromecast.py --encoder-backend ffmpeg --latency-profile low
+
+    --target-latency overrides the read sizes of the profile.  This option is
+    not used by the node backend.
+    """,
+)
+
 Parser.add_argument(
     "--loop",
     action="store_true",
@@ -271,6 +341,32 @@ Parser.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--max-read-size",
+    type=int,
+    default=1024**2,
+    help="""
+    Set the largest number of bytes the streaming server reads from the
+    encoder at a time when --target-latency is used. Default to 1048576.
+
+    Example:
+        python mkchromecast.py --video --screencast --target-latency 50 --max-read-size 262144
+    """,
+)
+
+Parser.add_argument(
+    "--min-read-size",
+    type=int,
+    default=512,
+    help="""
+    Set the smallest number of bytes the streaming server reads from the
+    encoder at a time when --target-latency is used. Default to 512.
+
+    Example:
+        python mkchromecast.py -c opus --target-latency 50 --min-read-size 256
+    """,
+)
+
 Parser.add_argument(
     "--mtype",
     type=str,
@@ -290,10 +386,15 @@ Parser.add_argument(
     default=None,
     help="""
     Use this option if you know the name of the Google Cast you want to
-    connect.
+    connect. Separate several names with commas to cast the same audio to all
+    of them, which share a single capture and encoder. A Google Cast group can
+    be used by its name, too.
 
     Example:
         python mkchromecast.py -n mychromecast
+        python mkchromecast.py -n "Kitchen,Living Room"
+
+    Casting to several devices only works for audio.
     """,
 )
 
@@ -321,6 +422,22 @@ Parser.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--prewarm",
+    action="store_true",
+    default=False,
+    help="""
+    Start capturing and encoding audio as soon as the streaming server starts,
+    instead of waiting for the Google Cast device to connect. The most recent
+    few hundred milliseconds of encoded audio are sent as soon as the device
+    requests the stream, so playback starts almost immediately.
+
+    Example:
+        python mkchromecast.py --encoder-backend ffmpeg --prewarm
+
+    This option is not available for the node backend.
+    """,
+)
 
 _ActionGroup.add_argument(
     "-r",
@@ -420,7 +537,9 @@ Parser.add_argument(
     default=None,
     help="""
     Option to seeking when casting video. The format to set the time is
-    HH:MM:SS.
+    HH:MM:SS. Input files that the device decodes are served as they are (or
+    remuxed into a seekable mp4 first), so the device seeks in the file
+    instead of ffmpeg.
 
     Example:
         python mkchromecast.py --video -i "/path/to/file.mp4" --seek 00:23:00
@@ -433,7 +552,8 @@ Parser.add_argument(
     type=int,
     default=None,
     help="""
-    Segmentate audio for improved live streaming when using ffmpeg.
+    Segmentate audio for improved live streaming when using ffmpeg. With
+    --hls, this is the length of the segments in seconds.
 
     Example:
         python mkchromecast.py --encoder-backend ffmpeg --segment-time 2
@@ -472,6 +592,29 @@ _ActionGroup.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--stream-server",
+    type=str,
+    default="flask",
+    choices=constants.STREAM_SERVERS,
+    help="""
+    Set the HTTP server that streams to your Google Cast devices.
+    Possible servers:
+        - flask (default)
+        - zerocopy: Moves the encoder output straight to the network socket
+          (using splice on Linux), bypassing Flask.  This uses less CPU, which
+          helps on small ARM boards or when streaming to several devices.
+        - asyncio: Serves every client from a single event loop instead of a
+          thread per client, which scales better with many listeners.
+
+    Example:
+        python mkchromecast.py --encoder-backend ffmpeg --stream-server zerocopy
+        python mkchromecast.py --encoder-backend ffmpeg --stream-server asyncio
+
+    This option is not used by the node backend.
+    """,
+)
+
 Parser.add_argument(
     "--subtitles",
     type=str,
@@ -490,6 +633,43 @@ _ActionGroup.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--target-latency",
+    type=int,
+    default=None,
+    help="""
+    Adapt how much the streaming server reads from the encoder at a time to
+    the measured encoder throughput, aiming to forward the encoded stream at
+    least every given number of milliseconds. Read sizes stay between
+    --min-read-size and --max-read-size. By default, read sizes are fixed and
+    derived from --chunk-size. With --debug, the chosen read size is printed
+    whenever it changes.
+
+    Example:
+        python mkchromecast.py --encoder-backend ffmpeg -c opus --target-latency 50
+
+    This option is not used by the node backend.
+    """,
+)
+
+Parser.add_argument(
+    "--transcode-cache",
+    type=int,
+    default=None,
+    metavar="MB",
+    help="""
+    Keep up to this many megabytes of transcoded video files on disk. When a
+    video file has to be transcoded, the first cast saves the transcode, and
+    later casts of the same file with the same settings are streamed from the
+    disk without encoding. The least recently cast files are removed when the
+    cache is full. Looping casts (--loop) are never cached. Files that are
+    remuxed to be seekable are kept here too. By default, nothing is cached.
+
+    Example:
+        python mkchromecast.py --video -i "/path/to/file.mkv" --resolution 720p --transcode-cache 4096
+    """,
+)
+
 Parser.add_argument(
     "--tries",
     type=int,
@@ -523,6 +703,22 @@ Parser.add_argument(
     """,
 )
 
+Parser.add_argument(
+    "--video-cpu-budget",
+    type=float,
+    default=constants.VIDEO_CPU_BUDGET,
+    help=f"""
+    The share of the CPU cores that a libx264 video encode may use, between 0
+    and 1. The libx264 preset, threads, slices and lookahead are chosen from
+    the cores this allows, the resolution and the frame rate. The chosen
+    settings are printed when casting, and so is the measured encode rate,
+    every 30 seconds. Defaults to {constants.VIDEO_CPU_BUDGET}.
+
+    Example:
+        python mkchromecast.py --video --screencast --video-cpu-budget 0.5
+    """,
+)
+
 # TODO(xsdg): Probably best to replace this with --suppress-video.  Otherwise,
 # we should either auto-detect audio-only usecases, or always send video.
 Parser.add_argument(
@@ -7,12 +7,13 @@ Google Cast device has to point out to http://ip:5000/stream
 import os
 import re
 import shutil
-from typing import Union
+from typing import Optional, Union
 
 import mkchromecast
 from mkchromecast import colors
 from mkchromecast import constants
 from mkchromecast import pipeline_builder
+from mkchromecast import segment_store
 from mkchromecast import stream_infra
 from mkchromecast import utils
 from mkchromecast.constants import OpMode
@@ -25,6 +26,7 @@ backend = stream_infra.BackendInfo()
 _mkcc = mkchromecast.Mkchromecast()
 command: Union[str, list[str]]
 media_type: str
+pyav_output: Optional[stream_infra.PyAVOutput] = None
 
 # We make local copies of these attributes because they are sometimes modified.
 # TODO(xsdg): clean this up more when we refactor this file.
@@ -34,7 +36,8 @@ platform = _mkcc.platform
 
 ip = utils.get_effective_ip(platform, host_override=host, fallback_ip="0.0.0.0")
 
-frame_size = 32 * _mkcc.chunk_size
+frame_size = pipeline_builder.capture_fragment_size(
+    _mkcc.chunk_size, _mkcc.latency_profile.capture_ms)
 buffer_size = 2 * _mkcc.chunk_size**2
 
 debug = _mkcc.debug
@@ -72,7 +75,10 @@ else:
         bitrate=_mkcc.bitrate,
         frame_size=frame_size,
         samplerate=str(_mkcc.samplerate),
-        segment_time=_mkcc.segment_time
+        segment_time=_mkcc.segment_time,
+        low_delay=_mkcc.latency_profile.low_delay,
+        hls_store=(segment_store.SegmentStore.for_port(port) if _mkcc.hls
+                   else None),
     )
 
     # TODO(xsdg): Why is this only run in tray mode???
@@ -120,6 +126,8 @@ else:
 
     builder = pipeline_builder.Audio(backend, platform, encode_settings)
     command = builder.command
+    if backend.name == "pyav":
+        pyav_output = builder.pyav_output
 
 if debug is True:
     print(":::audio::: command " + str(command))
@@ -136,9 +144,16 @@ def _flask_init():
         command=command,
         media_type=media_type,
         platform=platform,
-        samplerate=encode_settings.samplerate)
+        samplerate=encode_settings.samplerate,
+        read_sizing=stream_infra.ReadSizing.from_mkcc(_mkcc),
+        latency_profile=_mkcc.latency_profile,
+        pyav_output=pyav_output,
+        hls_store=encode_settings.hls_store,
+        capture_fragment_size=frame_size)
 
 
 def main():
-    pipeline = stream_infra.PipelineProcess(_flask_init, ip, port, platform)
+    pipeline = stream_infra.PipelineProcess(_flask_init, ip, port, platform,
+                                            prewarm=_mkcc.prewarm,
+                                            stream_server=_mkcc.stream_server)
     pipeline.start()
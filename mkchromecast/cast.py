@@ -1,16 +1,17 @@
 # This file is part of mkchromecast.
 
+from concurrent.futures import ThreadPoolExecutor
 import dataclasses
 import os
 import pickle
 import socket
-import subprocess
-from threading import Thread
+from threading import Event, Thread
 import time
 from typing import Any, Iterable, Optional
 
 import mkchromecast
 from mkchromecast import colors
+from mkchromecast import segment_store
 from mkchromecast import utils
 from mkchromecast.audio_devices import inputint, outputint
 from mkchromecast.constants import OpMode
@@ -37,10 +38,15 @@ has_chromecast: bool
 try:
     import pychromecast
 
+    from mkchromecast import discovery
+
     has_chromecast = True
 except ImportError:
     has_chromecast = False
 
+# How long to wait for the receiver to start playing after loading the media.
+PLAYBACK_TIMEOUT = 5.0
+
 
 @dataclasses.dataclass
 class AvailableDevice:
@@ -62,6 +68,31 @@ def print_available_devices(devices: Iterable[AvailableDevice]):
         print(f"{device.index} \t{device.type} \t{device.name.encode('utf-8').decode('utf-8')}")
 
 
+class _PlaybackListener:
+    """Media status listener that reports when our media starts playing."""
+
+    def __init__(self):
+        self.ready = Event()
+        self.failed: bool = False
+        self._content_id: Optional[str] = None
+
+    def expect(self, content_id: str) -> None:
+        """Starts waiting for the receiver to play `content_id`."""
+        self._content_id = content_id
+        self.failed = False
+        self.ready.clear()
+
+    def new_media_status(self, status) -> None:
+        # Ignores updates about whatever was playing before.
+        if (status.content_id == self._content_id
+                and status.player_state in {"BUFFERING", "PLAYING"}):
+            self.ready.set()
+
+    def load_media_failed(self, *args) -> None:
+        self.failed = True
+        self.ready.set()
+
+
 class Casting:
     """Main casting class."""
 
@@ -72,20 +103,27 @@ class Casting:
 
         self.ip = utils.get_effective_ip(self.mkcc.platform, host_override=self.mkcc.host)
 
+        # The devices that we cast to, by name, and the first of them, which
+        # the system tray talks to directly.
+        self.casts: dict[str, pychromecast.Chromecast] = {}
         self.cast: Optional[pychromecast.Chromecast] = None
-        self._chromecasts_by_name: dict[str, pychromecast.Chromecast]
+        self._browser: discovery.DeviceBrowser
+        # The media status listener of each device, with the connection that
+        # it was registered on.
+        self._playback_listeners: dict[
+            str, tuple[pychromecast.Chromecast, _PlaybackListener]] = {}
+        # The hijack thread, if it was started.
+        self.r: Optional[Thread] = None
+        # When the first device was picked for the user, the other devices to
+        # try if it doesn't answer.
+        self._fallback_names: list[str] = []
 
     def _get_chromecast_names(self) -> list[str]:
-        _chromecasts = pychromecast.get_chromecasts(tries=self.mkcc.tries)
-
-        # since PR380, pychromecast.get_chromecasts returns a tuple
-        # see: https://github.com/home-assistant-libs/pychromecast/pull/380
-        if type(_chromecasts) == tuple:
-            _chromecasts = _chromecasts[0]
-
-        self._chromecasts_by_name = {c.name: c for c in _chromecasts}
-
-        return list(self._chromecasts_by_name.keys())
+        # The browser keeps running in the background, and answers from its
+        # cache when it can.
+        self._browser = discovery.get_browser(self.mkcc.platform,
+                                              debug=self.mkcc.debug)
+        return self._browser.device_names()
 
     """
     Cast processes
@@ -118,6 +156,7 @@ class Casting:
                 print(colors.important("Select devices by using the -s flag."))
                 print(" ")
                 self.cast_to = self.cclist[0][1]
+                self._fallback_names = [name for _, name, _ in self.cclist[1:]]
                 print(colors.success(self.cast_to))
                 print(" ")
 
@@ -229,12 +268,29 @@ class Casting:
         if self.mkcc.debug is True:
             print("def get_devices(self):")
 
-        if self.mkcc.device_name:
-            self.cast_to = self.mkcc.device_name
-
-        if self.cast_to not in self._chromecasts_by_name:
+        names: list[str]
+        if self.mkcc.device_names:
+            names = self.mkcc.device_names
+        else:
+            names = [self.cast_to]
+
+        # Connects to all of the devices at once, so that a missing device
+        # doesn't hold up the others.
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            connected = dict(zip(names, executor.map(self._connect, names)))
+        self.casts = {name: cast for name, cast in connected.items()
+                      if cast is not None}
+
+        # A cached device may be gone, while others answered discovery.
+        while not self.casts and self._fallback_names:
+            name = self._fallback_names.pop(0)
+            print(colors.warning(f"Trying {name} instead"))
+            cast = self._connect(name)
+            if cast is not None:
+                self.casts = {name: cast}
+
+        if not self.casts:
             self.cast = None
-            print(colors.warning(f"No Chromecast found named {self.cast_to}"))
 
             if self.mkcc.platform == "Darwin":
                 inputint()
@@ -251,44 +307,51 @@ class Casting:
             terminate()
             exit()
 
-        self.cast = self._chromecasts_by_name[self.cast_to]
+        self.cast_to = next(iter(self.casts))
+        self.cast = self.casts[self.cast_to]
+        for name, cast in self.casts.items():
+            print()
+            print(
+                colors.important("Status of device ")
+                + " "
+                + colors.success(name)
+            )
+            print()
+            print(cast.status)
+            print()
+
+    def _connect(self, name: str) -> Optional["pychromecast.Chromecast"]:
+        """Connects to the named device, and waits for it to be ready."""
+        cast = self._browser.get_chromecast(name, tries=self.mkcc.tries)
+        if cast is None:
+            # Don't offer a device that has gone away again.
+            self._browser.forget(name)
+            print(colors.warning(f"No Chromecast found named {name}"))
+            return None
+
         # Wait for cast device to be ready
-        self.cast.wait()
-        print()
-        print(
-            colors.important("Status of device ")
-            + " "
-            + colors.success(self.cast_to)
-        )
-        print()
-        print(self.cast.status)
-        print()
+        cast.wait()
+        return cast
 
-    def play_cast(self):
+    def play_cast(self, names: Optional[Iterable[str]] = None):
+        """Casts our stream to the named devices, or to all of them."""
         if self.mkcc.debug is True:
             print("def play_cast(self):")
-        if not self.cast:
+        if not self.casts:
             print(colors.warning("Calling get_devices before proceeding with play_cast"))
             self.get_devices()
-            if not self.cast:
+            if not self.casts:
                 raise Exception("Internal error, self.cast was not set.")
         localip = self.ip
 
-        try:
-            print(
-                colors.options("The IP of ")
-                + colors.success(self.cast_to)
-                + colors.options(" is:")
-                + " "
-                + self.cast.socket_client.host  # valid since at least v3.0.0
-            )
-        except TypeError:
+        names = list(self.casts) if names is None else list(names)
+        for name in names:
             print(
                 colors.options("The IP of ")
-                + colors.success(self.cast_to.player_name)
+                + colors.success(name)
                 + colors.options(" is:")
                 + " "
-                + self.cast_to.ip_address
+                + self.casts[name].socket_client.host  # valid since at least v3.0.0
             )
 
         if self.mkcc.host is None:
@@ -296,17 +359,16 @@ class Casting:
         else:
             print(colors.options("Your manually entered local IP is:") + " " + localip)
 
-        media_controller = self.cast.media_controller
-
         # Set up the mime type and conditionally import video or audio
         # TODO(xsdg): Get rid of these conditional imports.
         media_type: str
+        # A served file can be seeked in, so it isn't cast as a live stream.
+        serves_file = False
         if self.mkcc.videoarg:
             import mkchromecast.video
 
-            # TODO(xsdg): Centralize media type storage in some way.
-            # In mkcc?
-            media_type = self.mkcc.mtype or "video/mp4"
+            media_type = mkchromecast.video.media_type
+            serves_file = mkchromecast.video.served_file is not None
         else:
             import mkchromecast.audio
 
@@ -319,71 +381,132 @@ class Casting:
             play_url = self.mkcc.source_url
             print(colors.options("Casting from stream URL:")
                   + f" {play_url}")
+        elif self.mkcc.hls:
+            play_url = (f"http://{localip}:{self.mkcc.port}/hls/"
+                        f"{segment_store.PLAYLIST}")
+            media_type = segment_store.PLAYLIST_MEDIA_TYPE
+            print(colors.options("Casting HLS playlist:") + f" {play_url}")
         else:
             play_url = f"http://{localip}:{self.mkcc.port}/stream"
 
-        media_controller.play_media(
-            play_url, media_type, title=self.title, stream_type="LIVE",
-        )
+        listeners: dict[str, _PlaybackListener] = {}
+        for name in names:
+            listeners[name] = self._get_playback_listener(name)
+            listeners[name].expect(play_url)
+
+        media_args: dict[str, Any] = {"stream_type": "LIVE"}
+        if self.mkcc.hls:
+            # Without these, the receiver expects packed audio and fMP4 video.
+            media_args["media_info"] = {"hlsSegmentFormat": "ts",
+                                        "hlsVideoSegmentFormat": "mpeg2_ts"}
+        if serves_file:
+            media_args["stream_type"] = "BUFFERED"
+            # The device seeks with a byte range, instead of restarting ffmpeg
+            # with -ss.
+            if self.mkcc.seek:
+                media_args["current_time"] = utils.seek_seconds(self.mkcc.seek)
+
+        # Loads the media on every device back to back, so that they all join
+        # the shared stream at about the same point.
+        start = time.monotonic()
+        for name in names:
+            media_controller = self.casts[name].media_controller
+            media_controller.play_media(
+                play_url, media_type, title=self.title, **media_args,
+            )
 
-        if media_controller.is_active:
-            media_controller.play()
+            if media_controller.is_active:
+                media_controller.play()
 
         print(" ")
         print(colors.important("Cast media controller status"))
         print(" ")
-        print(self.cast.status)
-        print(" ")
-
-        time.sleep(5.0)
-        media_controller.play()
+        for name in names:
+            print(self.casts[name].status)
+            print(" ")
 
-        if self.mkcc.hijack is True:
+        # The devices start up in parallel, so they all share one timeout.
+        deadline = start + PLAYBACK_TIMEOUT
+        all_ready = True
+        for name, listener in listeners.items():
+            if not listener.ready.wait(max(0.0, deadline - time.monotonic())):
+                print(colors.warning(f"{name} hasn't started playing yet."))
+                self.casts[name].media_controller.play()
+                all_ready = False
+            elif listener.failed:
+                print(colors.error(f"{name} failed to load the stream."))
+                all_ready = False
+        if all_ready and self.mkcc.debug is True:
+            print(f"Time to play: {time.monotonic() - start:.2f}s")
+
+        # Recasting from the hijack thread comes through here too.
+        if self.mkcc.hijack is True and self.r is None:
             self.r = Thread(target=self.hijack_cc)
             # This has to be set to True so that we catch
             # KeyboardInterrupt.
             self.r.daemon = True
             self.r.start()
 
+    def _get_playback_listener(self, name: str) -> _PlaybackListener:
+        """Returns a listener for the media status of the named device.
+
+        pychromecast can't unregister listeners, so this registers one per
+        device connection, and reuses it for every cast.
+        """
+        cast = self.casts[name]
+        listened_cast, listener = self._playback_listeners.get(name,
+                                                               (None, None))
+        if listened_cast is not cast:
+            listener = _PlaybackListener()
+            cast.media_controller.register_status_listener(listener)
+            self._playback_listeners[name] = (cast, listener)
+        return listener
+
     def pause(self):
         """Pause casting"""
-        if not self.cast:
+        if not self.casts:
             raise Exception("Internal error: not initialized.")
-        media_controller = self.cast.media_controller
-        media_controller.pause()
+        for cast in self.casts.values():
+            cast.media_controller.pause()
 
     def play(self):
         """Play casting"""
-        if not self.cast:
+        if not self.casts:
             raise Exception("Internal error: not initialized.")
-        media_controller = self.cast.media_controller
-        media_controller.play()
+        for cast in self.casts.values():
+            cast.media_controller.play()
 
     def stop_cast(self):
-        if self.cast:
-            self.cast.quit_app()
+        for cast in self.casts.values():
+            cast.quit_app()
 
     def volume_up(self):
         """Increment volume by 0.1 unless it is already maxed.
-        Returns the new volume.
+        Returns the new volume of the first device.
         """
-        if not self.cast:
+        if not self.casts:
             raise Exception("Internal error: not initialized.")
         if self.mkcc.debug is True:
             print("Increasing volume... \n")
-        volume = round(self.cast.status.volume_level, 1)
-        return self.cast.set_volume(volume + 0.1)
+        return self._change_volume(0.1)
 
     def volume_down(self):
         """Decrement the volume by 0.1 unless it is already 0.
-        Returns the new volume.
+        Returns the new volume of the first device.
         """
-        if not self.cast:
+        if not self.casts:
             raise Exception("Internal error: not initialized.")
         if self.mkcc.debug is True:
             print("Decreasing volume... \n")
-        volume = round(self.cast.status.volume_level, 1)
-        return self.cast.set_volume(volume - 0.1)
+        return self._change_volume(-0.1)
+
+    def _change_volume(self, delta: float):
+        """Changes the volume of every device, keeping their differences."""
+        new_volumes = []
+        for cast in self.casts.values():
+            volume = round(cast.status.volume_level, 1)
+            new_volumes.append(cast.set_volume(volume + delta))
+        return new_volumes[0]
 
     @property
     def available_devices(self) -> list[AvailableDevice]:
@@ -395,17 +518,37 @@ class Casting:
         return devices
 
     def hijack_cc(self):
-        """Dummy method to call  _hijack_cc_().
+        """Recasts whenever a device stops playing our stream.
 
-        In the cast that the self.r thread is alive, we check that the
-        chromecast is connected. If it is connected, we check again in
-        5 seconds.
+        This sleeps until pychromecast reports that another app took over a
+        device, or that its connection came back after dropping.  Only that
+        device is recast, and its existing connection is reused, unless
+        pychromecast gave up on it.
         """
+        # Set by the listeners of all of the devices.
+        wake = Event()
+        listeners: dict[
+            str, tuple[pychromecast.Chromecast, _HijackListener]] = {}
         try:
-            while self.r.is_alive():
-                self._hijack_cc_()
-                # FIXME: I think that this has to be set by users.
-                time.sleep(5)
+            while True:
+                for name, cast in list(self.casts.items()):
+                    listened_cast, _ = listeners.get(name, (None, None))
+                    if cast is not listened_cast:
+                        listener = _HijackListener(wake)
+                        cast.register_status_listener(listener)
+                        cast.register_connection_listener(listener)
+                        listeners[name] = (cast, listener)
+                        # Checks for anything that happened before we
+                        # listened.
+                        listener.changed.set()
+                        wake.set()
+
+                wake.wait()
+                wake.clear()
+                for name, (_, listener) in list(listeners.items()):
+                    if listener.changed.is_set():
+                        listener.changed.clear()
+                        self._hijack_cc_(name, listener)
         except KeyboardInterrupt:
             self.stop_cast()
             if self.mkcc.platform == "Darwin":
@@ -415,42 +558,68 @@ class Casting:
                 remove_sink()
             terminate()
 
-    def _hijack_cc_(self):
-        """Check if chromecast is disconnected and hijack.
+    def _hijack_cc_(self, name: str, listener: "_HijackListener"):
+        """Recasts if the named device is no longer playing our stream."""
+        cast = self.casts.get(name)
+        if cast is None:
+            # We stopped casting to this device.
+            return
+
+        if listener.connection_failed:
+            # pychromecast gave up on the connection, so we need a new one.
+            cast = self._connect(name)
+            if cast is None:
+                # Carries on casting to the other devices.
+                del self.casts[name]
+                if self.casts:
+                    self.cast_to = next(iter(self.casts))
+                    self.cast = self.casts[self.cast_to]
+                return
 
-        This function checks if the chromecast is online. Then, if the display
-        name is different from "Default Media Receiver", it hijacks to the
-        chromecast.
-        """
-        if not self.cast:
-            raise Exception("Internal error: not initialized.")
+            self.casts[name] = cast
+            if name == self.cast_to:
+                self.cast = cast
+            self.play_cast([name])
+        elif listener.connected and _is_hijacked(cast.status):
+            if self.mkcc.debug is True:
+                print(":::hijack::: recasting to " + name)
+            self.play_cast([name])
 
-        ip = self.cast.socket_client.host  # valid since at least v3.0.0
 
-        if ping_chromecast(ip) is True:  # The chromecast is online.
-            if str(self.cast.status.display_name) != "Default Media Receiver":
-                self.mkcc.device_name = self.cast_to
-                self.get_devices()
-                self.play_cast()
-        else:  # The chromecast is offline.
-            try:
-                self.mkcc.device_name = self.cast_to
-                self.get_devices()
-                self.play_cast()
-            except AttributeError:
-                pass
+def _is_hijacked(status) -> bool:
+    """Returns whether another app took over the device."""
+    return str(getattr(status, "display_name", None)) != "Default Media Receiver"
 
 
-def ping_chromecast(ip):
-    """This function pings to hosts.
+class _HijackListener:
+    """Cast status and connection listener for Casting.hijack_cc.
 
-    Credits: http://stackoverflow.com/a/34455969/1995261
+    `changed` is set for this device, and `wake` for any device.
     """
-    try:
-        subprocess.check_output("ping -c 1 " + ip, shell=True)
-    except:
-        return False
-    return True
+
+    def __init__(self, wake: Optional[Event] = None):
+        self.changed = Event()
+        self.connected: bool = True
+        self.connection_failed: bool = False
+        self._wake = wake
+
+    def new_cast_status(self, status) -> None:
+        if _is_hijacked(status):
+            self._set_changed()
+
+    def new_connection_status(self, status) -> None:
+        self.connected = (
+            status.status == pychromecast.socket_client.CONNECTION_STATUS_CONNECTED)
+        self.connection_failed = (
+            status.status == pychromecast.socket_client.CONNECTION_STATUS_FAILED)
+        if self.connected or self.connection_failed:
+            # The receiver may have dropped our stream while we were away.
+            self._set_changed()
+
+    def _set_changed(self) -> None:
+        self.changed.set()
+        if self._wake is not None:
+            self._wake.set()
 
 
 class _DisabledSonosCasting:
@@ -0,0 +1,147 @@
+# This file is part of mkchromecast.
+
+"""What each Google Cast device generation can decode.
+
+Combined with a MediaInfo, this decides for every stream of an input file
+whether it can be copied as it is, copied into a new container, or has to be
+transcoded.  Only what the device can't decode gets transcoded.
+"""
+
+from dataclasses import dataclass
+import enum
+from typing import Optional
+
+from mkchromecast import constants
+from mkchromecast.media_probe import MediaInfo, StreamInfo
+
+
+class Action(enum.Enum):
+    # The stream is already in an mp4 file, and can be sent as it is.
+    COPY = "copy"
+    # The stream can be decoded, but has to be copied into an mp4.
+    REMUX = "remux"
+    TRANSCODE = "transcode"
+
+
+@dataclass(frozen=True)
+class VideoSupport:
+    """A video codec that a device decodes, and its limits."""
+    codec: str
+    # ffprobe profile names.
+    profiles: frozenset[str]
+    pix_fmts: frozenset[str]
+    # As ffprobe reports it: 41 is H.264 level 4.1, and 153 is HEVC level 5.1.
+    # None when the codec has no levels that ffprobe reports reliably.
+    max_level: Optional[int]
+    max_height: int
+    max_fps: float
+
+    def decodes(self, stream: StreamInfo) -> bool:
+        if stream.codec_name != self.codec:
+            return False
+        if stream.profile is not None and stream.profile not in self.profiles:
+            return False
+        if stream.pix_fmt is not None and stream.pix_fmt not in self.pix_fmts:
+            return False
+        if (self.max_level is not None and stream.level is not None
+                and stream.level > self.max_level):
+            return False
+        if stream.height is not None and stream.height > self.max_height:
+            return False
+        # Rounding, as in 59.94 fps.
+        if stream.fps is not None and stream.fps > self.max_fps + 0.5:
+            return False
+        return True
+
+
+@dataclass(frozen=True)
+class DeviceCodecs:
+    video: tuple[VideoSupport, ...]
+    audio: frozenset[str]
+
+
+_8BIT = frozenset({"yuv420p", "yuvj420p"})
+_10BIT = _8BIT | {"yuv420p10le"}
+_H264_PROFILES = frozenset({"Constrained Baseline", "Baseline", "Main", "High"})
+_HEVC_PROFILES = frozenset({"Main", "Main 10"})
+_VP9_PROFILES = frozenset({"Profile 0", "Profile 2"})
+# Every generation decodes these, up to stereo.
+_AUDIO = frozenset({"aac", "mp3", "opus", "vorbis", "flac"})
+
+DEVICE_CODECS: dict[str, DeviceCodecs] = {
+    # The first and second generation Chromecast.
+    "gen1": DeviceCodecs(
+        video=(VideoSupport("h264", _H264_PROFILES, _8BIT, 41, 1080, 30),),
+        audio=_AUDIO),
+    "gen3": DeviceCodecs(
+        video=(VideoSupport("h264", _H264_PROFILES, _8BIT, 42, 1080, 60),),
+        audio=_AUDIO),
+    "ultra": DeviceCodecs(
+        video=(VideoSupport("h264", _H264_PROFILES, _8BIT, 42, 1080, 60),
+               VideoSupport("hevc", _HEVC_PROFILES, _10BIT, 153, 2160, 60),
+               VideoSupport("vp9", _VP9_PROFILES, _10BIT, None, 2160, 60)),
+        audio=_AUDIO),
+    "google-tv": DeviceCodecs(
+        video=(VideoSupport("h264", _H264_PROFILES, _8BIT, 51, 2160, 30),
+               VideoSupport("hevc", _HEVC_PROFILES, _10BIT, 153, 2160, 60),
+               VideoSupport("vp9", _VP9_PROFILES, _10BIT, None, 2160, 60)),
+        audio=_AUDIO),
+}
+
+# What the fragmented mp4 that we stream can hold.
+_MP4_VIDEO = frozenset({"h264", "hevc", "vp9"})
+_MP4_AUDIO = frozenset({"aac", "mp3", "opus", "flac"})
+# What the MPEG-TS segments of HLS can hold, for Google Cast devices.
+_MPEGTS_VIDEO = frozenset({"h264"})
+_MPEGTS_AUDIO = frozenset({"aac", "mp3"})
+# Audio codecs that older ffmpeg only puts in mp4 with -strict experimental.
+EXPERIMENTAL_MP4_AUDIO = frozenset({"opus", "flac"})
+
+# The video and audio codecs of each container that we stream, by the ffmpeg
+# format name.
+_CONTAINERS = {
+    "mp4": (_MP4_VIDEO, _MP4_AUDIO),
+    "mpegts": (_MPEGTS_VIDEO, _MPEGTS_AUDIO),
+}
+
+
+def _is_in(info: MediaInfo, container: str) -> bool:
+    return container in (info.format_name or "").split(",")
+
+
+def video_action(info: MediaInfo,
+                 stream: StreamInfo,
+                 generation: str = constants.DEFAULT_DEVICE_GENERATION,
+                 container: str = "mp4",
+                 ) -> Action:
+    device = DEVICE_CODECS[generation]
+    if (stream.codec_name not in _CONTAINERS[container][0]
+            or not any(support.decodes(stream) for support in device.video)):
+        return Action.TRANSCODE
+    return Action.COPY if _is_in(info, container) else Action.REMUX
+
+
+def audio_action(info: MediaInfo,
+                 stream: StreamInfo,
+                 generation: str = constants.DEFAULT_DEVICE_GENERATION,
+                 container: str = "mp4",
+                 ) -> Action:
+    device = DEVICE_CODECS[generation]
+    if (stream.codec_name not in _CONTAINERS[container][1]
+            or stream.codec_name not in device.audio
+            or (stream.channels or 2) > 2):
+        return Action.TRANSCODE
+    return Action.COPY if _is_in(info, container) else Action.REMUX
+
+
+def describe(info: MediaInfo,
+             generation: str = constants.DEFAULT_DEVICE_GENERATION) -> str:
+    """Describes what happens to the default streams, as in "h264: copy"."""
+    parts = []
+    if info.video is not None:
+        action = video_action(info, info.video, generation)
+        parts.append(f"video {info.video.codec_name}: {action.value}")
+    if info.audio is not None:
+        action = audio_action(info, info.audio, generation)
+        parts.append(f"audio {info.audio.codec_name}: {action.value}")
+    return ", ".join(parts) or "no streams"
@@ -21,18 +21,36 @@ SEARCH_AT_LAUNCH = "search_at_launch"
 ALSA_DEVICE = "alsa_device"
 
 
-def _default_config_path(platform: str) -> pathlib.Path:
-    config_dir: pathlib.PurePath
+def config_dir(platform: str) -> pathlib.Path:
+    """Returns the directory for mkchromecast configuration and state."""
+    directory: pathlib.PurePath
     if platform == "Darwin":
-        config_dir = pathlib.PosixPath(
+        directory = pathlib.PosixPath(
             "~/Library/Application Support/mkchromecast")
     else:  # Linux
         xdg_config_home = pathlib.PosixPath(
             os.environ.get("XDG_CONFIG_HOME", "~/.config"))
-        config_dir = xdg_config_home / "mkchromecast"
+        directory = xdg_config_home / "mkchromecast"
+
+    return directory.expanduser()
+
 
+def cache_dir(platform: str) -> pathlib.Path:
+    """Returns the directory for files that mkchromecast can recreate."""
+    directory: pathlib.PurePath
+    if platform == "Darwin":
+        directory = pathlib.PosixPath("~/Library/Caches/mkchromecast")
+    else:  # Linux
+        xdg_cache_home = pathlib.PosixPath(
+            os.environ.get("XDG_CACHE_HOME", "~/.cache"))
+        directory = xdg_cache_home / "mkchromecast"
+
+    return directory.expanduser()
+
+
+def _default_config_path(platform: str) -> pathlib.Path:
     # TODO(xsdg): Switch this back to mkchromecast.cfg.
-    config_path = (config_dir / "mkchromecast_beta.cfg").expanduser()
+    config_path = config_dir(platform) / "mkchromecast_beta.cfg"
 
     print(f":::config::: WARNING: USING BETA CONFIG PATH: {config_path}")
     return config_path
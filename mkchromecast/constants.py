@@ -1,7 +1,8 @@
 # This file is part of mkchromecast.
 
+from dataclasses import dataclass
 import enum
-from typing import List
+from typing import List, Optional
 
 
 @enum.unique
@@ -34,8 +35,8 @@ def sample_rates_for_codec(codec: str) -> List[int]:
 
 DARWIN_BACKENDS = ["node", "ffmpeg"]
 LINUX_VIDEO_BACKENDS = ["node", "ffmpeg"]
-LINUX_BACKENDS = ["ffmpeg", "parec"]
-ALL_BACKENDS = ["node", "ffmpeg", "parec"]
+LINUX_BACKENDS = ["ffmpeg", "parec", "pyav"]
+ALL_BACKENDS = ["node", "ffmpeg", "parec", "pyav"]
 
 def backend_options_for_platform(platform: str, video: bool = False):
     if platform == "Darwin":
@@ -47,7 +48,59 @@ def backend_options_for_platform(platform: str, video: bool = False):
     return LINUX_BACKENDS
 
 
+STREAM_SERVERS = ["flask", "zerocopy", "asyncio"]
+
+# HLS segments are MPEG-TS, which Google Cast devices play with these audio
+# codecs.
+HLS_CODECS = ["aac", "mp3"]
+# Seconds per segment, unless --segment-time is set.
+HLS_SEGMENT_TIME = 2
+# Segments listed in the live playlist.  ffmpeg deletes older ones, so at
+# most a few more than these are stored.
+HLS_LIST_SIZE = 6
+
+
+@dataclass(frozen=True)
+class LatencyProfile:
+    """Trades latency against efficiency along the audio chain."""
+    # How much audio the capture device buffers, or None to derive the buffer
+    # from --chunk-size.
+    capture_ms: Optional[int]
+    # Whether ffmpeg skips input probing and flushes every packet.
+    low_delay: bool
+    # Target latency for adaptive pipeline reads, or None for fixed read sizes.
+    read_latency_ms: Optional[int]
+    # How much encoded audio a prewarmed pipeline sends to new clients.
+    backlog_ms: int
+
+
+LATENCY_PROFILES = {
+    "low": LatencyProfile(capture_ms=10,
+                          low_delay=True,
+                          read_latency_ms=20,
+                          backlog_ms=100),
+    "balanced": LatencyProfile(capture_ms=None,
+                               low_delay=False,
+                               read_latency_ms=None,
+                               backlog_ms=300),
+    "throughput": LatencyProfile(capture_ms=100,
+                                 low_delay=False,
+                                 read_latency_ms=250,
+                                 backlog_ms=1000),
+}
+
+# Google Cast device generations, by what they decode; see codec_support.
+DEVICE_GENERATIONS = ["gen1", "gen3", "ultra", "google-tv"]
+DEFAULT_DEVICE_GENERATION = "gen3"
+
+# The share of the cores that a libx264 video encode may use.
+VIDEO_CPU_BUDGET = 0.75
+
 DEFAULT_BITRATE = 192
+# Codecs whose streams can be joined midway.  Late joiners are sent the stream
+# header first, and then the stream from a frame boundary; see
+# stream_infra.framer_for_codec.
+JOINABLE_CODECS = ["mp3", "aac", "ogg", "opus", "wav", "flac"]
 CODECS_WITH_BITRATE = ["aac", "mp3", "ogg", "opus"]
 # TODO(xsdg): Reverse how this is defined.
 ALL_CODECS = QUANTIZED_SAMPLE_RATE_CODECS
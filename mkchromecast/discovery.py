@@ -0,0 +1,311 @@
+# This file is part of mkchromecast.
+
+"""Google Cast device discovery, backed by a cache of known devices.
+
+A single zeroconf browser runs for the lifetime of the process and keeps the
+cache up to date in the background.  The cache is also saved to disk, so that a
+new process can list the known devices without waiting for mDNS.
+"""
+
+import atexit
+import dataclasses
+import json
+import os
+import pathlib
+import threading
+import time
+import uuid
+from typing import Optional
+
+from mkchromecast import colors
+from mkchromecast import config
+
+has_chromecast: bool
+try:
+    import pychromecast
+    import zeroconf
+
+    has_chromecast = True
+except ImportError:
+    has_chromecast = False
+
+# How long to wait for the first device when nothing is cached, and how long to
+# keep listening for more devices once the first one has shown up.
+DISCOVERY_TIMEOUT = 5.0
+DISCOVERY_SETTLE_TIME = 1.0
+# How long to wait for a cached device to answer at its last known address.
+CONNECT_TIMEOUT = 3.0
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedDevice:
+    """What we need to know to connect to a Google Cast device."""
+    name: str
+    host: str
+    port: int
+    uuid: str
+    model_name: Optional[str] = None
+
+
+def _default_cache_path(platform: str) -> pathlib.Path:
+    return config.config_dir(platform) / "devices.json"
+
+
+class DeviceCache:
+    """The known devices by name, in memory and on disk.
+
+    This is safe to use from several threads.
+    """
+
+    def __init__(self, path: os.PathLike, debug: bool = False):
+        self._path = pathlib.Path(path)
+        self._debug = debug
+        self._lock = threading.Lock()
+        self._devices: dict[str, CachedDevice] = {}
+
+    def load(self) -> None:
+        """Loads the devices that were saved to disk, if any."""
+        try:
+            with open(self._path) as cache_file:
+                entries = json.load(cache_file)
+            devices = {entry["name"]: CachedDevice(**entry)
+                       for entry in entries}
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            # A corrupt cache is no worse than an empty one.
+            if self._debug:
+                print(f":::discovery::: Ignoring device cache: {e}")
+            return
+
+        with self._lock:
+            self._devices = devices
+
+    def save(self) -> None:
+        with self._lock:
+            entries = [dataclasses.asdict(device)
+                       for device in self._devices.values()]
+
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # Writes a new file and moves it into place, so that a concurrent
+            # reader never sees a partial cache.
+            tmp_path = self._path.with_name(f".{self._path.name}.{os.getpid()}")
+            with open(tmp_path, "w") as cache_file:
+                json.dump(entries, cache_file, indent=2)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            if self._debug:
+                print(f":::discovery::: Couldn't save device cache: {e}")
+
+    def get(self, name: str) -> Optional[CachedDevice]:
+        with self._lock:
+            return self._devices.get(name)
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return sorted(self._devices)
+
+    def update(self, device: CachedDevice) -> bool:
+        """Adds or replaces a device.  Returns whether anything changed."""
+        with self._lock:
+            if self._devices.get(device.name) == device:
+                return False
+            # A device that was renamed keeps its uuid.
+            for name, known in list(self._devices.items()):
+                if known.uuid == device.uuid:
+                    del self._devices[name]
+            self._devices[device.name] = device
+            return True
+
+    def remove(self, name: str) -> bool:
+        """Forgets a device.  Returns whether it was known."""
+        with self._lock:
+            return self._devices.pop(name, None) is not None
+
+
+class DeviceBrowser:
+    """Keeps browsing for Google Cast devices in the background.
+
+    Devices that the browser finds or loses are written through to the cache.
+    """
+
+    def __init__(self, cache: DeviceCache, debug: bool = False):
+        self._cache = cache
+        self._debug = debug
+
+        self._lock = threading.Lock()
+        self._found = threading.Condition(self._lock)
+        self._cast_browser = None
+        self._zconf = None
+        # The uuids of the devices that the running browser has seen.
+        self._live: set[str] = set()
+
+    def start(self) -> None:
+        """Starts browsing, unless that's already happening."""
+        with self._lock:
+            if self._cast_browser is not None:
+                return
+
+            self._zconf = zeroconf.Zeroconf()
+            listener = pychromecast.discovery.SimpleCastListener(
+                add_callback=self._on_update,
+                remove_callback=self._on_remove,
+                update_callback=self._on_update)
+            self._cast_browser = pychromecast.discovery.CastBrowser(
+                listener, self._zconf)
+            self._cast_browser.start_discovery()
+            atexit.register(self.stop)
+
+    def stop(self) -> None:
+        with self._lock:
+            cast_browser, self._cast_browser = self._cast_browser, None
+            zconf, self._zconf = self._zconf, None
+
+        if cast_browser is not None:
+            cast_browser.stop_discovery()
+        if zconf is not None:
+            zconf.close()
+
+    def device_names(self, timeout: float = DISCOVERY_TIMEOUT) -> list[str]:
+        """Returns the names of the known devices.
+
+        This only waits for the network when the cache is empty, in which case
+        it returns shortly after the first device is found, or after `timeout`
+        seconds.  Devices that the browser has seen come first, so that the
+        first name is one that is likely to answer.
+        """
+        if not self._cache.names():
+            with self._found:
+                found = self._found.wait_for(lambda: self._live,
+                                             timeout=timeout)
+            if found:
+                # Gives the other devices a chance to answer too.
+                time.sleep(DISCOVERY_SETTLE_TIME)
+
+        with self._lock:
+            live = set(self._live)
+
+        def is_cached_only(name: str) -> bool:
+            device = self._cache.get(name)
+            return device is None or device.uuid not in live
+
+        # The sort is stable, so both groups stay sorted by name.
+        return sorted(self._cache.names(), key=is_cached_only)
+
+    def cast_info(self, name: str, timeout: float = DISCOVERY_TIMEOUT):
+        """Returns the live CastInfo for the named device, or None.
+
+        Waits up to `timeout` seconds for the browser to find the device.
+        """
+        def find():
+            if self._cast_browser is None:
+                return None
+            for cast_info in list(self._cast_browser.devices.values()):
+                if cast_info.friendly_name == name:
+                    return cast_info
+            return None
+
+        with self._found:
+            self._found.wait_for(find, timeout=timeout)
+            return find()
+
+    def get_chromecast(self,
+                       name: str,
+                       tries: Optional[int] = None,
+                       timeout: float = DISCOVERY_TIMEOUT):
+        """Returns a Chromecast for the named device, or None if not found.
+
+        A device that the browser hasn't seen yet, but which is in the cache,
+        is first tried at its last known address.  Discovery is only waited
+        for if that doesn't work.
+        """
+        cast_info = self.cast_info(name, timeout=0)
+        if cast_info is None:
+            cached = self._cache.get(name)
+            if cached is not None:
+                cast = self._connect_cached(cached, tries)
+                if cast is not None:
+                    return cast
+
+            cast_info = self.cast_info(name, timeout=timeout)
+            if cast_info is None:
+                return None
+
+        return pychromecast.get_chromecast_from_cast_info(
+            cast_info, self._zconf, tries=tries)
+
+    def _connect_cached(self, device: CachedDevice, tries: Optional[int]):
+        """Connects to a device at its cached address, or returns None."""
+        start = time.monotonic()
+        cast = pychromecast.get_chromecast_from_host(
+            (device.host, device.port, uuid.UUID(device.uuid),
+             device.model_name, device.name),
+            tries=tries,
+            timeout=CONNECT_TIMEOUT)
+        try:
+            cast.wait(timeout=CONNECT_TIMEOUT)
+        except pychromecast.error.RequestTimeout:
+            if self._debug:
+                print(f":::discovery::: {device.name} didn't answer at "
+                      f"{device.host}:{device.port}")
+            cast.disconnect(blocking=False)
+            return None
+
+        if self._debug:
+            print(f":::discovery::: Connected to {device.name} at its cached "
+                  f"address in {time.monotonic() - start:.2f}s")
+        return cast
+
+    def forget(self, name: str) -> None:
+        """Removes a device that couldn't be found from the cache."""
+        if self._cache.remove(name):
+            self._cache.save()
+
+    def _on_update(self, device_uuid, service: Optional[str] = None) -> None:
+        cast_info = self._cast_browser.devices.get(device_uuid)
+        if cast_info is None:
+            return
+
+        device = CachedDevice(name=cast_info.friendly_name,
+                              host=cast_info.host,
+                              port=cast_info.port,
+                              uuid=str(device_uuid),
+                              model_name=cast_info.model_name)
+        if self._cache.update(device):
+            if self._debug:
+                print(f":::discovery::: Found {device}")
+            self._cache.save()
+
+        with self._found:
+            self._live.add(str(device_uuid))
+            self._found.notify_all()
+
+    def _on_remove(self, device_uuid, service: Optional[str], cast_info) -> None:
+        with self._found:
+            self._live.discard(str(device_uuid))
+
+        if self._cache.remove(cast_info.friendly_name):
+            if self._debug:
+                print(f":::discovery::: Lost {cast_info.friendly_name}")
+            self._cache.save()
+
+
+_browser: Optional[DeviceBrowser] = None
+_browser_lock = threading.Lock()
+
+
+def get_browser(platform: str, debug: bool = False) -> DeviceBrowser:
+    """Returns the process-wide DeviceBrowser, starting it if needed."""
+    global _browser
+    with _browser_lock:
+        if _browser is None:
+            cache = DeviceCache(_default_cache_path(platform), debug=debug)
+            cache.load()
+            if debug:
+                print(colors.options("Cached devices:")
+                      + f" {', '.join(cache.names()) or 'none'}")
+            _browser = DeviceBrowser(cache, debug=debug)
+
+    _browser.start()
+    return _browser
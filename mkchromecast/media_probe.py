@@ -0,0 +1,368 @@
+# This file is part of mkchromecast.
+
+"""Probes media files with ffprobe, backed by a cache of the results.
+
+Results are keyed by the path, size and modification time of the file, so a
+file that changes is probed again.  The cache is also saved to disk, so that
+casting the same file from a new process doesn't run ffprobe either.
+
+media_info returns everything that casting decisions need about a file, from a
+single probe.
+"""
+
+from dataclasses import dataclass
+from fractions import Fraction
+import json
+import mimetypes
+import os
+import pathlib
+import platform as platform_module
+import subprocess
+import threading
+from typing import Any, Optional
+
+from mkchromecast import config
+
+# How many files the cache remembers.  The least recently used are dropped.
+MAX_CACHED_FILES = 500
+
+
+def _default_cache_path(platform: str) -> pathlib.Path:
+    return config.config_dir(platform) / "probes.json"
+
+
+def run_ffprobe(name: str) -> dict[str, Any]:
+    """Returns the format and streams of a media file, as ffprobe reports them.
+
+    Raises:
+        ValueError: ffprobe couldn't read the file.
+    """
+    command = [
+        "ffprobe",
+        "-show_format",
+        "-show_streams",
+        "-loglevel", "quiet",
+        "-print_format", "json",
+        name,
+    ]
+
+    info = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    info_out, info_error = info.communicate()
+    # ffprobe still prints "{}" for a file it can't read.
+    if info.returncode != 0:
+        raise ValueError(f"ffprobe couldn't read {name} "
+                         f"(exit status {info.returncode})")
+    return json.loads(info_out)
+
+
+class ProbeCache:
+    """The ffprobe results by path, in memory and on disk.
+
+    This is safe to use from several threads.
+    """
+
+    def __init__(self,
+                 path: os.PathLike,
+                 max_files: int = MAX_CACHED_FILES,
+                 debug: bool = False):
+        self._path = pathlib.Path(path)
+        self._max_files = max_files
+        self._debug = debug
+        self._lock = threading.Lock()
+        # Entries hold the size, mtime and result, least recently used first.
+        self._entries: dict[str, dict[str, Any]] = {}
+
+    def load(self) -> None:
+        """Loads the results that were saved to disk, if any."""
+        try:
+            with open(self._path) as cache_file:
+                entries = json.load(cache_file)
+            if not isinstance(entries, dict):
+                raise ValueError("not a JSON object")
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            # A corrupt cache is no worse than an empty one.
+            if self._debug:
+                print(f":::media_probe::: Ignoring probe cache: {e}")
+            return
+
+        with self._lock:
+            self._entries = entries
+
+    def save(self) -> None:
+        with self._lock:
+            entries = dict(self._entries)
+
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # Writes a new file and moves it into place, so that a concurrent
+            # reader never sees a partial cache.
+            tmp_path = self._path.with_name(f".{self._path.name}.{os.getpid()}")
+            with open(tmp_path, "w") as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            if self._debug:
+                print(f":::media_probe::: Couldn't save probe cache: {e}")
+
+    def get(self, path: str, stat: os.stat_result) -> Optional[dict[str, Any]]:
+        """Returns the cached result for the file, unless it has changed."""
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is None:
+                return None
+            if (entry.get("size") != stat.st_size
+                    or entry.get("mtime_ns") != stat.st_mtime_ns):
+                return None
+            # Marks the file as the most recently used.
+            self._entries[path] = entry
+            return entry.get("info")
+
+    def put(self,
+            path: str,
+            stat: os.stat_result,
+            info: dict[str, Any]) -> None:
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = {"size": stat.st_size,
+                                   "mtime_ns": stat.st_mtime_ns,
+                                   "info": info}
+            while len(self._entries) > self._max_files:
+                del self._entries[next(iter(self._entries))]
+
+    def probe(self, name: str) -> dict[str, Any]:
+        """Returns what ffprobe reports for a file, running it only if needed.
+
+        Anything that isn't a local file, like a URL, is always probed.  Files
+        that ffprobe can't read aren't cached, so they are probed again.
+
+        Raises:
+            OSError: ffprobe couldn't be run.
+            ValueError: ffprobe couldn't read the file.
+        """
+        try:
+            path = os.path.abspath(name)
+            stat = os.stat(path)
+        except OSError:
+            return run_ffprobe(name)
+
+        info = self.get(path, stat)
+        if info is not None:
+            if self._debug:
+                print(f":::media_probe::: Cached probe for {path}")
+            return info
+
+        info = run_ffprobe(name)
+        self.put(path, stat, info)
+        self.save()
+        return info
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _frame_rate(value: Any) -> Optional[float]:
+    """Parses an ffprobe frame rate like "30000/1001"; "0/0" is unknown."""
+    try:
+        rate = Fraction(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return float(rate) if rate > 0 else None
+
+
+# Transfer characteristics of HDR video.
+_HDR_TRANSFERS = {"smpte2084": "HDR10", "arib-std-b67": "HLG"}
+
+
+@dataclass(frozen=True)
+class StreamInfo:
+    """A video, audio or subtitle stream of a media file."""
+    # The index of the stream in the file, as used by `-map 0:<index>`.
+    index: int
+    codec_type: str
+    codec_name: Optional[str] = None
+    profile: Optional[str] = None
+    level: Optional[int] = None
+    bit_rate: Optional[int] = None
+    duration: Optional[float] = None
+    language: Optional[str] = None
+
+    # Video.
+    pix_fmt: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    color_transfer: Optional[str] = None
+    color_primaries: Optional[str] = None
+    dolby_vision: bool = False
+
+    # Audio.
+    channels: Optional[int] = None
+    sample_rate: Optional[int] = None
+
+    @property
+    def hdr_format(self) -> Optional[str]:
+        """Returns "Dolby Vision", "HDR10" or "HLG" for HDR video, or None."""
+        if self.dolby_vision:
+            return "Dolby Vision"
+        return _HDR_TRANSFERS.get(self.color_transfer or "")
+
+    @classmethod
+    def from_ffprobe(cls, stream: dict[str, Any]) -> "StreamInfo":
+        side_data = stream.get("side_data_list") or []
+        # ffprobe reports -99 when it doesn't know.
+        level = _int(stream.get("level"))
+        return cls(
+            index=int(stream["index"]),
+            codec_type=stream.get("codec_type", "data"),
+            codec_name=stream.get("codec_name"),
+            profile=stream.get("profile"),
+            level=level if level != -99 else None,
+            bit_rate=_int(stream.get("bit_rate")),
+            duration=_float(stream.get("duration")),
+            language=(stream.get("tags") or {}).get("language"),
+            pix_fmt=stream.get("pix_fmt"),
+            width=_int(stream.get("width")),
+            height=_int(stream.get("height")),
+            fps=(_frame_rate(stream.get("avg_frame_rate"))
+                 or _frame_rate(stream.get("r_frame_rate"))),
+            color_transfer=stream.get("color_transfer"),
+            color_primaries=stream.get("color_primaries"),
+            dolby_vision=any(
+                data.get("side_data_type") == "DOVI configuration record"
+                for data in side_data),
+            channels=_int(stream.get("channels")),
+            sample_rate=_int(stream.get("sample_rate")),
+        )
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """What ffprobe reports about a media file."""
+    format_name: Optional[str]
+    duration: Optional[float]
+    bit_rate: Optional[int]
+    streams: tuple[StreamInfo, ...]
+
+    def _streams_of(self, codec_type: str) -> list[StreamInfo]:
+        return [stream for stream in self.streams
+                if stream.codec_type == codec_type]
+
+    @property
+    def video_streams(self) -> list[StreamInfo]:
+        # Cover art is reported as a video stream too.
+        return [stream for stream in self._streams_of("video")
+                if stream.codec_name not in ("mjpeg", "png")]
+
+    @property
+    def audio_streams(self) -> list[StreamInfo]:
+        return self._streams_of("audio")
+
+    @property
+    def subtitle_streams(self) -> list[StreamInfo]:
+        return self._streams_of("subtitle")
+
+    @property
+    def video(self) -> Optional[StreamInfo]:
+        """The first video stream, which ffmpeg picks by default."""
+        streams = self.video_streams
+        return streams[0] if streams else None
+
+    @property
+    def audio(self) -> Optional[StreamInfo]:
+        """The first audio stream, which ffmpeg picks by default."""
+        streams = self.audio_streams
+        return streams[0] if streams else None
+
+    @classmethod
+    def from_ffprobe(cls, info: dict[str, Any]) -> "MediaInfo":
+        media_format = info.get("format") or {}
+        return cls(
+            format_name=media_format.get("format_name"),
+            duration=_float(media_format.get("duration")),
+            bit_rate=_int(media_format.get("bit_rate")),
+            streams=tuple(StreamInfo.from_ffprobe(stream)
+                          for stream in info.get("streams") or []),
+        )
+
+
+_cache: Optional[ProbeCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(platform: Optional[str] = None) -> ProbeCache:
+    """Returns the process-wide ProbeCache, loading it if needed."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProbeCache(
+                _default_cache_path(platform or platform_module.system()))
+            _cache.load()
+    return _cache
+
+
+def probe(name: str) -> dict[str, Any]:
+    """Returns what ffprobe reports for a file, using the process-wide cache."""
+    return get_cache().probe(name)
+
+
+def media_info(name: str) -> MediaInfo:
+    """Returns the MediaInfo for a file, using the process-wide cache.
+
+    Raises:
+        OSError: ffprobe couldn't be run.
+        ValueError: ffprobe couldn't read the file.
+    """
+    return MediaInfo.from_ffprobe(probe(name))
+
+
+# The MIME types of the containers that ffprobe names, in its format names.
+_MEDIA_TYPES = {
+    "mp4": "video/mp4",
+    "matroska": "video/x-matroska",
+    "webm": "video/webm",
+    "mpegts": "video/mp2t",
+    "avi": "video/x-msvideo",
+    "mp3": "audio/mpeg",
+    "flac": "audio/flac",
+    "ogg": "audio/ogg",
+    "wav": "audio/wav",
+}
+
+
+def media_type(name: str) -> str:
+    """Returns the MIME type of a media file, from the container it's probed in.
+
+    Files that can't be probed get the type of their extension.
+    """
+    try:
+        info = media_info(name)
+    except (OSError, ValueError):
+        info = None
+
+    if info is not None:
+        formats = (info.format_name or "").split(",")
+        # Matroska and WebM files are both probed as "matroska,webm".
+        if "webm" in formats and name.lower().endswith(".webm"):
+            return "video/webm"
+        for format_name in formats:
+            if format_name not in _MEDIA_TYPES:
+                continue
+            if format_name == "mp4" and info.video is None:
+                return "audio/mp4"
+            return _MEDIA_TYPES[format_name]
+
+    guessed, _ = mimetypes.guess_type(name)
+    return guessed or "application/octet-stream"
@@ -12,24 +12,21 @@ To call them:
 
 import multiprocessing
 import os
-import pickle
-import psutil
-import time
 import re
 import sys
 import signal
 import subprocess
 
 import mkchromecast
-from mkchromecast.audio_devices import inputint, outputint
 from mkchromecast import colors
 from mkchromecast import constants
+from mkchromecast import stream_infra
 from mkchromecast import utils
 from mkchromecast.cast import Casting
 from mkchromecast.constants import OpMode
 
 
-def streaming(mkcc: mkchromecast.Mkchromecast):
+def streaming(mkcc: mkchromecast.Mkchromecast, parent_pid: int):
     print(colors.options("Selected backend:") + " " + mkcc.backend)
 
     if mkcc.debug is True:
@@ -84,35 +81,14 @@ def streaming(mkcc: mkchromecast.Mkchromecast):
         if mkcc.debug is True:
             print(":::node::: node command: %s." % webcast)
 
-        f = open("/tmp/mkchromecast.pid", "rb")
-        pidnumber = int(pickle.load(f))
-        print(colors.options("PID of main process:") + " " + str(pidnumber))
-
-        localpid = os.getpid()
-        print(colors.options("PID of streaming process: ") + str(localpid))
-
-        while p.poll() is None:
-            try:
-                time.sleep(0.5)
-                # With this I ensure that if the main app fails, everything
-                # will get back to normal
-                if psutil.pid_exists(pidnumber) is False:
-                    inputint()
-                    outputint()
-                    parent = psutil.Process(localpid)
-                    # or parent.children() for recursive=False
-                    for child in parent.children(recursive=True):
-                        child.kill()
-                    parent.kill()
-            except KeyboardInterrupt:
-                print("Ctrl-c was requested")
-                sys.exit(0)
-            except IOError:
-                print("I/O Error")
-                sys.exit(0)
-            except OSError:
-                print("OSError")
-                sys.exit(0)
+        # Restores the audio devices if the main app fails.
+        stream_infra.ParentMonitor(mkcc.platform, parent_pid).start()
+
+        try:
+            p.wait()
+        except KeyboardInterrupt:
+            print("Ctrl-c was requested")
+            sys.exit(0)
         else:
             print(colors.warning("Reconnecting node streaming..."))
             if mkcc.platform == "Darwin" and mkcc.notifications:
@@ -158,7 +134,8 @@ def streaming(mkcc: mkchromecast.Mkchromecast):
 class multi_proc(object):
     def __init__(self):
         self._mkcc = mkchromecast.Mkchromecast()
-        self.proc = multiprocessing.Process(target=streaming, args=(self._mkcc,))
+        self.proc = multiprocessing.Process(target=streaming,
+                                            args=(self._mkcc, os.getpid()))
         self.proc.daemon = False
 
     def start(self):
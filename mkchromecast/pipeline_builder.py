@@ -5,15 +5,46 @@ import os
 from typing import Optional, Union
 
 import mkchromecast
+from mkchromecast import codec_support
 from mkchromecast import colors
 from mkchromecast import constants
+from mkchromecast import media_probe
 from mkchromecast import resolution
+from mkchromecast import segment_store
 from mkchromecast import stream_infra
-from mkchromecast import utils
 from mkchromecast.constants import OpMode
 
 SubprocessCommand = Union[list[str], str, os.PathLike]
 
+
+def hls_output_args(store: segment_store.SegmentStore,
+                    segment_time: Optional[int]) -> list[str]:
+    """Returns the output args that write HLS segments into the store.
+
+    ffmpeg deletes the segments that drop out of the live playlist.
+    """
+    return ["-f", "hls",
+            "-hls_time", str(segment_time or constants.HLS_SEGMENT_TIME),
+            "-hls_list_size", str(constants.HLS_LIST_SIZE),
+            "-hls_flags", "delete_segments+independent_segments+temp_file",
+            "-hls_segment_type", "mpegts",
+            "-hls_segment_filename", store.segment_pattern,
+            str(store.playlist)]
+
+
+def capture_fragment_size(chunk_size: int,
+                          capture_ms: Optional[int] = None) -> int:
+    """Returns how many bytes the audio capture device should buffer.
+
+    Without `capture_ms`, this is derived from --chunk-size.
+    """
+    if capture_ms is None:
+        return 32 * chunk_size
+
+    # The capture is 16-bit stereo at 44.1kHz.
+    return 44100 * 4 * capture_ms // 1000
+
+
 @dataclass
 class EncodeSettings:
     codec: str
@@ -23,6 +54,10 @@ class EncodeSettings:
     samplerate: str
     segment_time: Optional[int]
     ffmpeg_debug: bool = False
+    # Skips input probing and output buffering; see LatencyProfile.
+    low_delay: bool = False
+    # When set, the audio is written to this store as HLS segments.
+    hls_store: Optional[segment_store.SegmentStore] = None
 
 
 class Audio:
@@ -56,6 +91,9 @@ class Audio:
             elif self._backend.name == "parec":
                 return self._build_linux_other_command()
 
+            elif self._backend.name == "pyav":
+                return self._build_pyav_capture_command()
+
             else:
                 raise Exception(f"Unsupported backend: {self._backend.name}")
 
@@ -66,11 +104,13 @@ class Audio:
         pulse or alsa.
         """
         if self._platform == "Darwin":
-            return ["-f", "avfoundation", "-i", ":BlackHole 16ch"]
+            return [*self._low_delay_input_flags(),
+                    "-f", "avfoundation", "-i", ":BlackHole 16ch"]
         else:  # platform == "Linux"
             # NOTE(xsdg): Warning on console:
             # [Pulse indev @ 0x564d070e7440] The "frame_size" option is deprecated: set number of bytes per frame
             cmd: list[str] = [
+                *self._low_delay_input_flags(),
                 "-ac", "2",
                 "-ar", "44100",
                 "-frame_size", str(self._settings.frame_size),
@@ -84,6 +124,16 @@ class Audio:
 
             return cmd
 
+    def _low_delay_input_flags(self) -> list[str]:
+        """Returns input flags that stop ffmpeg from buffering the capture."""
+        if not self._settings.low_delay:
+            return []
+
+        # Capture devices have a fixed format, so there's nothing to probe.
+        return ["-fflags", "nobuffer",
+                "-probesize", "32",
+                "-analyzeduration", "0"]
+
     def _build_ffmpeg_command(self) -> list[str]:
         fmt = self._settings.codec
         # Special case: the ffmpeg format for AAC is ADTS
@@ -106,7 +156,10 @@ class Audio:
         # determine if this was just a copy-paste error or if there's an
         # underlying motivation for which of these don't use segment_time.
         maybe_segment_cmd: list[str]
-        if self._settings.segment_time and (
+        if self._settings.hls_store is not None:
+            # The HLS muxer does the segmenting.
+            maybe_segment_cmd = []
+        elif self._settings.segment_time and (
             (self._platform == "Darwin" and fmt != "ogg") or
             (self._platform == "Linux" and fmt != "adts")):
             maybe_segment_cmd = [
@@ -124,19 +177,53 @@ class Audio:
         else:  # fmt != "adts" or bool(segment_time) == False
             maybe_cutoff_cmd = []
 
+        # Writes every packet as soon as it is encoded.
+        maybe_flush_cmd: list[str] = (
+            ["-flush_packets", "1"] if self._settings.low_delay else []
+        )
+
+        format_cmd: list[str] = ["-f", fmt]
+        output_cmd: list[str] = ["pipe:"]
+        if self._settings.hls_store is not None:
+            format_cmd = []
+            output_cmd = hls_output_args(self._settings.hls_store,
+                                         self._settings.segment_time)
+
         return [self._backend.path,
                 *maybe_debug_cmd,
                 *self._input_command(),
                 *maybe_segment_cmd,
-                "-f", fmt,
+                *format_cmd,
                 "-acodec", self._ffmpeg_fmt_to_acodec[fmt],
                 "-ac", "2",
                 "-ar", self._settings.samplerate,
                 *maybe_bitrate_cmd,
                 *maybe_cutoff_cmd,
-                "pipe:",
+                *maybe_flush_cmd,
+                *output_cmd,
         ]
 
+    @property
+    def pyav_output(self) -> stream_infra.PyAVOutput:
+        """How the pyav backend encodes the audio that `command` captures."""
+        fmt = "adts" if self._settings.codec == "aac" else self._settings.codec
+        bitrate: Optional[int] = None
+        if self._settings.codec in constants.CODECS_WITH_BITRATE:
+            bitrate = self._settings.bitrate
+        return stream_infra.PyAVOutput(
+            format=fmt,
+            codec=self._ffmpeg_fmt_to_acodec[fmt],
+            samplerate=int(self._settings.samplerate),
+            bitrate=bitrate)
+
+    def _build_pyav_capture_command(self) -> list[str]:
+        # PyAVPipeline expects this sample format.
+        return ["parec",
+                "--format=s16le",
+                "--channels=2",
+                f"--rate={stream_infra.PyAVPipeline.CAPTURE_RATE}",
+                "-d", "Mkchromecast.monitor"]
+
     def _build_linux_other_command(self) -> list[str]:
         if self._settings.codec == "mp3":
             return ["lame",
@@ -207,6 +294,106 @@ def is_mkv(filename: str) -> bool:
     return filename.endswith("mkv")
 
 
+def cpu_cores() -> int:
+    """Returns how many cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def video_size(res: Optional[str]) -> tuple[int, int]:
+    """Returns the width and height for a --resolution, defaulting to 1080p."""
+    size = resolution.resolutions[(res or "1080p").lower()][1]
+    width, height = size.rstrip(":").split("x")
+    return int(width), int(height)
+
+
+@dataclass(frozen=True)
+class X264Settings:
+    """How libx264 spreads an encode over the available cores."""
+    preset: str
+    threads: int
+    # Slices are encoded in parallel within a frame, which adds no latency.
+    # Otherwise, x264 encodes several frames in parallel.
+    slices: int
+    lookahead: int
+    # What the settings were chosen for.
+    width: int
+    height: int
+    fps: float
+    cores: int
+
+    @property
+    def args(self) -> list[str]:
+        params = [f"rc-lookahead={self.lookahead}"]
+        if self.slices > 1:
+            params += ["sliced-threads=1", f"slices={self.slices}"]
+        else:
+            params.append("sliced-threads=0")
+        return ["-preset", self.preset,
+                "-threads", str(self.threads),
+                "-x264-params", ":".join(params)]
+
+    def __str__(self) -> str:
+        return (f"libx264 preset={self.preset} threads={self.threads} "
+                f"slices={self.slices} lookahead={self.lookahead} for "
+                f"{self.width}x{self.height}@{self.fps:g}fps on "
+                f"{self.cores} cores")
+
+
+# Rough single-core libx264 throughput per preset, in megapixels per second,
+# from the fastest preset to the one with the best quality that we use.
+_X264_PRESET_MPIXELS = [
+    ("ultrafast", 60),
+    ("superfast", 35),
+    ("veryfast", 22),
+    ("faster", 12),
+]
+
+
+def x264_settings(width: int,
+                  height: int,
+                  fps: float,
+                  low_latency: bool,
+                  cpu_budget: float = constants.VIDEO_CPU_BUDGET,
+                  cores: Optional[int] = None) -> X264Settings:
+    """Chooses libx264 settings that keep up with the video in real time.
+
+    The encode may use `cpu_budget` of the cores, and gets the slowest preset
+    whose estimated throughput on those cores covers the pixel rate, with some
+    headroom.  A low latency encode splits every frame into slices, while
+    other encodes thread over frames and look ahead, which compresses better.
+    """
+    if cores is None:
+        cores = cpu_cores()
+    threads = max(1, int(cores * cpu_budget))
+    mpixels = width * height * fps / 1e6
+
+    preset = _X264_PRESET_MPIXELS[0][0]
+    for name, per_core in _X264_PRESET_MPIXELS:
+        if threads * per_core >= 1.25 * mpixels:
+            preset = name
+
+    if low_latency:
+        # x264 needs a few macroblock rows per slice.
+        max_slices = max(1, height // 16 // 4)
+        slices = min(threads, max_slices)
+        lookahead = 0
+    else:
+        slices = 1
+        # Looking ahead is cheap compared to the slow presets, up to a second.
+        lookahead = 0 if preset == "ultrafast" else min(int(fps), 40)
+
+    return X264Settings(preset=preset, threads=threads, slices=slices,
+                        lookahead=lookahead, width=width, height=height,
+                        fps=fps, cores=cores)
+
+
+# Sends machine-readable progress reports to stderr instead of the usual stats
+# line; see stream_infra.log_encode_progress.
+_PROGRESS_ARGS = ["-nostats", "-progress", "pipe:2"]
+
+
 @dataclass
 class VideoSettings:
     display: Optional[str]  # TODO(xsdg): Should this be Optional?
@@ -221,11 +408,20 @@ class VideoSettings:
     user_command: Optional[str]  # TODO(xsdg): check type.
     vcodec: str
     youtube_url: Optional[str]
+    # The share of the cores that libx264 may use.
+    cpu_budget: float = constants.VIDEO_CPU_BUDGET
+    # What the device decodes; see codec_support.
+    device_generation: str = constants.DEFAULT_DEVICE_GENERATION
+    # When set, the video is written to this store as HLS segments of
+    # `segment_time` seconds.
+    hls_store: Optional[segment_store.SegmentStore] = None
+    segment_time: Optional[int] = None
 
 
 class Video:
     # Differences compared to original policies:
-    # - Using `veryfast` preset across the board, instead of `ultrafast`.
+    # - Choosing the libx264 preset and threading from the cores and the
+    #   pixel rate (see x264_settings), instead of always using `ultrafast`.
     # - Differences in vencode policy (see function).
     # - Avoids running ffmpeg with panic loglevel when --debug specified.
     #
@@ -233,8 +429,50 @@ class Video:
     # "-vf" can only be specified once per stream, but will end up being
     # specified twice if both subtitles and resolution are used.
 
+    # Re-encodes of files with an unknown frame rate are sized for this one.
+    _INPUT_FILE_FPS = 30
+
     def __init__(self, video_settings: VideoSettings):
         self._settings = video_settings
+        # The libx264 settings, once the command turns out to use libx264.
+        self.x264: Optional[X264Settings] = None
+        # Once the command turns out to only copy the streams of the input
+        # file, whether the file can be served as it is (COPY), or has to be
+        # remuxed first (REMUX).  Served files can be seeked in by the device.
+        self.file_action: Optional[codec_support.Action] = None
+        self._info: Optional[media_probe.MediaInfo] = None
+
+    @property
+    def reports_progress(self) -> bool:
+        """Whether ffmpeg writes -progress reports to stderr."""
+        return (self._settings.operation == OpMode.SCREENCAST
+                or (self._settings.operation == OpMode.INPUT_FILE
+                    and not self._settings.user_command))
+
+    @property
+    def target_fps(self) -> Optional[float]:
+        """The frame rate that the encode must keep up with, if known."""
+        if self._settings.operation == OpMode.SCREENCAST:
+            return float(self._settings.fps)
+        return None
+
+    @property
+    def _container(self) -> str:
+        """The ffmpeg format of what we stream; see codec_support."""
+        return "mp4" if self._settings.hls_store is None else "mpegts"
+
+    def _hls_output_args(self, encoding: bool) -> list[str]:
+        """Returns the output args for HLS.
+
+        When the video is `encoding`, keyframes are placed so that every
+        segment can start with one, at the segment time.
+        """
+        segment_time = self._settings.segment_time or constants.HLS_SEGMENT_TIME
+        maybe_keyframes_cmd: list[str] = (
+            ["-force_key_frames", f"expr:gte(t,n_forced*{segment_time})"]
+            if encoding else [])
+        return [*maybe_keyframes_cmd,
+                *hls_output_args(self._settings.hls_store, segment_time)]
 
     @property
     def command(self) -> SubprocessCommand:
@@ -260,13 +498,34 @@ class Video:
             self._settings.screencast
         )
 
-        maybe_veryfast_cmd: list[str]
-        if self._settings.vcodec != "h264_nvenc":
-            maybe_veryfast_cmd = ["-preset", "veryfast"]
+        maybe_preset_cmd: list[str]
+        if self._settings.vcodec == "libx264":
+            width, height = video_size(self._settings.resolution)
+            self.x264 = x264_settings(width, height,
+                                      float(self._settings.fps),
+                                      low_latency=True,
+                                      cpu_budget=self._settings.cpu_budget)
+            maybe_preset_cmd = self.x264.args
+        elif self._settings.vcodec != "h264_nvenc":
+            maybe_preset_cmd = ["-preset", "veryfast"]
         else:
-            maybe_veryfast_cmd = []
+            maybe_preset_cmd = []
+
+        output_cmd: list[str] = [
+            "-f", "mp4",
+            "-movflags", "frag_keyframe+empty_moov",
+            "-ar", "44100",
+            "-acodec", "libvorbis",
+            "pipe:1",
+        ]
+        if self._settings.hls_store is not None:
+            # MPEG-TS can't hold vorbis.
+            output_cmd = ["-ar", "44100",
+                          "-acodec", "aac",
+                          *self._hls_output_args(encoding=True)]
 
         return ["ffmpeg",
+                *_PROGRESS_ARGS,
                 "-ac", "2",
                 "-ar", "44100",
                 "-frame_size", "2048",
@@ -279,24 +538,22 @@ class Video:
                 "-s", screen_size,
                 "-i", "{}+0,0".format(self._settings.display),
                 "-vcodec", self._settings.vcodec,
-                *maybe_veryfast_cmd,
+                *maybe_preset_cmd,
                 "-tune", "zerolatency",
                 "-maxrate", "10000k",
                 "-bufsize", "20000k",
                 "-pix_fmt", "yuv420p",
                 "-g", "60",  # '-c:a', 'copy', '-ac', '2',
                 # '-b', '900k',
-                "-f", "mp4",
-                "-movflags", "frag_keyframe+empty_moov",
-                "-ar", "44100",
-                "-acodec", "libvorbis",
-                "pipe:1",
+                *output_cmd,
         ]
 
     @staticmethod
     def _input_file_subtitle(
         subtitles: Optional[str],
-        is_mkv: bool) -> tuple[list[str], list[str]]:
+        is_mkv: bool,
+        info: Optional[media_probe.MediaInfo] = None,
+    ) -> tuple[list[str], list[str]]:
         """Returns input_file arguments related to subtitles.
 
         Depending on the pipeline settings, this will return arguments to be
@@ -307,6 +564,10 @@ class Video:
             A tuple of (input-adjacent args, output-adjacent args).
         """
         if not subtitles:
+            if info is not None and info.subtitle_streams:
+                # The receiver doesn't show embedded subtitles, and mp4 can't
+                # hold image-based ones.
+                return ([], ["-sn"],)
             return ([], [],)
 
         if not is_mkv:
@@ -333,50 +594,78 @@ class Video:
         # "-movflags".  We may need to move it to be functionally
         # equivalent to the original command.
 
+        # Mapping the subtitles drops the default streams of input_file, so
+        # those are mapped too.
+        video_map, audio_map = "0:v:0", "0:a:0?"
+        if info is not None:
+            video_map = f"0:{info.video.index}" if info.video else "0:v:0?"
+            audio_map = f"0:{info.audio.index}" if info.audio else "0:a:0?"
+
         input_args = ["-i", subtitles,
                       "-codec:s", "mov_text",
+                      "-map", video_map,
+                      "-map", audio_map,
                       "-map", "1:0"]
         output_args = ["-max_muxing_queue_size", "9999"]
         return (input_args, output_args,)
 
     @staticmethod
-    def _input_file_vencode(input_file: str, res: Optional[str]) -> list[str]:
+    def _input_file_vencode(
+            info: Optional[media_probe.MediaInfo],
+            res: Optional[str],
+            x264: Optional[X264Settings] = None,
+            filtered: bool = False,
+            generation: str = constants.DEFAULT_DEVICE_GENERATION,
+            container: str = "mp4",
+    ) -> list[str]:
         """Specifies the video encoding args according to a simple policy.
 
         1) If any reencoding is being done (for instance, to rescale), use
-           libx264 vcodec with yuv420p pixel format
-        2) If input pixel format is yuv420p10le (HDR), re-encode using libx264
-           with yuv420p pixel format.
+           libx264 vcodec with yuv420p pixel format, and `x264` (or the default
+           policy for `res`) to thread the encode.  A source that the device
+           decodes at the requested height is copied instead, unless it is
+           `filtered` (for instance, to burn in subtitles).
+        2) If the device `generation` can't decode the input video (see
+           codec_support), or the `container` can't hold it, re-encode using
+           libx264 with yuv420p pixel format.
         3) Otherwise, copy input with no re-encoding.
+
+        `info` is the probed input file, or None if it couldn't be probed, in
+        which case the video is copied unless it's rescaled.
         """
 
         # Original policy was _extremely_ inconsistent and wasn't worth
         # replicating.  Note that this may cause some regressions which would
         # need to be re-fixed going forward.
 
-        input_is_mkv = is_mkv(input_file)
+        if x264 is None:
+            x264 = x264_settings(*video_size(res), fps=Video._INPUT_FILE_FPS,
+                                 low_latency=False)
+
+        video = info.video if info is not None else None
         copy_strategy = ["-vcodec", "copy"]
         reencode_strategy = [
             "-vcodec", "libx264",
-            "-preset", "veryfast",
-            "-tune", "zerolatency",
+            *x264.args,
             "-maxrate", "10000k",
             "-bufsize", "20000k",
             "-pix_fmt", "yuv420p",
             "-g", "60"
         ]
 
+        decodable = (video is not None
+                     and codec_support.video_action(info, video, generation,
+                                                    container)
+                     != codec_support.Action.TRANSCODE)
+
         if res:
-            # Rescaling always requires re-encoding.
-            # TODO(xsdg): Optimization: if the input resolution already matches
-            # the output resolution, avoid re-encoding?
+            if (not filtered
+                    and decodable
+                    and video.height == video_size(res)[1]):
+                # Rescaling to the same height would only cost an encode.
+                return copy_strategy
             return reencode_strategy
 
-        # TODO(xsdg): Why does mkv or not-mkv matter here?
-        if not input_is_mkv:
-            # Return early to avoid expensive check_file_info.
-            return copy_strategy
-
         # NOTE(xsdg): A video from youtube with the following specs played
         # without issue using the copy strategy, so I'm not sure if the
         # following workaround is still necessary:
@@ -388,16 +677,39 @@ class Video:
         #      Content Light Level Metadata, MaxCLL=1100, MaxFALL=180
         #      Mastering Display Metadata, has_primaries:1 has_luminance:1 r(0.6780,0.3220) g(0.2450,0.7030) b(0.1380 0.0520) wp(0.3127, 0.3290) min_luminance=0.000100, max_luminance=1000.000000
 
-
-        # TODO(xsdg): rename "what" from "bit-depth" to something more accurate.
-        pixel_format = utils.check_file_info(input_file, what="bit-depth")
-        if pixel_format == "yuv420p10le":
+        if video is not None and not decodable:
             return reencode_strategy
 
         return copy_strategy
 
     @staticmethod
-    def _input_file_aencode(has_subtitles: bool, input_is_mkv: bool) -> list[str]:
+    def _input_file_aencode(
+            info: Optional[media_probe.MediaInfo],
+            has_subtitles: bool,
+            input_is_mkv: bool,
+            generation: str = constants.DEFAULT_DEVICE_GENERATION,
+            container: str = "mp4",
+    ) -> list[str]:
+        """Specifies the audio encoding args.
+
+        The audio of a probed file is copied when the `container` and the
+        device `generation` can both take it, and otherwise encoded to mp3.
+        Files that couldn't be probed follow the original policy below.
+        """
+        if info is not None:
+            audio = info.audio
+            if audio is None:
+                return []
+            action = codec_support.audio_action(info, audio, generation,
+                                                container)
+            if action == codec_support.Action.TRANSCODE:
+                return ["-codec:a", "libmp3lame",
+                        "-q:a", "0"]
+            if audio.codec_name in codec_support.EXPERIMENTAL_MP4_AUDIO:
+                return ["-codec:a", "copy",
+                        "-strict", "experimental"]
+            return ["-codec:a", "copy"]
+
         # Original acodec policy:
         #sub None, mkv False -> []
         #sub None mkv True -> ["-acodec", "libmp3lame", "-q:a", "0"]
@@ -414,6 +726,76 @@ class Video:
             return ["-codec:a", "libmp3lame",
                     "-q:a", "0"]
 
+    def _input_file_action(
+            self,
+            info: Optional[media_probe.MediaInfo],
+            vencode_cmd: list[str],
+            aencode_cmd: list[str],
+    ) -> Optional[codec_support.Action]:
+        """Decides whether the input file can be served instead of streamed.
+
+        That takes a probed file whose streams are all copied, with nothing
+        else for ffmpeg to do: no subtitles to add, no loop, and no HLS
+        segments to write.
+        """
+        if (info is None
+                or info.video is None
+                or self._settings.hls_store is not None
+                or self._settings.loop
+                or self._settings.subtitles
+                or "libx264" in vencode_cmd
+                or "libmp3lame" in aencode_cmd):
+            return None
+
+        generation = self._settings.device_generation
+        actions = {codec_support.video_action(info, info.video, generation)}
+        if info.audio is not None:
+            actions.add(
+                codec_support.audio_action(info, info.audio, generation))
+        if codec_support.Action.REMUX in actions:
+            return codec_support.Action.REMUX
+        return codec_support.Action.COPY
+
+    def remux_command(self, output: str) -> list[str]:
+        """Returns the command that remuxes the input file into `output`.
+
+        The result is a fragmented mp4 with a segment index (sidx) up front,
+        so that the device can seek in it with byte ranges.  Only valid once
+        `command` has set `file_action` to REMUX.
+        """
+        if self.file_action != codec_support.Action.REMUX:
+            raise Exception("Internal error: the input file isn't remuxed.")
+
+        info = self._info
+        maybe_audio_cmd: list[str] = []
+        if info.audio is not None:
+            maybe_audio_cmd = ["-map", f"0:{info.audio.index}"]
+            if info.audio.codec_name in codec_support.EXPERIMENTAL_MP4_AUDIO:
+                maybe_audio_cmd += ["-strict", "experimental"]
+
+        return [
+            "ffmpeg",
+            "-nostats",
+            "-y",
+            "-i", self._settings.input_file,
+            "-map", f"0:{info.video.index}",
+            *maybe_audio_cmd,
+            "-map_chapters", "-1",
+            "-codec", "copy",
+            "-f", "mp4",
+            "-movflags", "frag_keyframe+global_sidx",
+            output,
+        ]
+
+    def _probe_input_file(self) -> Optional[media_probe.MediaInfo]:
+        """Probes the input file, or returns None if that fails."""
+        try:
+            return media_probe.media_info(self._settings.input_file)
+        except (OSError, ValueError) as e:
+            print(colors.warning(
+                f"Couldn't probe {self._settings.input_file}: {e}"))
+            return None
+
     def _input_file_command(self) -> list[str]:
         # Commands adapted from:
         # https://trac.ffmpeg.org/wiki/EncodingForStreamingSites#Streamingafile
@@ -421,6 +803,13 @@ class Video:
             raise Exception("Internal error: input file is not specified.")
 
         input_is_mkv = is_mkv(self._settings.input_file)
+        # Every decision below comes from this single probe.
+        info = self._probe_input_file()
+        video = info.video if info is not None else None
+        generation = self._settings.device_generation
+        if info is not None:
+            print(colors.options(f"Streams for {generation}:")
+                  + f" {codec_support.describe(info, generation)}")
 
         maybe_loop_cmd: list[str] = (
             ["-stream_loop", "-1"] if self._settings.loop else [])
@@ -428,26 +817,54 @@ class Video:
         maybe_seek_cmd: list[str] = (
             ["-ss", self._settings.seek] if self._settings.seek else [])
 
-        maybe_resolution_cmd: list[str]
-        if self._settings.resolution:
-            maybe_resolution_cmd = [
-                "-vf",
-                resolution.resolutions[self._settings.resolution][0]
-            ]
-        else:
-            maybe_resolution_cmd = []
-
         maybe_input_subtitle_cmd, maybe_filter_subtitle_cmd = (
-            self._input_file_subtitle(self._settings.subtitles, input_is_mkv))
-
-        vencode_cmd = self._input_file_vencode(self._settings.input_file,
-                                               self._settings.resolution)
+            self._input_file_subtitle(self._settings.subtitles, input_is_mkv,
+                                      info))
 
-        aencode_cmd = self._input_file_aencode(bool(self._settings.subtitles),
-                                               input_is_mkv)
+        if self._settings.resolution or video is None or not video.height:
+            size = video_size(self._settings.resolution)
+        else:
+            size = (video.width, video.height)
+        x264 = x264_settings(*size,
+                             fps=(video and video.fps) or self._INPUT_FILE_FPS,
+                             low_latency=False,
+                             cpu_budget=self._settings.cpu_budget)
+        vencode_cmd = self._input_file_vencode(
+            info, self._settings.resolution, x264,
+            filtered="-vf" in maybe_filter_subtitle_cmd,
+            generation=generation,
+            container=self._container)
+        # A copied stream can't be scaled.
+        maybe_resolution_cmd: list[str] = []
+        if "libx264" in vencode_cmd:
+            self.x264 = x264
+            if self._settings.resolution:
+                maybe_resolution_cmd = [
+                    "-vf",
+                    resolution.resolutions[self._settings.resolution][0]
+                ]
+
+        aencode_cmd = self._input_file_aencode(
+            info, bool(self._settings.subtitles), input_is_mkv, generation,
+            self._container)
+
+        self._info = info
+        self.file_action = self._input_file_action(
+            info, vencode_cmd, aencode_cmd)
+
+        output_format_cmd: list[str] = [
+            "-f", "mp4",
+            "-movflags", "frag_keyframe+empty_moov",
+        ]
+        output_cmd: list[str] = ["pipe:1"]
+        if self._settings.hls_store is not None:
+            output_format_cmd = []
+            output_cmd = self._hls_output_args(
+                encoding="copy" not in vencode_cmd)
 
         return [
             "ffmpeg",
+            *_PROGRESS_ARGS,
             *maybe_loop_cmd,
             *maybe_seek_cmd,
             "-re",
@@ -456,9 +873,8 @@ class Video:
             "-map_chapters", "-1",
             *vencode_cmd,
             *aencode_cmd,
-            "-f", "mp4",
-            "-movflags", "frag_keyframe+empty_moov",
+            *output_format_cmd,
             *maybe_filter_subtitle_cmd,
             *maybe_resolution_cmd,
-            "pipe:1",
+            *output_cmd,
         ]
@@ -0,0 +1,168 @@
+# This file is part of mkchromecast.
+
+"""Captures the Mkchromecast sink monitor within mkchromecast, with ctypes.
+
+This is what parec does, through libpulse-simple, which PipeWire also
+provides.  Captured audio is read into a buffer that is reused for every
+fragment, and then written to the encoder without going through another
+process.
+
+Capture is only available where libpulse-simple is installed; otherwise,
+callers run parec instead.
+"""
+
+import ctypes
+import ctypes.util
+import threading
+from typing import Optional
+
+MONITOR = "Mkchromecast.monitor"
+
+# The captured audio is 16-bit stereo at 44.1kHz, like parec --format=s16le.
+RATE = 44100
+CHANNELS = 2
+FRAME_BYTES = 4
+
+# From pulse/def.h and pulse/sample.h.
+_PA_STREAM_RECORD = 2
+_PA_SAMPLE_S16LE = 3
+# Lets the server pick the buffer attribute.
+_PA_DEFAULT = 0xFFFFFFFF
+
+
+class _SampleSpec(ctypes.Structure):
+    _fields_ = [("format", ctypes.c_int),
+                ("rate", ctypes.c_uint32),
+                ("channels", ctypes.c_uint8)]
+
+
+class _BufferAttr(ctypes.Structure):
+    _fields_ = [("maxlength", ctypes.c_uint32),
+                ("tlength", ctypes.c_uint32),
+                ("prebuf", ctypes.c_uint32),
+                ("minreq", ctypes.c_uint32),
+                ("fragsize", ctypes.c_uint32)]
+
+
+_library: Optional[ctypes.CDLL] = None
+_library_lock = threading.Lock()
+
+
+def _load_library() -> Optional[ctypes.CDLL]:
+    """Returns libpulse-simple, or None if it isn't installed."""
+    global _library
+    with _library_lock:
+        if _library is not None:
+            return _library
+
+        name = ctypes.util.find_library("pulse-simple")
+        if name is None:
+            return None
+        try:
+            library = ctypes.CDLL(name)
+        except OSError:
+            return None
+
+        library.pa_simple_new.restype = ctypes.c_void_p
+        library.pa_simple_new.argtypes = [
+            ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+            ctypes.c_char_p, ctypes.POINTER(_SampleSpec), ctypes.c_void_p,
+            ctypes.POINTER(_BufferAttr), ctypes.POINTER(ctypes.c_int)]
+        library.pa_simple_read.restype = ctypes.c_int
+        library.pa_simple_read.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+            ctypes.POINTER(ctypes.c_int)]
+        library.pa_simple_free.restype = None
+        library.pa_simple_free.argtypes = [ctypes.c_void_p]
+        # libpulse-simple links against libpulse, which provides this.
+        library.pa_strerror.restype = ctypes.c_char_p
+        library.pa_strerror.argtypes = [ctypes.c_int]
+
+        _library = library
+        return _library
+
+
+def available() -> bool:
+    """Whether the monitor can be captured in this process."""
+    return _load_library() is not None
+
+
+def _strerror(library: ctypes.CDLL, error: int) -> str:
+    message = library.pa_strerror(error)
+    return message.decode("utf-8") if message else f"error {error}"
+
+
+class PulseCapture:
+    """A recording stream from a PulseAudio or PipeWire source.
+
+    This is safe to close from another thread while a fragment is being read;
+    closing waits for that read to finish.
+    """
+
+    def __init__(self,
+                 fragment_size: int,
+                 device: str = MONITOR,
+                 name: str = "mkchromecast"):
+        library = _load_library()
+        if library is None:
+            raise OSError("libpulse-simple is not installed")
+        self._library = library
+
+        # Whole frames, so that no read ends partway through a sample.
+        fragment_size = max(FRAME_BYTES,
+                            fragment_size - fragment_size % FRAME_BYTES)
+        self.fragment_size = fragment_size
+
+        spec = _SampleSpec(_PA_SAMPLE_S16LE, RATE, CHANNELS)
+        # The server delivers audio a fragment at a time, which is also how
+        # much we read at a time.
+        attr = _BufferAttr(_PA_DEFAULT, _PA_DEFAULT, _PA_DEFAULT, _PA_DEFAULT,
+                           fragment_size)
+        error = ctypes.c_int(0)
+        self._handle = library.pa_simple_new(
+            None, name.encode("utf-8"), _PA_STREAM_RECORD,
+            device.encode("utf-8"), b"capture", ctypes.byref(spec), None,
+            ctypes.byref(attr), ctypes.byref(error))
+        if not self._handle:
+            raise OSError(f"Couldn't capture {device}: "
+                          f"{_strerror(library, error.value)}")
+
+        self.device = device
+        self._buffer = bytearray(fragment_size)
+        self._view = memoryview(self._buffer)
+        # Shares the buffer's memory, which the library reads into.
+        self._c_buffer = (ctypes.c_char * fragment_size).from_buffer(
+            self._buffer)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "PulseCapture":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def read_fragment(self) -> memoryview:
+        """Reads the next fragment, blocking until it's captured.
+
+        The returned view is overwritten by the next read.  Once the capture
+        is closed, it is empty.
+
+        Raises:
+            OSError: the server failed the read.
+        """
+        with self._lock:
+            if self._handle is None:
+                return self._view[:0]
+            error = ctypes.c_int(0)
+            if self._library.pa_simple_read(self._handle, self._c_buffer,
+                                            self.fragment_size,
+                                            ctypes.byref(error)) < 0:
+                raise OSError(f"Couldn't read {self.device}: "
+                              f"{_strerror(self._library, error.value)}")
+            return self._view
+
+    def close(self) -> None:
+        with self._lock:
+            if self._handle is not None:
+                self._library.pa_simple_free(self._handle)
+                self._handle = None
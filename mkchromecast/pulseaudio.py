@@ -1,30 +1,168 @@
 # This file is part of mkchromecast.
 
-import subprocess
-import time
+"""Manages the Mkchromecast null sink on the PulseAudio or PipeWire server.
+
+Where pulsectl is installed, every call goes over a single native protocol
+connection, which is opened on first use and kept for the life of the process.
+Otherwise, or when the server can't be reached that way, each call runs pactl.
+"""
+
+import os
 import re
+import subprocess
+import threading
+from typing import Optional, Union
+
+from mkchromecast import colors
+
+has_pulsectl: bool
+try:
+    import pulsectl
+
+    has_pulsectl = True
+    # Raised once the server has gone away.
+    _DISCONNECTED: tuple[type[Exception], ...] = (pulsectl.PulseDisconnected,)
+    # Raised when the server refuses a request, or can't be reached.
+    _FAILED: tuple[type[Exception], ...] = (pulsectl.PulseError,
+                                            pulsectl.PulseDisconnected)
+except ImportError:
+    has_pulsectl = False
+    _DISCONNECTED = ()
+    _FAILED = ()
+
+SINK_NAME = "Mkchromecast"
 
 _sink_num = None
 
 
-def create_sink():
-    global _sink_num
+class _NativeControl:
+    """Sink management over a native protocol connection, with pulsectl."""
+
+    def __init__(self):
+        self._pulse = pulsectl.Pulse("mkchromecast")
+
+    def close(self) -> None:
+        self._pulse.close()
+
+    def load_null_sink(self, name: str) -> int:
+        """Returns the index of the module that owns the new sink."""
+        return self._pulse.module_load(
+            "module-null-sink",
+            [f"sink_name={name}", f"sink_properties=device.description={name}"])
+
+    def unload_module(self, index: int) -> None:
+        self._pulse.module_unload(index)
+
+    def has_sink(self, name: str) -> bool:
+        try:
+            self._pulse.get_sink_by_name(name)
+        except pulsectl.PulseIndexError:
+            return False
+        return True
+
+    def sink_modules(self, prefix: str) -> list[int]:
+        """Returns the modules that own the sinks whose names start so."""
+        return [sink.owner_module for sink in self._pulse.sink_list()
+                if sink.name.startswith(prefix)]
+
+
+class _PactlControl:
+    """Sink management with a pactl subprocess for every call."""
+
+    def close(self) -> None:
+        pass
+
+    def load_null_sink(self, name: str) -> int:
+        result = subprocess.run(
+            ["pactl", "load-module", "module-null-sink", f"sink_name={name}",
+             f"sink_properties=device.description={name}"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60,
+            check=True)
+        return int(result.stdout)
+
+    def unload_module(self, index: int) -> None:
+        subprocess.run(["pactl", "unload-module", str(index)],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       timeout=60, check=True)
+
+    def has_sink(self, name: str) -> bool:
+        result = subprocess.run(["pactl", "list", "short", "sinks"],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                timeout=60, check=True)
+        # Each line is the index, name, driver, sample spec and state.
+        return any(line.split("\t")[1:2] == [name]
+                   for line in result.stdout.decode("utf-8").splitlines())
+
+    def sink_modules(self, prefix: str) -> list[int]:
+        result = subprocess.run(["pactl", "list", "sinks"],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                timeout=60, check=True)
+
+        pattern = re.compile(
+            r"^Sink\s*#\d+\s*$(?:\n^.*?$)*?\n\s*?Name:\s*?"
+            + re.escape(prefix)
+            + r".*\s*?$(?:\n^.*?$)*?\n^\s*?Owner Module: (?P<module>\d+?)\s*?$",
+            re.MULTILINE,
+        )
+        return [int(module)
+                for module in pattern.findall(result.stdout.decode("utf-8"))]
+
+
+_control: Optional[Union[_NativeControl, _PactlControl]] = None
+_control_lock = threading.Lock()
+
 
-    sink_name = "Mkchromecast"
+def _reset_control() -> None:
+    """Forgets the connection in a forked child, which mustn't share it."""
+    global _control, _control_lock
+    _control = None
+    _control_lock = threading.Lock()
 
-    create_sink = [
-        "pactl",
-        "load-module",
-        "module-null-sink",
-        "sink_name=" + sink_name,
-        "sink_properties=device.description=" + sink_name,
-    ]
 
-    cs = subprocess.Popen(create_sink, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    csoutput, cserror = cs.communicate()
-    _sink_num = csoutput[:-1]
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_control)
 
-    return
+
+def _get_control() -> Union[_NativeControl, _PactlControl]:
+    """Returns the process-wide control, connecting if needed."""
+    global _control
+    if _control is None and has_pulsectl:
+        try:
+            _control = _NativeControl()
+        except pulsectl.PulseError:
+            # pactl may still find a server that pulsectl can't reach.
+            pass
+    if _control is None:
+        _control = _PactlControl()
+    return _control
+
+
+def _call(method: str, *args):
+    """Calls a method of the control, reconnecting once if the server went away.
+
+    The connection isn't safe to share between threads, so calls are
+    serialized.
+    """
+    global _control
+    with _control_lock:
+        control = _get_control()
+        try:
+            return getattr(control, method)(*args)
+        except _DISCONNECTED:
+            # The server restarted, as it does when the user switches between
+            # PulseAudio and PipeWire.
+            control.close()
+            _control = None
+            return getattr(_get_control(), method)(*args)
+
+
+def create_sink():
+    global _sink_num
+
+    try:
+        _sink_num = _call("load_null_sink", SINK_NAME)
+    except (OSError, ValueError, subprocess.SubprocessError, *_FAILED) as e:
+        print(colors.warning(f"Couldn't create the {SINK_NAME} sink: {e}"))
 
 
 def remove_sink():
@@ -37,60 +175,27 @@ def remove_sink():
         _sink_num = [_sink_num]
 
     for num in _sink_num:
-        remove_sink = [
-            "pactl",
-            "unload-module",
-            num.decode("utf-8") if type(num) == bytes else str(num),
-        ]
-        rms = subprocess.run(
-            remove_sink,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=60,
-            check=True,
-        )
+        try:
+            _call("unload_module", int(num))
+        except (OSError, ValueError, subprocess.SubprocessError,
+                *_FAILED) as e:
+            print(colors.warning(f"Couldn't remove the {SINK_NAME} sink: {e}"))
 
 
-def check_sink():
+def check_sink() -> Optional[bool]:
+    """Returns whether the Mkchromecast sink exists, or None without pactl."""
     try:
-        check_sink = ["pactl", "list", "sinks"]
-        chk = subprocess.Popen(
-            check_sink, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        chkoutput, chkerror = chk.communicate()
-    except FileNotFoundError:
+        return _call("has_sink", SINK_NAME)
+    except (OSError, subprocess.CalledProcessError):
         return None
 
-    try:
-        if "Mkchromecast" in chkoutput:
-            return True
-        else:
-            return False
-    except TypeError:
-        if "Mkchromecast" in chkoutput.decode("utf-8"):
-            return True
-        else:
-            return False
-
 
 def get_sink_list():
     """Get a list of sinks with a name prefix of Mkchromecast and save to _sink_num.
 
     Used to clear any residual sinks from previous failed actions. The number
-    saved to _sink_num is the module index, which can be passed to pactl.
+    saved to _sink_num is the module index, which can be unloaded.
     """
     global _sink_num
 
-    cmd = ["pactl", "list", "sinks"]
-    result = subprocess.run(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60, check=True
-    )
-
-    pattern = re.compile(
-        r"^Sink\s*#\d+\s*$(?:\n^.*?$)*?\n\s*?Name:\s*?Mkchromecast.*"
-        + r"\s*?$(?:\n^.*?$)*?\n^\s*?Owner Module: (?P<module>\d+?)\s*?$",
-        re.MULTILINE,
-    )
-    matches = pattern.findall(result.stdout.decode("utf-8"), re.MULTILINE)
-
-    _sink_num = [int(i) for i in matches]
+    _sink_num = _call("sink_modules", SINK_NAME)
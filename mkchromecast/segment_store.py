@@ -0,0 +1,81 @@
+# This file is part of mkchromecast.
+
+"""The HLS playlist and segments that the encoder writes, and the server sends.
+
+ffmpeg's HLS muxer writes a few seconds of the stream per segment, and lists
+the most recent segments in a live playlist.  Older segments are deleted as
+new ones are written, so the store never holds more than a few of them.  It
+lives in memory (/dev/shm) where that is available.
+
+There is one store per server port, which is emptied whenever a new encoder
+starts, so a server that was killed leaves at most one store behind.
+"""
+
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+PLAYLIST = "stream.m3u8"
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MEDIA_TYPE = "video/mp2t"
+
+# ffmpeg writes segments to a .tmp file first, which is never served.
+_SEGMENT_NAME = re.compile(r"segment\d+\.ts")
+
+
+class SegmentStore:
+    """A directory of HLS segments, and the playlist that lists them."""
+
+    def __init__(self, directory: os.PathLike):
+        self.directory = pathlib.Path(directory)
+
+    @classmethod
+    def for_port(cls, port: int) -> "SegmentStore":
+        """Returns the store of the server on the port, in memory if possible."""
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        return cls(pathlib.Path(base) / f"mkchromecast-hls-{port}")
+
+    @property
+    def playlist(self) -> pathlib.Path:
+        return self.directory / PLAYLIST
+
+    @property
+    def segment_pattern(self) -> str:
+        """The segment file names, as ffmpeg's -hls_segment_filename takes."""
+        return str(self.directory / "segment%05d.ts")
+
+    def reset(self) -> None:
+        """Empties the store, for a new encoder."""
+        self.remove()
+        self.directory.mkdir(parents=True)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path_for(self, name: str) -> Optional[pathlib.Path]:
+        """Returns the file with the requested name, if it's in the store."""
+        if name != PLAYLIST and not _SEGMENT_NAME.fullmatch(name):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+    @staticmethod
+    def media_type(name: str) -> str:
+        return PLAYLIST_MEDIA_TYPE if name == PLAYLIST else SEGMENT_MEDIA_TYPE
+
+    def wait_for_playlist(self, timeout: float) -> bool:
+        """Waits for the encoder to write its first segment.
+
+        Returns:
+            Whether the playlist exists.
+        """
+        deadline = time.monotonic() + timeout
+        while not self.playlist.is_file():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
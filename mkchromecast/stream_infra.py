@@ -1,22 +1,41 @@
 # This file is part of mkchromecast.
 
+import asyncio
+import collections
 from dataclasses import dataclass
+import errno
 import flask
-from functools import partial
+from fractions import Fraction
+import itertools
+import math
 import multiprocessing
 import os
-import pickle
+import select
 import psutil
-from subprocess import Popen, PIPE
+import socket
+import socketserver
+from subprocess import DEVNULL, Popen, PIPE
 import sys
 import textwrap
 import threading
 import time
-from typing import Callable, Optional, Union
+from typing import AsyncIterator, Callable, Iterator, Optional, Union
 
 import mkchromecast
 from mkchromecast.audio_devices import inputint, outputint
 from mkchromecast import colors
+from mkchromecast import constants
+from mkchromecast import pulse_capture
+from mkchromecast import segment_store
+from mkchromecast import transcode_cache
+
+has_pyav: bool
+try:
+    import av
+
+    has_pyav = True
+except ImportError:
+    has_pyav = False
 
 FlaskViewReturn = Union[str, flask.Response]
 
@@ -28,6 +47,1052 @@ class BackendInfo:
     path: Optional[str] = None
 
 
+@dataclass
+class ReadSizing:
+    """Bounds for adapting the pipeline read size to its throughput."""
+    min_size: int
+    max_size: int
+    target_latency_ms: int
+    debug: bool = False
+
+    @staticmethod
+    def from_mkcc(mkcc: mkchromecast.Mkchromecast) -> Optional["ReadSizing"]:
+        """Returns the configured read sizing, or None for fixed read sizes."""
+        if mkcc.target_latency is None:
+            return None
+        return ReadSizing(min_size=mkcc.min_read_size,
+                          max_size=mkcc.max_read_size,
+                          target_latency_ms=mkcc.target_latency,
+                          debug=mkcc.debug)
+
+
+class Pipeline:
+    """A chain of processes, the last of which writes the stream to stdout."""
+
+    def __init__(self, processes: list[Popen]):
+        self._processes = processes
+
+    @property
+    def stdout(self):
+        return self._processes[-1].stdout
+
+    def stop(self) -> None:
+        """Terminates any processes that are still running and reaps them."""
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self._processes:
+            process.wait()
+
+    def close(self) -> None:
+        """Stops the pipeline and closes our end of its output pipe."""
+        self.stop()
+        self.stdout.close()
+
+    def read_chunks(self, sizer: "ReadSizer") -> Iterator[bytes]:
+        """Yields the pipeline output as it becomes available, until EOF."""
+        fd = self.stdout.fileno()
+        while chunk := os.read(fd, sizer.size):
+            sizer.update(len(chunk))
+            yield chunk
+
+
+class PulseCapturePipeline(Pipeline):
+    """Feeds audio that's captured in this process into an encoder process.
+
+    This takes the place of parec: a thread reads each fragment of the monitor
+    into the capture's buffer, and writes it straight to the encoder's stdin.
+    """
+
+    def __init__(self, capture: pulse_capture.PulseCapture, encoder: Popen):
+        super().__init__([encoder])
+        self._capture = capture
+        feeder = threading.Thread(target=self._feed, args=(encoder.stdin,))
+        feeder.daemon = True
+        feeder.start()
+
+    def _feed(self, stdin) -> None:
+        fd = stdin.fileno()
+        try:
+            while view := self._capture.read_fragment():
+                while view:
+                    view = view[os.write(fd, view):]
+        except OSError:
+            # The encoder exited, or the capture failed.
+            pass
+        finally:
+            # The encoder sees EOF, and finishes.
+            stdin.close()
+
+    def stop(self) -> None:
+        # Waits for any read in progress, after which reads are empty.
+        self._capture.close()
+        super().stop()
+
+
+@dataclass
+class PyAVOutput:
+    """How the pyav backend encodes the captured audio."""
+    format: str
+    codec: str
+    samplerate: int
+    # In kbps, for the lossy codecs.
+    bitrate: Optional[int] = None
+
+
+class _OutputBuffer:
+    """A file-like object that collects what a PyAV container writes."""
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class _PumpedPipeline(Pipeline):
+    """A pipeline whose output is produced by `read_chunks` in this process.
+
+    Readers that need a file descriptor can still use `stdout`, which is a
+    pipe that a thread feeds from `read_chunks`.
+    """
+
+    # How much a pump thread reads at a time.
+    _PUMP_READ_SIZE = 64 * 1024
+
+    def __init__(self, processes: list[Popen]):
+        super().__init__(processes)
+        self._stdout_lock = threading.Lock()
+        self._stdout = None
+
+    @property
+    def stdout(self):
+        """A pipe with the output, created on first use."""
+        with self._stdout_lock:
+            if self._stdout is None:
+                read_fd, write_fd = os.pipe()
+                self._stdout = os.fdopen(read_fd, "rb", buffering=0)
+                pump = threading.Thread(target=self._pump, args=(write_fd,))
+                pump.daemon = True
+                pump.start()
+            return self._stdout
+
+    def close(self) -> None:
+        self.stop()
+        for process in self._processes:
+            if process.stdout is not None:
+                process.stdout.close()
+        with self._stdout_lock:
+            if self._stdout is not None:
+                self._stdout.close()
+
+    def _pump(self, write_fd: int) -> None:
+        try:
+            for chunk in self.read_chunks(ReadSizer(self._PUMP_READ_SIZE)):
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(write_fd, view):]
+        except (OSError, ValueError):
+            # The reader went away, or the pipeline was closed.
+            pass
+        finally:
+            os.close(write_fd)
+
+
+class PyAVPipeline(_PumpedPipeline):
+    """Encodes captured audio in this process, with PyAV.
+
+    Compared with piping the capture into an encoder process, this saves a
+    process, and a pipe between it and us: encoded packets are handed to the
+    reader as they are muxed.  The audio comes from a capture process, or is
+    captured in this process too.  Readers that need a file descriptor can
+    still use `stdout`, which is fed from a thread.
+    """
+
+    # The format of the captured audio.
+    CAPTURE_RATE = 44100
+    CAPTURE_FORMAT = "s16"
+    _CAPTURE_FRAME_BYTES = 4
+    # 20ms of captured audio.
+    _PUMP_READ_SIZE = CAPTURE_RATE * _CAPTURE_FRAME_BYTES // 50
+
+    def __init__(self,
+                 capture: Union[Popen, pulse_capture.PulseCapture],
+                 output: PyAVOutput):
+        super().__init__([capture] if isinstance(capture, Popen) else [])
+        self._capture = capture
+        self._output = output
+
+    def close(self) -> None:
+        if not isinstance(self._capture, Popen):
+            self._capture.close()
+        super().close()
+
+    def _read_capture(self,
+                      sizer: "ReadSizer") -> Iterator[Union[bytes, memoryview]]:
+        """Yields captured audio until the capture finishes."""
+        if not isinstance(self._capture, Popen):
+            # Each fragment is read into the same buffer, and is only valid
+            # until the next one.
+            while pcm := self._capture.read_fragment():
+                yield pcm
+            return
+
+        fd = self._capture.stdout.fileno()
+        while pcm := os.read(fd, sizer.size):
+            sizer.update(len(pcm))
+            yield pcm
+
+    def read_chunks(self, sizer: "ReadSizer") -> Iterator[bytes]:
+        """Yields the encoded output, until the capture finishes.
+
+        `sizer` sizes the reads from a capture process.
+        """
+        buffer = _OutputBuffer()
+        # Hands over every packet as soon as it's muxed.
+        container = av.open(buffer, mode="w", format=self._output.format,
+                            container_options={"flush_packets": "1"})
+        try:
+            stream = container.add_stream(self._output.codec,
+                                          rate=self._output.samplerate)
+            context = stream.codec_context
+            context.layout = "stereo"
+            if self._output.bitrate:
+                context.bit_rate = self._output.bitrate * 1000
+            # Opens the encoder, which tells us its frame size.
+            container.start_encoding()
+            resampler = av.AudioResampler(format=context.format.name,
+                                          layout="stereo",
+                                          rate=self._output.samplerate,
+                                          frame_size=context.frame_size or None)
+
+            time_base = Fraction(1, self.CAPTURE_RATE)
+            samples = 0
+            remainder = b""
+            for pcm in self._read_capture(sizer):
+                if remainder:
+                    pcm = remainder + pcm
+                # Reads may end partway through a sample.
+                usable = len(pcm) - len(pcm) % self._CAPTURE_FRAME_BYTES
+                remainder = bytes(pcm[usable:])
+                if not usable:
+                    continue
+
+                frame = av.AudioFrame(
+                    format=self.CAPTURE_FORMAT,
+                    layout="stereo",
+                    samples=usable // self._CAPTURE_FRAME_BYTES)
+                frame.planes[0].update(pcm[:usable])
+                frame.sample_rate = self.CAPTURE_RATE
+                frame.time_base = time_base
+                frame.pts = samples
+                samples += frame.samples
+
+                self._encode(container, stream, resampler.resample(frame))
+                if data := buffer.take():
+                    yield data
+
+            # Flushes the resampler and then the encoder.
+            self._encode(container, stream, resampler.resample(None))
+            self._encode(container, stream, [None])
+        finally:
+            container.close()
+
+        if data := buffer.take():
+            yield data
+
+    @staticmethod
+    def _encode(container, stream, frames) -> None:
+        for frame in frames:
+            for packet in stream.encode(frame):
+                container.mux(packet)
+
+
+class CachingPipeline(_PumpedPipeline):
+    """Writes the output of an encoder to the transcode cache as it's read.
+
+    The cache entry is only kept if the encoder finishes successfully, so a
+    client that goes away midway leaves nothing behind.
+    """
+
+    def __init__(self,
+                 process: Popen,
+                 writer: transcode_cache.CacheWriter):
+        super().__init__([process])
+        self._process = process
+        self._writer = writer
+
+    def read_chunks(self, sizer: "ReadSizer") -> Iterator[bytes]:
+        fd = self._process.stdout.fileno()
+        while chunk := os.read(fd, sizer.size):
+            sizer.update(len(chunk))
+            self._writer.write(chunk)
+            yield chunk
+
+        if self._process.wait() == 0:
+            self._writer.commit()
+        else:
+            self._writer.abort()
+
+    def close(self) -> None:
+        super().close()
+        # Does nothing once committed.
+        self._writer.abort()
+
+
+class CachedFilePipeline(_PumpedPipeline):
+    """Streams a finished transcode from the cache, without an encoder."""
+
+    def __init__(self, path: os.PathLike):
+        super().__init__([])
+        self._file = open(path, "rb", buffering=0)
+
+    def read_chunks(self, sizer: "ReadSizer") -> Iterator[bytes]:
+        while chunk := self._file.read(sizer.size):
+            sizer.update(len(chunk))
+            yield chunk
+
+    def close(self) -> None:
+        super().close()
+        self._file.close()
+
+
+def find_frame_sync(data: bytes, start: int = 0) -> int:
+    """Returns the offset of the first MP3 or ADTS frame sync, or -1.
+
+    Both formats start every frame with 11 or more set bits, so this matches
+    either.  A match may be a false positive inside frame data, but decoders
+    resynchronize on their own if that happens.
+    """
+    index = data.find(b"\xff", start)
+    while index != -1 and index + 1 < len(data):
+        if data[index + 1] & 0xE0 == 0xE0:
+            return index
+        index = data.find(b"\xff", index + 1)
+
+    return -1
+
+
+class StreamFramer:
+    """Knows where a stream can be joined, and what a late joiner needs first.
+
+    A late joiner is sent `header`, and then the stream from a sync point.
+    This base class is for streams that have no header and can be joined at
+    any byte; the subclasses handle particular formats.
+    """
+
+    def __init__(self):
+        self.header: bytes = b""
+
+    def reset(self) -> None:
+        """Forgets the stream, before a new one starts."""
+        self.header = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Takes the next chunk of the stream, and returns what to buffer.
+
+        Subclasses may hold data back, for example while the header is
+        incomplete, so the result may be empty.
+        """
+        return chunk
+
+    def find_sync(self, data: bytes, start: int = 0) -> int:
+        """Returns the offset of the first sync point from `start`, or -1."""
+        return start if start < len(data) else -1
+
+    def last_sync(self, data: bytes, end: int) -> int:
+        """Returns the offset of the last sync point before `end`, or -1."""
+        last = -1
+        index = self.find_sync(data, 0)
+        while index != -1 and index < end:
+            last = index
+            index = self.find_sync(data, index + 1)
+        return last
+
+
+class MpegFramer(StreamFramer):
+    """MP3 and ADTS streams, which are joined at a frame sync."""
+
+    def find_sync(self, data: bytes, start: int = 0) -> int:
+        return find_frame_sync(data, start)
+
+
+class _HeaderFramer(StreamFramer):
+    """A stream that starts with a header, which late joiners need first."""
+
+    # Streams that don't have a header within this many bytes are joined
+    # without one.
+    _MAX_HEADER_SIZE = 1 << 20
+
+    def __init__(self):
+        super().__init__()
+        # The start of the stream, until the header is complete.
+        self._pending: Optional[bytearray] = bytearray()
+
+    def reset(self) -> None:
+        super().reset()
+        self._pending = bytearray()
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self._pending is None:
+            return self._frame(chunk)
+
+        self._pending += chunk
+        length = self._header_length(self._pending)
+        if length is None:
+            if len(self._pending) < self._MAX_HEADER_SIZE:
+                return b""
+            length = 0
+
+        pending, self._pending = self._pending, None
+        self.header = bytes(pending[:length])
+        return self._frame(bytes(pending[length:]))
+
+    def _header_length(self, data: bytearray) -> Optional[int]:
+        """Returns the length of the header, or None if it's incomplete.
+
+        A stream that doesn't start with the expected header has a header
+        length of 0.
+        """
+        raise NotImplementedError
+
+    def _frame(self, data: bytes) -> bytes:
+        """Returns the part of data that follows the header to buffer."""
+        return data
+
+
+class OggFramer(_HeaderFramer):
+    """Ogg Vorbis and Ogg Opus streams.
+
+    The header is every page before the first one with a granule position,
+    and the stream is joined at a page boundary.
+    """
+
+    def _header_length(self, data: bytearray) -> Optional[int]:
+        offset = 0
+        while True:
+            if len(data) < offset + 4:
+                return None
+            if data[offset:offset + 4] != b"OggS":
+                return offset
+            if len(data) < offset + 27:
+                return None
+            granule = int.from_bytes(data[offset + 6:offset + 14], "little")
+            if granule != 0:
+                # The first page with audio.
+                return offset
+
+            segments = data[offset + 26]
+            if len(data) < offset + 27 + segments:
+                return None
+            offset += (27 + segments
+                       + sum(data[offset + 27:offset + 27 + segments]))
+
+    def find_sync(self, data: bytes, start: int = 0) -> int:
+        return data.find(b"OggS", start)
+
+
+class WavFramer(_HeaderFramer):
+    """RIFF WAVE streams.
+
+    The header runs up to the start of the samples, and the buffered chunks
+    are kept aligned to whole sample frames, so that the stream can be joined
+    at the start of any chunk.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._block_align: int = 1
+        self._remainder: bytes = b""
+
+    def reset(self) -> None:
+        super().reset()
+        self._block_align = 1
+        self._remainder = b""
+
+    def _header_length(self, data: bytearray) -> Optional[int]:
+        if len(data) < 12:
+            return None
+        if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+            return 0
+
+        offset = 12
+        while True:
+            if len(data) < offset + 8:
+                return None
+            chunk_id = bytes(data[offset:offset + 4])
+            if chunk_id == b"data":
+                return offset + 8
+
+            size = int.from_bytes(data[offset + 4:offset + 8], "little")
+            if chunk_id == b"fmt ":
+                if len(data) < offset + 22:
+                    return None
+                self._block_align = int.from_bytes(
+                    data[offset + 20:offset + 22], "little") or 1
+            # Chunks are padded to an even length.
+            offset += 8 + size + (size & 1)
+
+    def _frame(self, data: bytes) -> bytes:
+        if self._remainder:
+            data = self._remainder + data
+        usable = len(data) - len(data) % self._block_align
+        self._remainder = data[usable:]
+        return data[:usable] if self._remainder else data
+
+    def find_sync(self, data: bytes, start: int = 0) -> int:
+        start = -(-start // self._block_align) * self._block_align
+        return start if start < len(data) else -1
+
+    def last_sync(self, data: bytes, end: int) -> int:
+        if end <= 0 or not data:
+            return -1
+        return (min(end, len(data)) - 1) // self._block_align * self._block_align
+
+
+class FlacFramer(_HeaderFramer):
+    """Native FLAC streams.
+
+    The header is the stream marker and the metadata blocks, and the stream
+    is joined at a frame sync code.
+    """
+
+    def _header_length(self, data: bytearray) -> Optional[int]:
+        if len(data) < 4:
+            return None
+        if data[:4] != b"fLaC":
+            return 0
+
+        offset = 4
+        while True:
+            if len(data) < offset + 4:
+                return None
+            is_last = data[offset] & 0x80
+            offset += 4 + int.from_bytes(data[offset + 1:offset + 4], "big")
+            if is_last:
+                return offset if len(data) >= offset else None
+
+    def find_sync(self, data: bytes, start: int = 0) -> int:
+        index = data.find(b"\xff", start)
+        while index != -1 and index + 1 < len(data):
+            if data[index + 1] & 0xFE == 0xF8:
+                return index
+            index = data.find(b"\xff", index + 1)
+
+        return -1
+
+
+_CODEC_FRAMERS: dict[str, type[StreamFramer]] = {
+    "mp3": MpegFramer,
+    "aac": MpegFramer,
+    "ogg": OggFramer,
+    "opus": OggFramer,
+    "wav": WavFramer,
+    "flac": FlacFramer,
+}
+
+
+def framer_for_codec(codec: str) -> StreamFramer:
+    """Returns a new framer for a stream encoded with `codec`."""
+    return _CODEC_FRAMERS.get(codec, StreamFramer)()
+
+
+def prewarm_backlog_bytes(bitrate: int, backlog_ms: int) -> int:
+    """Returns how many bytes of a stream at `bitrate` kbps last `backlog_ms`."""
+    return bitrate * 1000 // 8 * backlog_ms // 1000
+
+
+def stream_bitrate(codec: str, bitrate: int, samplerate: int) -> int:
+    """Returns roughly how many kbps a stereo audio stream takes.
+
+    The bitrate setting only applies to lossy codecs.
+    """
+    if codec == "wav":
+        # At most 24 bits per sample.
+        return samplerate * 2 * 24 // 1000
+    if codec == "flac":
+        # Lossless compression of 16 bit samples typically saves 40% or more.
+        return samplerate * 2 * 16 * 6 // 10000
+    return bitrate
+
+
+class ReadSizer:
+    """Decides how many bytes to read from a pipeline at a time.
+
+    This one always uses the same size; see AdaptiveReadSizer.
+    """
+
+    def __init__(self, size: int):
+        self.size: int = size
+        # The largest size that this will ever return.
+        self.max_size: int = size
+
+    def update(self, nbytes: int) -> None:
+        """Records that a read returned `nbytes` bytes."""
+
+
+class AdaptiveReadSizer(ReadSizer):
+    """Sizes reads to match the measured output rate of a pipeline.
+
+    Reads from a pipe return whatever is available, so the read size is an
+    upper bound: too small, and a fast encoder needs thousands of syscalls per
+    second; too large, and a slow encoder's output gets delivered in chunks
+    that each hold a long stretch of audio.  This measures the throughput over
+    short windows and picks the power of two closest to what the pipeline
+    produces in `target_latency_ms`, clamped to `[min_size, max_size]`.
+    """
+
+    # How long to measure throughput for before reconsidering the size.
+    _WINDOW_S = 0.5
+    # Weight of the latest window in the smoothed throughput.
+    _SMOOTHING = 0.5
+
+    def __init__(self,
+                 size: int,
+                 min_size: int,
+                 max_size: int,
+                 target_latency_ms: int,
+                 debug: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__(min(max(size, min_size), max_size))
+        self.min_size = min_size
+        self.max_size = max_size
+        self._target_latency_ms = target_latency_ms
+        self._debug = debug
+        self._clock = clock
+
+        self._rate: Optional[float] = None
+        self._window_bytes: int = 0
+        self._window_start: float = clock()
+
+    def update(self, nbytes: int) -> None:
+        self._window_bytes += nbytes
+        now = self._clock()
+        elapsed = now - self._window_start
+        if elapsed < self._WINDOW_S:
+            return
+
+        rate = self._window_bytes / elapsed
+        if self._rate is None:
+            self._rate = rate
+        else:
+            self._rate += self._SMOOTHING * (rate - self._rate)
+        self._window_bytes = 0
+        self._window_start = now
+
+        wanted = max(1, int(self._rate * self._target_latency_ms / 1000))
+        # Rounding to a power of two keeps the size from jittering.
+        size = 1 << round(math.log2(wanted))
+        size = min(max(size, self.min_size), self.max_size)
+        if size != self.size:
+            self.size = size
+            if self._debug:
+                print(f":::stream::: read size {size} bytes at "
+                      f"{self._rate / 1024:.1f} KiB/s")
+
+
+def read_pipeline(pipeline: Pipeline, sizer: ReadSizer) -> Iterator[bytes]:
+    """Yields the output of a pipeline that serves a single client.
+
+    The pipeline is stopped once it finishes or the client goes away.
+    """
+    try:
+        yield from pipeline.read_chunks(sizer)
+    finally:
+        pipeline.close()
+
+
+# How often the measured encode rate is printed.
+ENCODE_PROGRESS_INTERVAL = 30.0
+
+
+def log_encode_progress(stream, target_fps: Optional[float] = None) -> None:
+    """Prints the encode rate from ffmpeg's -progress reports.
+
+    `stream` is ffmpeg's stderr.  Every ENCODE_PROGRESS_INTERVAL seconds, this
+    prints the frame rate over the interval, and warns when it falls short of
+    `target_fps`.  Everything that isn't a progress report is passed through.
+    """
+    last_time = time.monotonic()
+    last_frame = 0
+    for raw_line in stream:
+        line = raw_line.decode(errors="replace").rstrip()
+        key, sep, value = line.partition("=")
+        if not sep or not key.replace("_", "").isalnum():
+            print(line, file=sys.stderr)
+            continue
+
+        if key != "frame":
+            continue
+        frame = int(value)
+        now = time.monotonic()
+        if now - last_time < ENCODE_PROGRESS_INTERVAL:
+            continue
+
+        fps = (frame - last_frame) / (now - last_time)
+        last_time, last_frame = now, frame
+        print(colors.options("Encoding at:") + f" {fps:.1f} fps")
+        if target_fps is not None and fps < 0.95 * target_fps:
+            print(colors.warning(
+                f"The encoder can't keep up with {target_fps:g} fps; try a "
+                "lower --resolution or --fps."))
+    stream.close()
+
+
+class ChunkRing:
+    """A bounded ring of stream chunks, addressed by sequence number.
+
+    This holds the shared state behind the broadcasters; it does no locking of
+    its own.
+    """
+
+    def __init__(self,
+                 max_chunks: int,
+                 framer: Optional[StreamFramer] = None):
+        self._chunks: collections.deque[bytes] = collections.deque(
+            maxlen=max_chunks)
+        self._framer = framer
+        # Sequence number that the next appended chunk will get.
+        self.next_seq: int = 0
+
+    @property
+    def header(self) -> bytes:
+        """What every reader has to be sent before any of the chunks."""
+        return self._framer.header if self._framer else b""
+
+    def append(self, chunk: bytes) -> None:
+        if self._framer:
+            chunk = self._framer.feed(chunk)
+            if not chunk:
+                return
+        self._chunks.append(chunk)
+        self.next_seq += 1
+
+    def clear(self) -> None:
+        self._chunks.clear()
+        if self._framer:
+            self._framer.reset()
+
+    def backlog_start(self, backlog_bytes: int) -> tuple[int, bytes]:
+        """Finds where a new reader should start.
+
+        Args:
+            backlog_bytes: At most how much already-buffered output to replay
+                before the live output, limited to what is still in the ring.
+                If a framer was provided, the backlog starts at the first sync
+                point within that budget or, if there is none, at the last
+                sync point before it, so that a reader always starts on a
+                clean boundary.
+
+        Returns:
+            A tuple of (cursor, head), where head is a partial chunk to send
+            before the chunks starting at cursor.
+        """
+        chunks = list(self._chunks)
+        # Finds the oldest position within the budget.
+        index = len(chunks)
+        offset = 0
+        remaining = backlog_bytes
+        while index > 0 and remaining > 0:
+            index -= 1
+            if len(chunks[index]) > remaining:
+                offset = len(chunks[index]) - remaining
+                break
+            remaining -= len(chunks[index])
+
+        if self._framer:
+            index, offset = self._find_boundary(chunks, index, offset)
+
+        oldest = self.next_seq - len(chunks)
+        if index == len(chunks):
+            return self.next_seq, b""
+        if offset == 0:
+            return oldest + index, b""
+        return oldest + index + 1, chunks[index][offset:]
+
+    def _find_boundary(self,
+                       chunks: list[bytes],
+                       index: int,
+                       offset: int) -> tuple[int, int]:
+        """Returns the sync point nearest to a position, as (index, offset)."""
+        for i in range(index, len(chunks)):
+            found = self._framer.find_sync(chunks[i], offset if i == index else 0)
+            if found != -1:
+                return i, found
+
+        # Nothing within the budget, so this backs up to the last sync point.
+        for i in range(min(index, len(chunks) - 1), -1, -1):
+            end = offset if i == index else len(chunks[i])
+            found = self._framer.last_sync(chunks[i], end)
+            if found != -1:
+                return i, found
+
+        return len(chunks), 0
+
+    def read_from(self, cursor: int) -> tuple[list[bytes], int]:
+        """Returns the chunks from cursor onwards, and the cursor after them.
+
+        A cursor that has fallen out of the ring skips ahead to the oldest
+        chunk that is still available.
+        """
+        oldest = self.next_seq - len(self._chunks)
+        cursor = max(cursor, oldest)
+        pending = list(itertools.islice(self._chunks, cursor - oldest, None))
+        return pending, self.next_seq
+
+
+class StreamBroadcaster:
+    """Runs a single streaming pipeline and fans its output out to many clients.
+
+    The pipeline is started by the first subscriber (or an explicit call to
+    `start`), and its output is kept in a bounded ring of chunks.  Every
+    subscriber holds its own cursor into that ring, so adding listeners doesn't
+    add encoders.  A subscriber that falls more than a full ring behind skips
+    ahead to the oldest chunk that is still available.
+
+    The pipeline is stopped when the last subscriber leaves, unless
+    `keep_running` is set.  If the pipeline exits on its own, current
+    subscribers drain whatever is left and then finish, and the next subscriber
+    starts a fresh pipeline.
+
+    A late subscriber never sees the beginning of the stream.  Streams that
+    need a header, or that can only be joined at certain points, need a
+    framer; see `framer_for_codec`.
+    """
+
+    def __init__(self,
+                 start_pipeline: Callable[[], Pipeline],
+                 sizer: ReadSizer,
+                 max_chunks: int = 256,
+                 framer: Optional[StreamFramer] = None):
+        self._start_pipeline = start_pipeline
+        self._sizer = sizer
+        self.keep_running: bool = False
+
+        self._cond = threading.Condition()
+        self._ring = ChunkRing(max_chunks, framer)
+        self._pipeline: Optional[Pipeline] = None
+        self._subscribers: int = 0
+
+    def start(self) -> None:
+        """Starts the pipeline, unless it is already running."""
+        with self._cond:
+            self._start_locked()
+
+    def _start_locked(self) -> Pipeline:
+        if self._pipeline is None:
+            self._pipeline = self._start_pipeline()
+            self._ring.clear()
+
+            reader = threading.Thread(target=self._read_loop,
+                                      args=(self._pipeline,))
+            reader.daemon = True
+            reader.start()
+
+        return self._pipeline
+
+    def subscribe(self, backlog_bytes: int = 0) -> Iterator[bytes]:
+        """Returns an iterator over pipeline output.
+
+        Args:
+            backlog_bytes: See `ChunkRing.backlog_start`.
+        """
+        with self._cond:
+            pipeline = self._start_locked()
+            self._subscribers += 1
+            cursor, head = self._ring.backlog_start(backlog_bytes)
+
+        return self._iter_from(pipeline, cursor, head)
+
+    def _iter_from(self,
+                   pipeline: Pipeline,
+                   cursor: int,
+                   head: bytes = b"") -> Iterator[bytes]:
+        try:
+            # The stream header goes out before anything else.  It may not be
+            # complete yet when the pipeline has only just started.
+            sent_header = False
+            if head:
+                with self._cond:
+                    header = self._ring.header
+                if header:
+                    yield header
+                sent_header = True
+                yield head
+
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: (cursor < self._ring.next_seq
+                                 or self._pipeline is not pipeline))
+                    if cursor >= self._ring.next_seq:
+                        # Our pipeline is gone, and we've sent everything it
+                        # produced.
+                        return
+
+                    pending, cursor = self._ring.read_from(cursor)
+                    header = b"" if sent_header else self._ring.header
+
+                if header:
+                    yield header
+                sent_header = True
+                yield from pending
+        finally:
+            self._unsubscribe()
+
+    def _unsubscribe(self) -> None:
+        with self._cond:
+            self._subscribers -= 1
+            if self._subscribers or self.keep_running:
+                return
+
+            pipeline = self._pipeline
+            self._pipeline = None
+            self._cond.notify_all()
+
+        # The reader thread notices the pipeline exiting, and cleans up.
+        if pipeline is not None:
+            pipeline.stop()
+
+    def _read_loop(self, pipeline: Pipeline) -> None:
+        chunks = pipeline.read_chunks(self._sizer)
+        for chunk in chunks:
+            with self._cond:
+                if self._pipeline is not pipeline:
+                    # Stopped because everyone left.
+                    break
+
+                self._ring.append(chunk)
+                self._cond.notify_all()
+        else:
+            with self._cond:
+                if self._pipeline is pipeline:
+                    self._pipeline = None
+                    self._cond.notify_all()
+
+        chunks.close()
+        pipeline.close()
+
+
+class _AsyncPipelineProtocol(asyncio.Protocol):
+    """Hands data from a pipeline's output pipe to an AsyncStreamBroadcaster."""
+
+    def __init__(self, broadcaster: "AsyncStreamBroadcaster", pipeline: Pipeline):
+        self._broadcaster = broadcaster
+        self._pipeline = pipeline
+
+    def data_received(self, data: bytes) -> None:
+        self._broadcaster._on_data(self._pipeline, data)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._broadcaster._on_exit(self._pipeline)
+
+
+class AsyncStreamBroadcaster:
+    """The asyncio counterpart of StreamBroadcaster.
+
+    The pipeline's output pipe is read without blocking by the event loop, and
+    subscribers are async iterators.  This must only be used from the thread
+    running the event loop.
+    """
+
+    def __init__(self,
+                 start_pipeline: Callable[[], Pipeline],
+                 max_chunks: int = 256,
+                 framer: Optional[StreamFramer] = None):
+        self._start_pipeline = start_pipeline
+        self.keep_running: bool = False
+
+        self._ring = ChunkRing(max_chunks, framer)
+        self._changed = asyncio.Event()
+        self._pipeline: Optional[Pipeline] = None
+        self._transport: Optional[asyncio.BaseTransport] = None
+        self._subscribers: int = 0
+
+    async def start(self) -> Pipeline:
+        """Starts the pipeline, unless it is already running."""
+        if self._pipeline is None:
+            pipeline = self._start_pipeline()
+            self._pipeline = pipeline
+            self._ring.clear()
+
+            loop = asyncio.get_running_loop()
+            self._transport, _ = await loop.connect_read_pipe(
+                lambda: _AsyncPipelineProtocol(self, pipeline), pipeline.stdout)
+
+        return self._pipeline
+
+    async def subscribe(self, backlog_bytes: int = 0) -> AsyncIterator[bytes]:
+        """Yields pipeline output.
+
+        Args:
+            backlog_bytes: See `ChunkRing.backlog_start`.
+        """
+        pipeline = await self.start()
+        self._subscribers += 1
+        cursor, head = self._ring.backlog_start(backlog_bytes)
+
+        try:
+            # See StreamBroadcaster._iter_from.
+            sent_header = False
+            if head:
+                if self._ring.header:
+                    yield self._ring.header
+                sent_header = True
+                yield head
+
+            while True:
+                changed = self._changed
+                if cursor < self._ring.next_seq:
+                    pending, cursor = self._ring.read_from(cursor)
+                    if not sent_header and self._ring.header:
+                        yield self._ring.header
+                    sent_header = True
+                    for chunk in pending:
+                        yield chunk
+                elif self._pipeline is not pipeline:
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            self._subscribers -= 1
+            if not self._subscribers and not self.keep_running:
+                await self._stop()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _on_data(self, pipeline: Pipeline, data: bytes) -> None:
+        if pipeline is self._pipeline:
+            self._ring.append(data)
+            self._notify()
+
+    def _on_exit(self, pipeline: Pipeline) -> None:
+        if pipeline is self._pipeline:
+            self._pipeline = None
+            self._transport = None
+            self._notify()
+
+        asyncio.get_running_loop().run_in_executor(None, pipeline.close)
+
+    async def _stop(self) -> None:
+        transport = self._transport
+        self._pipeline = None
+        self._transport = None
+        self._notify()
+
+        if transport is not None:
+            # Closing the transport leads to _on_exit, which cleans up.
+            transport.close()
+
+
 # TODO(xsdg): Consider porting to https://github.com/pallets-eco/flask-classful
 # for a more natural approach to using Flask in an encapsulated way.
 class FlaskServer:
@@ -39,9 +1104,15 @@ class FlaskServer:
 
     _app: Optional[flask.Flask] = None
     _video_mode: Optional[bool] = None
+    _broadcaster: Optional[StreamBroadcaster] = None
+    # How much already-encoded audio to send to new clients.  This is only
+    # non-zero for a prewarmed pipeline.
+    _backlog_bytes: int = 0
+    _prewarm_backlog_ms: int = 300
 
     _mkcc: mkchromecast.Mkchromecast
     _stream_url: str = "stream"
+    _hls_url: str = "hls"
 
     # Common arguments.
     _command: Union[str, list[str]]
@@ -55,9 +1126,36 @@ class FlaskServer:
     _codec: str
     _platform: str
     _samplerate: str
+    _latency_profile: constants.LatencyProfile = (
+        constants.LATENCY_PROFILES["balanced"])
 
     # Video arguments.
     _chunk_size: int
+    # Whether the video command writes -progress reports to stderr, and the
+    # frame rate that the encode should keep up with.
+    _log_progress: bool = False
+    _target_fps: Optional[float] = None
+    # When set, the video is transcoded once and then streamed from the cache.
+    _transcode_cache: Optional[transcode_cache.TranscodeCache] = None
+    _cache_key: Optional[str] = None
+    # When set, this file is served as it is, with support for byte ranges,
+    # so that the device can seek in it.  The command isn't run.
+    _static_file: Optional["StaticFile"] = None
+
+    # When set, read sizes follow the pipeline throughput.
+    _read_sizing: Optional[ReadSizing] = None
+    # When set, audio is encoded in this process; see PyAVPipeline.
+    _pyav_output: Optional[PyAVOutput] = None
+    # When set, the parec and pyav backends capture the monitor in this
+    # process, a fragment of this many bytes at a time, if they can.
+    _capture_fragment_size: Optional[int] = None
+
+    # When set, the command writes HLS segments to this store, which are
+    # served from `/hls/` instead of streaming from `/stream`.
+    _segment_store: Optional[segment_store.SegmentStore] = None
+    _segmenter: Optional[Popen] = None
+    # How long a request for the playlist waits for the first segment.
+    _playlist_timeout: float = 10.0
 
     @staticmethod
     def _init_common(video_mode: bool) -> None:
@@ -74,6 +1172,8 @@ class FlaskServer:
         else:
             FlaskServer._app.add_url_rule("/stream",
                                           view_func=FlaskServer._stream_audio)
+        FlaskServer._app.add_url_rule(f"/{FlaskServer._hls_url}/<name>",
+                                      view_func=FlaskServer._stream_segment)
 
         FlaskServer._video_mode = video_mode
 
@@ -86,7 +1186,13 @@ class FlaskServer:
                    command: Union[str, list[str]],
                    media_type: str,
                    platform: str,
-                   samplerate: str) -> None:
+                   samplerate: str,
+                   read_sizing: Optional[ReadSizing] = None,
+                   latency_profile: Optional[constants.LatencyProfile] = None,
+                   pyav_output: Optional[PyAVOutput] = None,
+                   hls_store: Optional[segment_store.SegmentStore] = None,
+                   capture_fragment_size: Optional[int] = None,
+                   ) -> None:
         FlaskServer._init_common(video_mode=False)
 
         FlaskServer._adevice = adevice
@@ -98,16 +1204,93 @@ class FlaskServer:
         FlaskServer._media_type = media_type
         FlaskServer._platform = platform
         FlaskServer._samplerate = samplerate
+        FlaskServer._read_sizing = read_sizing
+        FlaskServer._pyav_output = pyav_output
+        FlaskServer._segment_store = hls_store
+        FlaskServer._capture_fragment_size = capture_fragment_size
+        if latency_profile is not None:
+            FlaskServer._latency_profile = latency_profile
+            FlaskServer._prewarm_backlog_ms = latency_profile.backlog_ms
+
+        # When the stream can be joined midway, all audio clients share a
+        # single capture and encode pipeline.  Otherwise, every client needs
+        # its own pipeline, so that it receives the whole stream.
+        # HLS clients share the segments instead.
+        if codec in constants.JOINABLE_CODECS and hls_store is None:
+            FlaskServer._broadcaster = StreamBroadcaster(
+                FlaskServer._start_audio_pipeline,
+                FlaskServer._read_sizer(),
+                framer=framer_for_codec(codec))
 
     @staticmethod
     def init_video(chunk_size: int,
                    command: Union[str, list[str]],
-                   media_type: str) -> None:
+                   media_type: str,
+                   read_sizing: Optional[ReadSizing] = None,
+                   log_progress: bool = False,
+                   target_fps: Optional[float] = None,
+                   cache: Optional[transcode_cache.TranscodeCache] = None,
+                   cache_key: Optional[str] = None,
+                   file_path: Optional[str] = None,
+                   hls_store: Optional[segment_store.SegmentStore] = None,
+                   ) -> None:
         FlaskServer._init_common(video_mode=True)
 
         FlaskServer._chunk_size = chunk_size
         FlaskServer._command = command
         FlaskServer._media_type = media_type
+        FlaskServer._read_sizing = read_sizing
+        FlaskServer._log_progress = log_progress
+        FlaskServer._target_fps = target_fps
+        if cache_key is not None:
+            FlaskServer._transcode_cache = cache
+            FlaskServer._cache_key = cache_key
+        if file_path is not None:
+            FlaskServer._static_file = StaticFile(file_path, media_type)
+        FlaskServer._segment_store = hls_store
+
+    @staticmethod
+    def prewarm() -> None:
+        """Starts the audio pipeline before any client has connected.
+
+        New clients are then sent the most recent few hundred milliseconds of
+        encoded audio, rather than waiting for the pipeline to start up.
+        """
+        FlaskServer._ensure_audio_mode()
+
+        FlaskServer._backlog_bytes = prewarm_backlog_bytes(
+            FlaskServer._stream_bitrate(), FlaskServer._prewarm_backlog_ms)
+        FlaskServer._broadcaster.keep_running = True
+        FlaskServer._broadcaster.start()
+
+    @staticmethod
+    def start_segmenter() -> None:
+        """Starts the command that writes HLS segments, for every client."""
+        FlaskServer._ensure_initialized()
+
+        store = FlaskServer._segment_store
+        store.reset()
+        if FlaskServer._log_progress:
+            FlaskServer._segmenter = Popen(FlaskServer._command, stdin=DEVNULL,
+                                           stderr=PIPE)
+            threading.Thread(target=log_encode_progress,
+                             args=(FlaskServer._segmenter.stderr,
+                                   FlaskServer._target_fps),
+                             daemon=True).start()
+        else:
+            FlaskServer._segmenter = Popen(FlaskServer._command, stdin=DEVNULL)
+        print(colors.options("Writing HLS segments to:")
+              + f" {store.directory}")
+
+    @staticmethod
+    def stop_segmenter() -> None:
+        """Stops the HLS segmenter, if any, and removes its segments."""
+        if FlaskServer._segmenter is not None:
+            FlaskServer._segmenter.kill()
+            FlaskServer._segmenter.wait()
+            FlaskServer._segmenter = None
+        if FlaskServer._segment_store is not None:
+            FlaskServer._segment_store.remove()
 
     @staticmethod
     def run(host: str, port: int) -> None:
@@ -116,13 +1299,17 @@ class FlaskServer:
         # NOTE(xsdg): video.py used threaded=True and didn't specify
         # passthrough_errors.  audio.py used passthrough_errors=False and didn't
         # specify threaded.
-        # I _believe_ that threaded is a bad idea, since it would potentially
-        # launch multiple streaming pipelines.  I could be wrong about that,
-        # though.
+        # Threading is only safe when every request subscribes to the same
+        # StreamBroadcaster, or reads the same served files.  Otherwise,
+        # concurrent requests would each launch their own streaming pipeline.
+        threaded = (FlaskServer._broadcaster is not None
+                    or FlaskServer._static_file is not None
+                    or FlaskServer._segment_store is not None)
 
         # Original comment: Note that passthrough_errors=False is useful when
         # reconnecting. In that way, flask won't die.
-        FlaskServer._app.run(host=host, port=port, passthrough_errors=False)
+        FlaskServer._app.run(host=host, port=port, threaded=threaded,
+                             passthrough_errors=False)
 
     @staticmethod
     def _ensure_initialized():
@@ -149,65 +1336,727 @@ class FlaskServer:
     def _index() -> FlaskViewReturn:
         FlaskServer._ensure_initialized()
 
+        if FlaskServer._segment_store is not None:
+            source = f"/{FlaskServer._hls_url}/{segment_store.PLAYLIST}"
+            source_type = segment_store.PLAYLIST_MEDIA_TYPE
+        elif FlaskServer._video_mode:
+            source = FlaskServer._stream_url
+            source_type = FlaskServer._media_type
+        else:
+            source = FlaskServer._stream_url
+            source_type = "audio/mp3"
+
         # TODO(xsdg): Add head and body tags?
         if FlaskServer._video_mode:
             return textwrap.dedent(f"""\
                 <!doctype html>
-                <title>Play {FlaskServer._stream_url}</title>
+                <title>Play {source}</title>
                 <video controls autoplay >
-                    <source src="{FlaskServer._stream_url}" type="video/mp4" >
+                    <source src="{source}" type="{source_type}" >
                     Your browser does not support this video format.
                 </video>
                 """)
         else:
             return textwrap.dedent(f"""\
                 <!doctype html>
-                <title>Play {FlaskServer._stream_url}</title>
+                <title>Play {source}</title>
                 <audio controls autoplay >
-                    <source src="{FlaskServer._stream_url}" type="audio/mp3" >
+                    <source src="{source}" type="{source_type}" >
                     Your browser does not support this audio format.
                 </audio>
                 """)
 
+    @staticmethod
+    def _serves_hls() -> bool:
+        """Whether clients are served HLS segments, instead of `/stream`.
+
+        Serving `/stream` as well would start a second encoder.
+        """
+        return FlaskServer._segment_store is not None
+
     @staticmethod
     def _stream_video() -> flask.Response:
         FlaskServer._ensure_video_mode()
+        if FlaskServer._serves_hls():
+            flask.abort(404)
+
+        if FlaskServer._static_file is not None:
+            # Answers Range requests, with 206 and 416 responses as needed.
+            return flask.send_file(FlaskServer._static_file.path,
+                                   mimetype=FlaskServer._media_type,
+                                   conditional=True)
 
-        process = Popen(FlaskServer._command, stdout=PIPE, bufsize=-1)
-        read_chunk = partial(os.read, process.stdout.fileno(), FlaskServer._chunk_size)
-        return flask.Response(iter(read_chunk, b""), mimetype=FlaskServer._media_type)
+        return flask.Response(read_pipeline(FlaskServer._start_pipeline(),
+                                            FlaskServer._read_sizer()),
+                              mimetype=FlaskServer._media_type)
 
     @staticmethod
-    def _stream_audio():
+    def _segment_path(name: str) -> Optional[str]:
+        """Returns the HLS playlist or segment with the name, if there is one.
+
+        The playlist only appears once the first segment is written, so a
+        request for it waits for that.
+        """
+        store = FlaskServer._segment_store
+        if store is None:
+            return None
+        if name == segment_store.PLAYLIST:
+            store.wait_for_playlist(FlaskServer._playlist_timeout)
+        path = store.path_for(name)
+        return str(path) if path is not None else None
+
+    @staticmethod
+    def _stream_segment(name: str) -> flask.Response:
+        FlaskServer._ensure_initialized()
+
+        path = FlaskServer._segment_path(name)
+        if path is None:
+            flask.abort(404)
+        try:
+            # The playlist changes with every segment, so it's never cached.
+            return flask.send_file(
+                path, mimetype=segment_store.SegmentStore.media_type(name),
+                conditional=True, max_age=0)
+        except FileNotFoundError:
+            # ffmpeg deleted the segment once it left the playlist.
+            flask.abort(404)
+
+    @staticmethod
+    def _stream_audio() -> flask.Response:
         FlaskServer._ensure_audio_mode()
+        if FlaskServer._serves_hls():
+            flask.abort(404)
+
+        stream: Iterator[bytes]
+        if FlaskServer._broadcaster is not None:
+            stream = FlaskServer._broadcaster.subscribe(
+                backlog_bytes=FlaskServer._backlog_bytes)
+        else:
+            stream = read_pipeline(FlaskServer._start_pipeline(),
+                                   FlaskServer._read_sizer())
+
+        return flask.Response(stream, mimetype=FlaskServer._media_type)
+
+    @staticmethod
+    def _stream_bitrate() -> int:
+        return stream_bitrate(FlaskServer._codec, FlaskServer._bitrate,
+                              int(FlaskServer._samplerate))
+
+    @staticmethod
+    def _read_sizer() -> ReadSizer:
+        """Decides how many bytes to read from a new pipeline at a time."""
+        FlaskServer._ensure_initialized()
+        if FlaskServer._video_mode:
+            size = FlaskServer._chunk_size
+        else:
+            size = FlaskServer._buffer_size
+
+        sizing = FlaskServer._read_sizing
+        if sizing is None:
+            return ReadSizer(size)
+        return AdaptiveReadSizer(size,
+                                 min_size=sizing.min_size,
+                                 max_size=sizing.max_size,
+                                 target_latency_ms=sizing.target_latency_ms,
+                                 debug=sizing.debug)
+
+    @staticmethod
+    def _start_pipeline() -> Pipeline:
+        """Starts a pipeline that serves a single client."""
+        FlaskServer._ensure_initialized()
+        if FlaskServer._video_mode:
+            return FlaskServer._start_video_pipeline()
+        return FlaskServer._start_audio_pipeline()
+
+    @staticmethod
+    def _start_video_pipeline() -> Pipeline:
+        cache = FlaskServer._transcode_cache
+        if cache is not None:
+            cached = cache.lookup(FlaskServer._cache_key)
+            if cached is not None:
+                try:
+                    return CachedFilePipeline(cached)
+                except OSError:
+                    # It was evicted in the meantime.
+                    pass
+
+        if FlaskServer._log_progress:
+            process = Popen(FlaskServer._command, stdout=PIPE, stderr=PIPE,
+                            bufsize=-1)
+            threading.Thread(target=log_encode_progress,
+                             args=(process.stderr, FlaskServer._target_fps),
+                             daemon=True).start()
+        else:
+            process = Popen(FlaskServer._command, stdout=PIPE, bufsize=-1)
 
+        if cache is not None:
+            return CachingPipeline(process,
+                                   cache.create(FlaskServer._cache_key))
+        return Pipeline([process])
+
+    @staticmethod
+    def _start_audio_pipeline() -> Pipeline:
         if (
             FlaskServer._platform == "Linux"
             and FlaskServer._backend.name == "parec"
             and FlaskServer._backend.path is not None
         ):
+            capture = FlaskServer._open_capture()
+            if capture is not None:
+                try:
+                    encoder = Popen(FlaskServer._command, stdin=PIPE,
+                                    stdout=PIPE, bufsize=-1)
+                except FileNotFoundError:
+                    capture.close()
+                    print("Failed to execute {}".format(FlaskServer._command))
+                    message = "Have you installed lame, see https://github.com/muammar/mkchromecast#linux-1?"
+                    raise Exception(message)
+                return PulseCapturePipeline(capture, encoder)
+
             c_parec = [FlaskServer._backend.path, "--format=s16le", "-d", "Mkchromecast.monitor"]
-            parec = Popen(c_parec, stdout=PIPE)
+            parec = Popen(c_parec + FlaskServer._capture_latency_args(),
+                          stdout=PIPE)
 
             try:
                 process = Popen(FlaskServer._command, stdin=parec.stdout, stdout=PIPE, bufsize=-1)
             except FileNotFoundError:
+                parec.kill()
+                parec.wait()
                 print("Failed to execute {}".format(FlaskServer._command))
                 message = "Have you installed lame, see https://github.com/muammar/mkchromecast#linux-1?"
                 raise Exception(message)
+            finally:
+                # The encoder holds its own copy; closing ours lets parec see
+                # SIGPIPE once the encoder exits.
+                parec.stdout.close()
+
+            return Pipeline([parec, process])
+
+        if FlaskServer._pyav_output is not None:
+            # The command only captures; we encode.
+            capture = FlaskServer._open_capture() or Popen(
+                FlaskServer._command + FlaskServer._capture_latency_args(),
+                stdout=PIPE)
+            return PyAVPipeline(capture, FlaskServer._pyav_output)
+
+        return Pipeline([Popen(FlaskServer._command, stdout=PIPE, bufsize=-1)])
+
+    @staticmethod
+    def _open_capture() -> Optional[pulse_capture.PulseCapture]:
+        """Captures the monitor in this process, instead of with parec.
+
+        Returns None when that isn't configured or isn't possible, in which
+        case parec is run as before.
+        """
+        if (FlaskServer._capture_fragment_size is None
+                or not pulse_capture.available()):
+            return None
+        try:
+            return pulse_capture.PulseCapture(
+                FlaskServer._capture_fragment_size)
+        except OSError as e:
+            print(colors.warning(f"Capturing with parec instead: {e}"))
+            return None
+
+    @staticmethod
+    def _capture_latency_args() -> list[str]:
+        """Returns the parec arguments for the latency profile."""
+        capture_ms = FlaskServer._latency_profile.capture_ms
+        if capture_ms is None:
+            return []
+        return [f"--latency-msec={capture_ms}"]
+
+
+def splice_to_socket(src_fd: int, sock: socket.socket, sizer: ReadSizer) -> None:
+    """Moves everything from a pipe to a socket until the pipe hits EOF.
+
+    Where os.splice is available (Linux), the data never enters userspace.
+    Elsewhere, it is read into a single reusable buffer and sent from there.
+    """
+    if hasattr(os, "splice"):
+        dst_fd = sock.fileno()
+        while True:
+            try:
+                size = os.splice(src_fd, dst_fd, sizer.size)
+            except OSError as e:
+                # EINVAL: this pair of file descriptors can't be spliced.
+                if e.errno != errno.EINVAL:
+                    raise
+                break
+            if not size:
+                return
+            sizer.update(size)
+
+    view = memoryview(bytearray(sizer.max_size))
+    while True:
+        size = os.readv(src_fd, [view[:sizer.size]])
+        if not size:
+            return
+        sizer.update(size)
+        sock.sendall(view[:size])
+
+
+# The most that sendfile_to_socket reads at a time, without os.sendfile.
+_SENDFILE_BLOCK_SIZE = 1024 * 1024
 
-        else:
-            process = Popen(FlaskServer._command, stdout=PIPE, bufsize=-1)
-        read_chunk = partial(os.read, process.stdout.fileno(), FlaskServer._buffer_size)
-        return flask.Response(iter(read_chunk, b""), mimetype=FlaskServer._media_type)
+
+def sendfile_to_socket(fd: int,
+                       sock: socket.socket,
+                       offset: int,
+                       length: int) -> None:
+    """Sends `length` bytes of a file, starting at `offset`, to a socket.
+
+    Where os.sendfile is available, the data never enters userspace.  The
+    offset of the file descriptor isn't used, so concurrent requests can share
+    it.
+    """
+    if hasattr(os, "sendfile"):
+        dst_fd = sock.fileno()
+        while length > 0:
+            try:
+                size = os.sendfile(dst_fd, fd, offset, length)
+            except OSError as e:
+                # EINVAL: this pair of file descriptors can't use sendfile.
+                if e.errno not in (errno.EINVAL, errno.ENOTSOCK):
+                    raise
+                break
+            if not size:
+                # The file was truncated.
+                return
+            offset += size
+            length -= size
+
+    while length > 0:
+        data = os.pread(fd, min(length, _SENDFILE_BLOCK_SIZE), offset)
+        if not data:
+            return
+        sock.sendall(data)
+        offset += len(data)
+        length -= len(data)
+
+
+def _response_headers(status: str,
+                      content_type: str,
+                      extra: Optional[dict[str, str]] = None) -> bytes:
+    """Builds the headers for the streaming servers that bypass Flask.
+
+    Without a Content-Length, the end of the body is signalled by closing the
+    connection.
+    """
+    extra_lines = "".join(f"{name}: {value}\r\n"
+                          for name, value in (extra or {}).items())
+    return (f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            "Cache-Control: no-cache\r\n"
+            f"{extra_lines}"
+            "Connection: close\r\n"
+            "\r\n").encode("latin-1")
+
+
+def _parse_request_path(request_line: bytes) -> Optional[tuple[str, str]]:
+    """Returns the (method, path) of an HTTP request line, if it's valid."""
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        return None
+    return parts[0], parts[1].split("?", 1)[0]
+
+
+def _parse_range_header(header_line: bytes) -> Optional[str]:
+    """Returns the value of a request header line, if it's the Range header."""
+    name, _, value = header_line.decode("latin-1").partition(":")
+    if name.strip().lower() != "range":
+        return None
+    return value.strip()
+
+
+def parse_byte_range(header: Optional[str],
+                     size: int) -> Optional[tuple[int, int]]:
+    """Returns the (offset, length) that a Range header asks for.
+
+    Returns None when the whole file should be sent, which is also how
+    malformed headers and requests for several ranges are answered.
+
+    Raises:
+        ValueError: the range can't be satisfied.
+    """
+    if not header:
+        return None
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, sep, last = (part.strip() for part in ranges.partition("-"))
+    if (not sep or not (first or last)
+            or not all(part.isdigit() for part in (first, last) if part)):
+        return None
+
+    if not first:
+        # A suffix, as in "bytes=-500" for the last 500 bytes.
+        length = min(int(last), size)
+        if length == 0:
+            raise ValueError(f"Range {header!r} is empty")
+        return size - length, length
+
+    start = int(first)
+    if start >= size:
+        raise ValueError(f"Range {header!r} starts past {size} bytes")
+    end = min(int(last), size - 1) if last else size - 1
+    if end < start:
+        return None
+    return start, end - start + 1
+
+
+def _file_response(
+        range_header: Optional[str],
+        size: int,
+        content_type: str) -> tuple[bytes, int, int]:
+    """Builds the response to a request for a file of `size` bytes.
+
+    Returns:
+        A tuple of (headers, offset, length), where the body is `length` bytes
+        of the file from `offset`.
+    """
+    try:
+        byte_range = parse_byte_range(range_header, size)
+    except ValueError:
+        return (_response_headers("416 Range Not Satisfiable", content_type,
+                                  {"Content-Range": f"bytes */{size}",
+                                   "Content-Length": "0"}),
+                0, 0)
+
+    if byte_range is None:
+        return (_response_headers("200 OK", content_type,
+                                  {"Accept-Ranges": "bytes",
+                                   "Content-Length": str(size)}),
+                0, size)
+
+    offset, length = byte_range
+    content_range = f"bytes {offset}-{offset + length - 1}/{size}"
+    return (_response_headers("206 Partial Content", content_type,
+                              {"Accept-Ranges": "bytes",
+                               "Content-Range": content_range,
+                               "Content-Length": str(length)}),
+            offset, length)
+
+
+class StaticFile:
+    """A file that the streaming servers send as it is, with byte ranges.
+
+    The file is opened and stat'ed once, rather than for every request; the
+    device sends a new Range request whenever it seeks.  It stays readable
+    even if it's removed while it's being served.
+    """
+
+    def __init__(self, path: str, media_type: str):
+        self.path = path
+        self.media_type = media_type
+        self._fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self._fd).st_size
+
+    def __enter__(self) -> "StaticFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def response(self, range_header: Optional[str]) -> tuple[bytes, int, int]:
+        """Builds the response to a request; see _file_response."""
+        return _file_response(range_header, self.size, self.media_type)
+
+    def send(self, sock: socket.socket, offset: int, length: int) -> None:
+        sendfile_to_socket(self._fd, sock, offset, length)
+
+
+class _ZeroCopyRequestHandler(socketserver.StreamRequestHandler):
+    """Serves the `/` and `/stream` routes without going through Flask."""
+
+    def handle(self) -> None:
+        request = _parse_request_path(self.rfile.readline(65537))
+        # Range is the only request header that we need.
+        range_header = None
+        while line := self.rfile.readline(65537).strip():
+            range_header = _parse_range_header(line) or range_header
+
+        if request is None or request[0] not in {"GET", "HEAD"}:
+            self._send_headers("405 Method Not Allowed", "text/plain")
+            return
+
+        method, path = request
+        send_body = method == "GET"
+        try:
+            if path == "/":
+                self._send_headers("200 OK", "text/html; charset=utf-8")
+                if send_body:
+                    self.request.sendall(FlaskServer._index().encode("utf-8"))
+            elif path.startswith(f"/{FlaskServer._hls_url}/"):
+                self._send_segment(path.rsplit("/", 1)[1], range_header,
+                                   send_body)
+            elif (path == f"/{FlaskServer._stream_url}"
+                    and FlaskServer._serves_hls()):
+                self._send_headers("404 Not Found", "text/plain")
+            elif (path == f"/{FlaskServer._stream_url}"
+                    and FlaskServer._static_file is not None):
+                self._send_file(FlaskServer._static_file, range_header,
+                                send_body)
+            elif path == f"/{FlaskServer._stream_url}":
+                self._send_headers("200 OK", FlaskServer._media_type)
+                if send_body:
+                    self._send_stream()
+            else:
+                self._send_headers("404 Not Found", "text/plain")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away.
+            pass
+
+    def _send_headers(self, status: str, content_type: str) -> None:
+        self.request.sendall(_response_headers(status, content_type))
+
+    def _send_segment(self,
+                      name: str,
+                      range_header: Optional[str],
+                      send_body: bool) -> None:
+        segment = None
+        segment_path = FlaskServer._segment_path(name)
+        if segment_path is not None:
+            try:
+                segment = StaticFile(segment_path,
+                                     segment_store.SegmentStore.media_type(name))
+            except FileNotFoundError:
+                # ffmpeg deleted the segment once it left the playlist.
+                pass
+
+        if segment is None:
+            self._send_headers("404 Not Found", "text/plain")
+            return
+        with segment:
+            self._send_file(segment, range_header, send_body)
+
+    def _send_file(self,
+                   static_file: StaticFile,
+                   range_header: Optional[str],
+                   send_body: bool) -> None:
+        headers, offset, length = static_file.response(range_header)
+        self.request.sendall(headers)
+        if send_body and length:
+            static_file.send(self.request, offset, length)
+
+    def _send_stream(self) -> None:
+        if FlaskServer._broadcaster is not None:
+            # Chunks are shared between all subscribers, so this sends them
+            # without making any further copies.
+            stream = FlaskServer._broadcaster.subscribe(
+                backlog_bytes=FlaskServer._backlog_bytes)
+            try:
+                for chunk in stream:
+                    self.request.sendall(chunk)
+            finally:
+                stream.close()
+            return
+
+        pipeline = FlaskServer._start_pipeline()
+        try:
+            splice_to_socket(pipeline.stdout.fileno(),
+                             self.request,
+                             FlaskServer._read_sizer())
+        finally:
+            pipeline.close()
+
+
+class _ZeroCopyTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ZeroCopyServer:
+    """Streaming server that bypasses Flask for the `/stream` route.
+
+    Every connection gets its own thread, which moves pipeline output straight
+    to the client socket: per-request pipelines are spliced from the pipe to
+    the socket in the kernel, and shared pipelines are sent from the
+    broadcaster's ring without further copies.  It uses the configuration that
+    was set up through `FlaskServer.init_audio` or `FlaskServer.init_video`.
+    """
+
+    @staticmethod
+    def run(host: str, port: int) -> None:
+        FlaskServer._ensure_initialized()
+
+        with _ZeroCopyTCPServer((host, port), _ZeroCopyRequestHandler) as server:
+            print(colors.options("Zero-copy server listening on:")
+                  + f" http://{host}:{port}/")
+            server.serve_forever()
+
+
+class AsyncioServer:
+    """Streaming server that runs every connection on a single event loop.
+
+    Instead of a thread per client, connections are coroutines, so an idle
+    listener costs a socket and a little memory.  Shared audio pipelines are
+    read by the event loop through an AsyncStreamBroadcaster, and per-request
+    pipelines are read with non-blocking pipes.  It uses the configuration
+    that was set up through `FlaskServer.init_audio` or
+    `FlaskServer.init_video`.
+    """
+
+    _broadcaster: Optional[AsyncStreamBroadcaster] = None
+
+    @staticmethod
+    def run(host: str, port: int, prewarm: bool = False) -> None:
+        FlaskServer._ensure_initialized()
+        asyncio.run(AsyncioServer._serve(host, port, prewarm))
+
+    @staticmethod
+    async def _serve(host: str, port: int, prewarm: bool) -> None:
+        if FlaskServer._broadcaster is not None:
+            # The event loop reads the shared pipeline itself, so the threaded
+            # broadcaster is only used for its configuration.
+            AsyncioServer._broadcaster = AsyncStreamBroadcaster(
+                FlaskServer._start_pipeline,
+                framer=framer_for_codec(FlaskServer._codec))
+            if prewarm:
+                FlaskServer._backlog_bytes = prewarm_backlog_bytes(
+                    FlaskServer._stream_bitrate(),
+                    FlaskServer._prewarm_backlog_ms)
+                AsyncioServer._broadcaster.keep_running = True
+                await AsyncioServer._broadcaster.start()
+                print(colors.options("Prewarmed the audio pipeline"))
+
+        server = await asyncio.start_server(AsyncioServer._handle, host, port)
+        print(colors.options("Asyncio server listening on:")
+              + f" http://{host}:{port}/")
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    async def _handle(reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        try:
+            request = _parse_request_path(await reader.readline())
+            # Range is the only request header that we need.
+            range_header = None
+            while line := (await reader.readline()).strip():
+                range_header = _parse_range_header(line) or range_header
+
+            if request is None or request[0] not in {"GET", "HEAD"}:
+                writer.write(
+                    _response_headers("405 Method Not Allowed", "text/plain"))
+                return
+
+            method, path = request
+            send_body = method == "GET"
+            if path == "/":
+                writer.write(
+                    _response_headers("200 OK", "text/html; charset=utf-8"))
+                if send_body:
+                    writer.write(FlaskServer._index().encode("utf-8"))
+            elif path.startswith(f"/{FlaskServer._hls_url}/"):
+                name = path.rsplit("/", 1)[1]
+                # Waiting for the playlist blocks.
+                segment_path = await asyncio.get_running_loop().run_in_executor(
+                    None, FlaskServer._segment_path, name)
+                if segment_path is not None:
+                    try:
+                        await AsyncioServer._send_file(
+                            writer, segment_path,
+                            segment_store.SegmentStore.media_type(name),
+                            range_header, send_body)
+                    except FileNotFoundError:
+                        # ffmpeg deleted the segment once it left the
+                        # playlist.  It's opened before anything is written.
+                        segment_path = None
+                if segment_path is None:
+                    writer.write(
+                        _response_headers("404 Not Found", "text/plain"))
+            elif (path == f"/{FlaskServer._stream_url}"
+                    and FlaskServer._serves_hls()):
+                writer.write(_response_headers("404 Not Found", "text/plain"))
+            elif (path == f"/{FlaskServer._stream_url}"
+                    and FlaskServer._static_file is not None):
+                static_file = FlaskServer._static_file
+                await AsyncioServer._send_file(
+                    writer, static_file.path, static_file.media_type,
+                    range_header, send_body, size=static_file.size)
+            elif path == f"/{FlaskServer._stream_url}":
+                writer.write(
+                    _response_headers("200 OK", FlaskServer._media_type))
+                if send_body:
+                    await AsyncioServer._send_stream(writer)
+            else:
+                writer.write(_response_headers("404 Not Found", "text/plain"))
+            await writer.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away.
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _send_file(writer: asyncio.StreamWriter,
+                         path: str,
+                         content_type: str,
+                         range_header: Optional[str],
+                         send_body: bool,
+                         size: Optional[int] = None) -> None:
+        """Sends a file, given its `size` if it's already known."""
+        # The event loop seeks in the file when it can't use os.sendfile, so
+        # every request opens the file again.
+        with open(path, "rb") as served_file:
+            if size is None:
+                size = os.fstat(served_file.fileno()).st_size
+            headers, offset, length = _file_response(range_header, size,
+                                                     content_type)
+            writer.write(headers)
+            if send_body and length:
+                await writer.drain()
+                # Uses os.sendfile where the transport supports it.
+                await asyncio.get_running_loop().sendfile(
+                    writer.transport, served_file, offset, length)
+
+    @staticmethod
+    async def _send_stream(writer: asyncio.StreamWriter) -> None:
+        if AsyncioServer._broadcaster is not None:
+            stream = AsyncioServer._broadcaster.subscribe(
+                backlog_bytes=FlaskServer._backlog_bytes)
+            try:
+                async for chunk in stream:
+                    writer.write(chunk)
+                    await writer.drain()
+            finally:
+                await stream.aclose()
+            return
+
+        loop = asyncio.get_running_loop()
+        pipeline = FlaskServer._start_pipeline()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), pipeline.stdout)
+        try:
+            sizer = FlaskServer._read_sizer()
+            while chunk := await reader.read(sizer.size):
+                sizer.update(len(chunk))
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            transport.close()
+            await loop.run_in_executor(None, pipeline.close)
 
 
 # Launching the pipeline command in a separate process.
 class PipelineProcess:
-    def __init__(self, flask_init: Callable, host: str, port: int, platform: str):
+    def __init__(self,
+                 flask_init: Callable,
+                 host: str,
+                 port: int,
+                 platform: str,
+                 prewarm: bool = False,
+                 stream_server: str = "flask"):
         self._proc = multiprocessing.Process(
             target=PipelineProcess.start_app,
-            args=(flask_init, host, port, platform,)
+            args=(flask_init, host, port, platform, prewarm, stream_server,
+                  os.getpid(),)
         )
         self._proc.daemon = True
 
@@ -215,67 +2064,118 @@ class PipelineProcess:
         self._proc.start()
 
     @staticmethod
-    def start_app(flask_init: Callable, host: str, port: int, platform: str):
+    def start_app(flask_init: Callable,
+                  host: str,
+                  port: int,
+                  platform: str,
+                  prewarm: bool,
+                  stream_server: str,
+                  parent_pid: int):
         """Starting the streaming server."""
-        monitor_daemon = ParentMonitor(platform)
+        monitor_daemon = ParentMonitor(platform, parent_pid)
         monitor_daemon.start()
 
         flask_init()
-        FlaskServer.run(host=host, port=port)
+        if FlaskServer._segment_store is not None:
+            FlaskServer.start_segmenter()
+
+        if stream_server == "asyncio":
+            # The asyncio server runs its own broadcaster on the event loop.
+            AsyncioServer.run(host=host, port=port, prewarm=prewarm)
+            return
+
+        if prewarm:
+            FlaskServer.prewarm()
+
+        if stream_server == "zerocopy":
+            ZeroCopyServer.run(host=host, port=port)
+        else:
+            FlaskServer.run(host=host, port=port)
+
+
+def wait_for_exit(pid: int) -> None:
+    """Blocks until the process with the given pid has exited.
+
+    This sleeps in the kernel until the process exits: on a pidfd on Linux, or
+    on a kqueue on macOS.  Elsewhere, it falls back to polling.
+    """
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            return
+        except OSError:
+            # Linux before 5.3.
+            pass
+        else:
+            try:
+                # A pidfd becomes readable once its process has exited.
+                poller = select.poll()
+                poller.register(pidfd, select.POLLIN)
+                poller.poll()
+            finally:
+                os.close(pidfd)
+            return
+
+    if hasattr(select, "kqueue"):
+        kq = select.kqueue()
+        try:
+            event = select.kevent(
+                pid,
+                filter=select.KQ_FILTER_PROC,
+                flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                fflags=select.KQ_NOTE_EXIT)
+            kq.control([event], 1, None)
+        except ProcessLookupError:
+            pass
+        finally:
+            kq.close()
+        return
+
+    while psutil.pid_exists(pid):
+        time.sleep(0.5)
 
 
 class ParentMonitor(object):
     """Thread that terminates this process if the main process dies.
 
-    A normal running of mkchromecast will have 2 threads in the streaming
-    process when ffmpeg is used.
+    The thread sleeps until the main process exits, and then restores the
+    audio devices right away.
     """
 
-    def __init__(self, platform: str):
+    def __init__(self, platform: str, parent_pid: int):
         self._monitor_thread = threading.Thread(target=ParentMonitor._monitor_loop,
-                                                args=(platform,))
+                                                args=(platform, parent_pid))
         self._monitor_thread.daemon = True
 
     def start(self):
         self._monitor_thread.start()
 
     @staticmethod
-    def _monitor_loop(platform: str):
-        with open("/tmp/mkchromecast.pid", "rb") as pid_file:
-            main_pid = int(pickle.load(pid_file))
-        print(colors.options("PID of main process:") + f" {main_pid}")
+    def _monitor_loop(platform: str, parent_pid: int):
+        print(colors.options("PID of main process:") + f" {parent_pid}")
 
         local_pid = os.getpid()
-        print(colors.options("PID of streaming process:") + f" {os.getpid()}")
+        print(colors.options("PID of streaming process:") + f" {local_pid}")
 
-        while psutil.pid_exists(local_pid):
-            try:
-                time.sleep(0.5)
-                # With this I ensure that if the main app fails, everything
-                # will get back to normal
-                if not psutil.pid_exists(main_pid):
-                    if platform == "Darwin":
-                        inputint()
-                        outputint()
-                    else:
-                        from mkchromecast.pulseaudio import remove_sink
-
-                        remove_sink()
-                    parent = psutil.Process(local_pid)
-                    # TODO(xsdg): This is unlikely to finish, given that this
-                    # code itself is running in one of the child processes.  We
-                    # should instead signal the parent to terminate, and have it
-                    # handle child cleanup on its own.
-                    for child in parent.children(recursive=True):
-                        child.kill()
-                    parent.kill()
-
-            except KeyboardInterrupt:
-                print("Ctrl-c was requested")
-                sys.exit(0)
-            except IOError:
-                print("I/O Error")
-                sys.exit(0)
-            except OSError:
-                print("OSError")
-                sys.exit(0)
+        wait_for_exit(parent_pid)
+
+        # With this I ensure that if the main app fails, everything will get
+        # back to normal
+        if platform == "Darwin":
+            inputint()
+            outputint()
+        else:
+            from mkchromecast.pulseaudio import remove_sink
+
+            remove_sink()
+        # The segments would otherwise be left in memory, in /dev/shm.
+        FlaskServer.stop_segmenter()
+
+        parent = psutil.Process(local_pid)
+        # TODO(xsdg): This is unlikely to finish, given that this code itself
+        # is running in one of the child processes.  We should instead signal
+        # the parent to terminate, and have it handle child cleanup on its own.
+        for child in parent.children(recursive=True):
+            child.kill()
+        parent.kill()
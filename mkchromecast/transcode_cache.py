@@ -0,0 +1,196 @@
+# This file is part of mkchromecast.
+
+"""A size-bounded cache of finished video transcodes.
+
+The first cast of a file that has to be transcoded writes the encoder output to
+the cache as it streams.  Later casts of the same file, with the same encoder
+command, are then streamed from the cache instead of being encoded again.  When
+the cache grows past its size, the least recently cast transcodes are removed.
+Files that are remuxed so that they can be served with byte ranges are kept
+the same way.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import threading
+from typing import Optional, Union
+
+_SUFFIX = ".mp4"
+
+
+class CacheWriter:
+    """Writes one transcode, which only shows up in the cache once committed.
+
+    Writes after commit or abort are ignored, and so are writes past the size
+    of the cache, which aborts the entry instead.  Any thread may abort while
+    another one writes.
+    """
+
+    def __init__(self, cache: "TranscodeCache", key: str):
+        self._cache = cache
+        self._key = key
+        self._path = cache.partial_path(key)
+        self._file = None
+        self._size = 0
+        self._done = False
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes) -> None:
+        with self._lock:
+            if self._done:
+                return
+            self._size += len(data)
+            if self._size > self._cache.max_bytes:
+                self._cache.log(f"{self._key} is larger than the cache")
+                self._abort_locked()
+                return
+
+            try:
+                if self._file is None:
+                    self._cache.directory.mkdir(parents=True, exist_ok=True)
+                    self._file = open(self._path, "wb")
+                self._file.write(data)
+            except OSError as e:
+                self._cache.log(f"Couldn't write {self._path}: {e}")
+                self._abort_locked()
+
+    def commit(self) -> None:
+        """Moves the finished transcode into the cache."""
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+            if self._file is None:
+                return
+            self._file.close()
+
+        self._cache.commit(self._key, self._path)
+
+    def abort(self) -> None:
+        """Drops the transcode.  This does nothing once committed."""
+        with self._lock:
+            self._abort_locked()
+
+    def _abort_locked(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        if self._file is not None:
+            self._file.close()
+            self._remove()
+
+    def _remove(self) -> None:
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+
+class TranscodeCache:
+    """Finished transcodes in a directory, evicted least recently used first.
+
+    This is safe to use from several threads and processes.
+    """
+
+    def __init__(self,
+                 directory: os.PathLike,
+                 max_bytes: int,
+                 debug: bool = False):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self._debug = debug
+        self._evict_lock = threading.Lock()
+
+    def log(self, message: str) -> None:
+        if self._debug:
+            print(f":::transcode_cache::: {message}")
+
+    @staticmethod
+    def key(input_file: str,
+            command: Union[str, list[str]]) -> Optional[str]:
+        """Returns the cache key for transcoding a file with a command.
+
+        Files are identified by their path, size and modification time, so a
+        file that changes gets a new key.  Returns None when the input isn't a
+        local file.
+        """
+        try:
+            path = os.path.abspath(input_file)
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        identity = json.dumps([path, stat.st_size, stat.st_mtime_ns, command])
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def path_for(self, key: str) -> pathlib.Path:
+        return self.directory / f"{key}{_SUFFIX}"
+
+    def partial_path(self, key: str) -> pathlib.Path:
+        """Where this thread writes a transcode before it's committed."""
+        return self.directory / (
+            f".{key}.{os.getpid()}.{threading.get_ident()}.partial")
+
+    def lookup(self, key: str) -> Optional[pathlib.Path]:
+        """Returns the cached transcode for the key, or None."""
+        path = self.path_for(key)
+        try:
+            # Marks the transcode as the most recently used.
+            os.utime(path)
+        except OSError:
+            return None
+        self.log(f"Streaming {key} from the cache")
+        return path
+
+    def create(self, key: str) -> CacheWriter:
+        return CacheWriter(self, key)
+
+    def commit(self, key: str, partial: os.PathLike) -> Optional[pathlib.Path]:
+        """Moves a finished transcode from its partial path into the cache.
+
+        Returns the cached transcode, or None if it was larger than the cache
+        or couldn't be moved, in which case the partial file is removed.
+        """
+        path = self.path_for(key)
+        try:
+            size = os.stat(partial).st_size
+            if size > self.max_bytes:
+                self.log(f"{key} is larger than the cache")
+                os.unlink(partial)
+                return None
+            os.replace(partial, path)
+        except OSError as e:
+            self.log(f"Couldn't commit {partial}: {e}")
+            try:
+                os.unlink(partial)
+            except OSError:
+                pass
+            return None
+
+        self.log(f"Cached {size} bytes as {key}")
+        self.evict()
+        return path
+
+    def evict(self) -> None:
+        """Removes the least recently used transcodes, down to the size."""
+        with self._evict_lock:
+            entries = []
+            for path in self.directory.glob(f"*{_SUFFIX}"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                self.log(f"Evicted {path.name}")
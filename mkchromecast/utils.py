@@ -1,16 +1,16 @@
 # This file is part of mkchromecast.
 
-import json
+import math
 import os
-import pickle
 import psutil
 import socket
-import subprocess
+import tempfile
 from typing import List, Optional
 from urllib.parse import urlparse
 
 from mkchromecast import colors
 from mkchromecast import constants
+from mkchromecast import media_probe
 from mkchromecast import messages
 
 
@@ -124,6 +124,20 @@ def clamp_bitrate(codec: str, bitrate: Optional[int]) -> int:
     return bitrate
 
 
+def seek_seconds(seek: str) -> float:
+    """Converts a --seek time, as in HH:MM:SS, MM:SS or seconds, to seconds.
+
+    Raises:
+        ValueError: the time is malformed.
+    """
+    seconds = 0.0
+    for part in seek.split(":"):
+        seconds = seconds * 60 + float(part)
+    if not math.isfinite(seconds) or seconds < 0:
+        raise ValueError(f"{seek} isn't a time in the media")
+    return seconds
+
+
 def terminate() -> None:
     del_tmp()
     parent_pid = os.getpid()
@@ -133,9 +147,28 @@ def terminate() -> None:
     parent.kill()
 
 
+# Where this instance remuxes an input file to be served, when it isn't cached.
+_remuxed_file: Optional[str] = None
+
+
+def remuxed_file() -> str:
+    """Returns the file that this instance remuxes into, creating it if needed.
+
+    Every instance has its own, so that several can serve files at once.
+    """
+    global _remuxed_file
+    if _remuxed_file is None:
+        fd, _remuxed_file = tempfile.mkstemp(prefix="mkchromecast-remux-",
+                                             suffix=".mp4")
+        os.close(fd)
+    return _remuxed_file
+
+
 def del_tmp(debug: bool = False) -> None:
     """Delete files created in /tmp/"""
-    delete_me = ["/tmp/mkchromecast.tmp", "/tmp/mkchromecast.pid"]
+    delete_me = ["/tmp/mkchromecast.tmp"]
+    if _remuxed_file is not None:
+        delete_me.append(_remuxed_file)
 
     if debug:
         print(colors.important("Cleaning up /tmp/..."))
@@ -171,17 +204,6 @@ def check_url(url):
         return False
 
 
-def writePidFile() -> None:
-    pid_filename = "/tmp/mkchromecast.pid"
-    # This is to verify that pickle tmp file exists
-    if os.path.exists(pid_filename):
-        os.remove(pid_filename)
-
-    pid = str(os.getpid())
-    with open(pid_filename, "wb") as pid_file:
-        pickle.dump(pid, pid_file)
-
-
 def checkmktmp() -> None:
     # This is to verify that pickle tmp file exists
     if os.path.exists("/tmp/mkchromecast.tmp"):
@@ -189,28 +211,24 @@ def checkmktmp() -> None:
 
 
 def check_file_info(name, what=None):
-    """Check things about files"""
+    """Check things about files
 
-    command = [
-        "ffprobe",
-        "-show_format",
-        "-show_streams",
-        "-loglevel", "quiet",
-        "-print_format", "json",
-        name,
-    ]
+    This is kept for compatibility; media_probe.media_info reports everything
+    at once.
+    """
 
-    info = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    info_out, info_error = info.communicate()
-    d = json.loads(info_out)
+    # The results are cached, so asking about the same file again is cheap.
+    try:
+        video = media_probe.media_info(name).video
+    except (OSError, ValueError):
+        return None
+    if video is None:
+        return None
 
     if what == "bit-depth":
-        bit_depth = d["streams"][0]["pix_fmt"]
-        return bit_depth
+        return video.pix_fmt
     elif what == "resolution":
-        resolution = d["streams"][0]["height"]
-        resolution = str(resolution) + "p"
-        return resolution
+        return f"{video.height}p"
 
 
 def get_effective_ip(platform, host_override=None, fallback_ip="127.0.0.1"):
@@ -4,25 +4,36 @@
 Google Cast device has to point out to http://ip:5000/stream
 """
 
-import getpass
+import functools
 import os
-import pickle
 import subprocess
+from typing import Optional
 
 import mkchromecast
+from mkchromecast import codec_support
 from mkchromecast import colors
+from mkchromecast import config
+from mkchromecast import media_probe
 from mkchromecast import pipeline_builder
+from mkchromecast import segment_store
 from mkchromecast import stream_infra
+from mkchromecast import transcode_cache
 from mkchromecast import utils
 from mkchromecast.constants import OpMode
 
-def _flask_init():
-    mkcc = mkchromecast.Mkchromecast()
+# The file that the server sends to the device, instead of streaming the
+# output of ffmpeg.  The device seeks in it with byte ranges.
+served_file: Optional[str] = None
+# What the server sends, which is whatever the served file holds.
+media_type = "video/mp4"
+
 
+def _video_settings(
+        mkcc: mkchromecast.Mkchromecast) -> pipeline_builder.VideoSettings:
     # TODO(xsdg): Passing args in one-by-one to facilitate refactoring
     # the Mkchromecast object so that it has argument groups instead of just a
     # giant set of uncoordinated and conflicting arguments.
-    encode_settings = pipeline_builder.VideoSettings(
+    return pipeline_builder.VideoSettings(
         display=mkcc.display,
         fps=mkcc.fps,
         input_file=mkcc.input_file,
@@ -35,30 +46,139 @@ def _flask_init():
         user_command=mkcc.command,
         vcodec=mkcc.vcodec,
         youtube_url=mkcc.youtube_url,
+        cpu_budget=mkcc.video_cpu_budget,
+        device_generation=mkcc.device_generation,
+        hls_store=(segment_store.SegmentStore.for_port(mkcc.port) if mkcc.hls
+                   else None),
+        segment_time=mkcc.segment_time,
     )
-    builder = pipeline_builder.Video(encode_settings)
+
+
+def _transcode_cache(
+        mkcc: mkchromecast.Mkchromecast) -> transcode_cache.TranscodeCache:
+    return transcode_cache.TranscodeCache(
+        config.cache_dir(mkcc.platform) / "transcodes",
+        max_bytes=mkcc.transcode_cache * 1024**2,
+        debug=mkcc.debug)
+
+
+def _remux(mkcc: mkchromecast.Mkchromecast,
+           builder: pipeline_builder.Video) -> Optional[str]:
+    """Remuxes the input file so that it can be served, and returns the result.
+
+    The remux is kept in the transcode cache when there is one.  Returns None
+    if ffmpeg fails.
+    """
+    cache = None
+    key = None
+    if mkcc.transcode_cache is not None:
+        cache = _transcode_cache(mkcc)
+        # The output path isn't part of the key.
+        key = cache.key(mkcc.input_file, builder.remux_command(""))
+    if key is not None:
+        cached = cache.lookup(key)
+        if cached is not None:
+            return str(cached)
+        cache.directory.mkdir(parents=True, exist_ok=True)
+        output = str(cache.partial_path(key))
+    else:
+        output = utils.remuxed_file()
+
+    print(colors.options("Remuxing for seeking:") + f" {mkcc.input_file}")
+    command = builder.remux_command(output)
+    if mkcc.debug is True:
+        print(f":::ffmpeg::: remux command: {command}")
+    try:
+        subprocess.run(command, check=True, stdin=subprocess.DEVNULL,
+                       stderr=None if mkcc.debug else subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(colors.warning(f"Couldn't remux {mkcc.input_file}: {e}"))
+        if key is not None and os.path.exists(output):
+            os.remove(output)
+        return None
+
+    if key is not None:
+        cached = cache.commit(key, output)
+        return str(cached) if cached is not None else None
+    return output
+
+
+def _served_file(mkcc: mkchromecast.Mkchromecast) -> Optional[str]:
+    """Returns the file to serve with byte ranges, remuxing the input if needed.
+
+    Returns None when the input has to be streamed through ffmpeg instead.
+    """
+    if (mkcc.operation != OpMode.INPUT_FILE
+            or mkcc.command
+            or not os.path.isfile(mkcc.input_file)):
+        return None
+
+    builder = pipeline_builder.Video(_video_settings(mkcc))
+    # Building the command decides whether the file can be served.
+    builder.command
+    if builder.file_action == codec_support.Action.COPY:
+        return mkcc.input_file
+    if builder.file_action == codec_support.Action.REMUX:
+        return _remux(mkcc, builder)
+    return None
+
+
+def _flask_init(served_file: Optional[str] = None,
+                media_type: str = "video/mp4"):
+    mkcc = mkchromecast.Mkchromecast()
+
+    if served_file is not None:
+        stream_infra.FlaskServer.init_video(
+            chunk_size=mkcc.chunk_size,
+            command=[],
+            media_type=media_type,
+            file_path=served_file,
+        )
+        return
+
+    settings = _video_settings(mkcc)
+    builder = pipeline_builder.Video(settings)
+    command = builder.command
     if mkcc.debug is True:
-        print(f":::ffmpeg::: pipeline_builder command: {builder.command}")
+        print(f":::ffmpeg::: pipeline_builder command: {command}")
+    if builder.x264 is not None:
+        print(colors.options("Video encoding:") + f" {builder.x264}")
+
+    # Only files that are transcoded are worth caching, and a looping cast
+    # never finishes.  HLS segments are shared by every client instead.
+    cache = None
+    cache_key = None
+    if (mkcc.transcode_cache is not None
+            and mkcc.operation == OpMode.INPUT_FILE
+            and builder.x264 is not None
+            and not mkcc.loop
+            and not mkcc.hls):
+        cache = _transcode_cache(mkcc)
+        cache_key = cache.key(mkcc.input_file, command)
 
-    media_type = mkcc.mtype or "video/mp4"
     stream_infra.FlaskServer.init_video(
         chunk_size=mkcc.chunk_size,
-        command=builder.command,
-        media_type=(mkcc.mtype or "video/mp4")
+        command=command,
+        media_type=media_type,
+        read_sizing=stream_infra.ReadSizing.from_mkcc(mkcc),
+        log_progress=builder.reports_progress,
+        target_fps=builder.target_fps,
+        cache=cache,
+        cache_key=cache_key,
+        hls_store=settings.hls_store,
     )
 
 
 def main():
+    global served_file, media_type
     mkcc = mkchromecast.Mkchromecast()
     ip = utils.get_effective_ip(
         mkcc.platform, host_override=mkcc.host, fallback_ip="0.0.0.0")
 
+    stream_server = mkcc.stream_server
     if mkcc.backend != "node":
-        pipeline = stream_infra.PipelineProcess(_flask_init, ip, mkcc.port, mkcc.platform)
-        pipeline.start()
+        served_file = _served_file(mkcc)
     else:
-        print("Starting Node")
-
         # TODO(xsdg): This implies that the `node` backend is only compatible
         # with INPUT_FILE OpMode, for video.  Double-check what's happening here
         # and then implement that constraint directly in the Mkchromecast class.
@@ -68,47 +188,19 @@ def main():
                 "file operation (-i argument)."))
             utils.terminate()
 
-        if mkcc.platform == "Darwin":
-            PATH = (
-                "./bin:./nodejs/bin:/Users/"
-                + str(getpass.getuser())
-                + "/bin:/usr/local/bin:/usr/local/sbin:"
-                + "/usr/bin:/bin:/usr/sbin:"
-                + "/sbin:/opt/X11/bin:/usr/X11/bin:/usr/games:"
-                + os.environ["PATH"]
-            )
-        else:
-            PATH = os.environ["PATH"]
-
-        if mkcc.debug is True:
-            print("PATH = %s." % PATH)
-
-        node_names = ["node"]
-        nodejs_dir = ["./nodejs/"]
-
-        # TODO(xsdg): This is not necessarily where mkchromecast is installed,
-        # and may point to an unrelated mkchromecast install.
-        if mkcc.platform == "Linux":
-            node_names.append("nodejs")
-            nodejs_dir.append("/usr/share/mkchromecast/nodejs/")
-
-        for name in node_names:
-            if utils.is_installed(name, PATH, mkcc.debug):
-                for path in nodejs_dir:
-                    if os.path.isdir(path):
-                        path = path + "html5-video-streamer.js"
-                        webcast = [name, path, mkcc.input_file]
-                        break
-
-        try:
-            subprocess.Popen(webcast)
-        except:
-            # TODO(xsdg): Capture a specific exception here.
-            print(
-                colors.warning(
-                    "Nodejs is not installed in your system. "
-                    "Please, install it to use this backend."
-                )
-            )
-            print(colors.warning("Closing the application..."))
-            utils.terminate()
+        # The node backend sends the input file as it is, which no longer
+        # needs Node.js.  Flask can't send it with os.sendfile.
+        served_file = mkcc.input_file
+        if stream_server == "flask":
+            stream_server = "zerocopy"
+
+    if served_file is not None:
+        media_type = mkcc.mtype or media_probe.media_type(served_file)
+        print(colors.options("Serving file:") + f" {served_file}")
+    else:
+        media_type = mkcc.mtype or "video/mp4"
+
+    pipeline = stream_infra.PipelineProcess(
+        functools.partial(_flask_init, served_file, media_type), ip, mkcc.port,
+        mkcc.platform, stream_server=stream_server)
+    pipeline.start()
@@ -0,0 +1,285 @@
+# this file is part of mkchromecast.
+
+from threading import Event
+import types
+import unittest
+from unittest import mock
+
+import mkchromecast
+from mkchromecast import cast
+
+
+def _status(content_id: str, player_state: str):
+    return types.SimpleNamespace(content_id=content_id,
+                                 player_state=player_state)
+
+
+class PlaybackListenerTests(unittest.TestCase):
+    def setUp(self):
+        self.listener = cast._PlaybackListener()
+        self.listener.expect("http://192.0.2.1:5000/stream")
+
+    def testReadyOnceOurMediaPlays(self):
+        self.listener.new_media_status(
+            _status("http://192.0.2.1:5000/stream", "IDLE"))
+        self.assertFalse(self.listener.ready.is_set())
+
+        for state in ["BUFFERING", "PLAYING"]:
+            with self.subTest(state=state):
+                self.listener.expect("http://192.0.2.1:5000/stream")
+                self.listener.new_media_status(
+                    _status("http://192.0.2.1:5000/stream", state))
+                self.assertTrue(self.listener.ready.is_set())
+                self.assertFalse(self.listener.failed)
+
+    def testIgnoresPreviousMedia(self):
+        self.listener.new_media_status(
+            _status("http://example.com/other.mp3", "PLAYING"))
+        self.assertFalse(self.listener.ready.is_set())
+
+    def testLoadFailure(self):
+        self.listener.load_media_failed(1, 104)
+        self.assertTrue(self.listener.ready.is_set())
+        self.assertTrue(self.listener.failed)
+
+        self.listener.expect("http://192.0.2.1:5000/stream")
+        self.assertFalse(self.listener.ready.is_set())
+        self.assertFalse(self.listener.failed)
+
+
+class GetPlaybackListenerTests(unittest.TestCase):
+    def testRegistersOncePerConnection(self):
+        casting = cast.Casting.__new__(cast.Casting)
+        casting._playback_listeners = {}
+
+        casting.casts = {"Kitchen": mock.Mock(), "Den": mock.Mock()}
+        register = (
+            casting.casts["Kitchen"].media_controller.register_status_listener)
+        listener = casting._get_playback_listener("Kitchen")
+        self.assertIs(listener, casting._get_playback_listener("Kitchen"))
+        register.assert_called_once_with(listener)
+        self.assertIsNot(listener, casting._get_playback_listener("Den"))
+
+        casting.casts["Kitchen"] = mock.Mock()
+        self.assertIsNot(listener, casting._get_playback_listener("Kitchen"))
+
+
+def _casting(**casts) -> cast.Casting:
+    """Returns a Casting that is connected to mock devices."""
+    casting = cast.Casting.__new__(cast.Casting)
+    casting.mkcc = mock.Mock(debug=False, hijack=False, hls=False)
+    casting.casts = casts
+    casting.cast_to = next(iter(casts), None)
+    casting.cast = casts.get(casting.cast_to)
+    casting._fallback_names = []
+    return casting
+
+
+class MultipleDevicesTests(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch("builtins.print"))
+
+    def testMissingDeviceIsSkipped(self):
+        kitchen = mock.Mock()
+        casting = _casting()
+        casting.mkcc.device_names = ["Den", "Kitchen"]
+        casting._browser = mock.Mock()
+        casting._browser.get_chromecast.side_effect = (
+            lambda name, tries: kitchen if name == "Kitchen" else None)
+
+        casting.get_devices()
+        self.assertEqual({"Kitchen": kitchen}, casting.casts)
+        self.assertIs(kitchen, casting.cast)
+        self.assertEqual("Kitchen", casting.cast_to)
+        casting._browser.forget.assert_called_once_with("Den")
+
+    def testFirstDeviceFallsBackToNext(self):
+        den = mock.Mock()
+        casting = _casting()
+        casting.mkcc.device_names = None
+        casting.cast_to = "Attic"
+        casting._fallback_names = ["Basement", "Den"]
+        casting._browser = mock.Mock()
+        casting._browser.get_chromecast.side_effect = (
+            lambda name, tries: den if name == "Den" else None)
+
+        casting.get_devices()
+        self.assertEqual({"Den": den}, casting.casts)
+        self.assertEqual("Den", casting.cast_to)
+
+    def testPlayCastLoadsEveryDevice(self):
+        casting = _casting(Kitchen=mock.Mock(), Den=mock.Mock())
+        casting.ip = "192.0.2.1"
+        casting.title = "Mkchromecast"
+        casting.r = None
+        casting._playback_listeners = {}
+        casting.mkcc.operation = cast.OpMode.AUDIOCAST
+        casting.mkcc.videoarg = False
+        casting.mkcc.port = 5000
+        for device in casting.casts.values():
+            device.socket_client.host = "192.0.2.2"
+        self.enterContext(mock.patch.object(cast, "PLAYBACK_TIMEOUT", 0))
+
+        # Importing the real module would start the audio pipeline.
+        audio = mock.Mock(media_type="audio/mpeg")
+        self.enterContext(mock.patch.dict(
+            "sys.modules", {"mkchromecast.audio": audio}))
+        self.enterContext(mock.patch.object(
+            mkchromecast, "audio", audio, create=True))
+        casting.play_cast()
+        for device in casting.casts.values():
+            device.media_controller.play_media.assert_called_once_with(
+                "http://192.0.2.1:5000/stream", "audio/mpeg",
+                title="Mkchromecast", stream_type="LIVE")
+
+        casting.play_cast(["Den"])
+        self.assertEqual(
+            2, casting.casts["Den"].media_controller.play_media.call_count)
+        self.assertEqual(
+            1, casting.casts["Kitchen"].media_controller.play_media.call_count)
+
+    def testPlayCastSeeksInServedFile(self):
+        casting = _casting(Kitchen=mock.Mock())
+        casting.ip = "192.0.2.1"
+        casting.title = "Mkchromecast"
+        casting.r = None
+        casting._playback_listeners = {}
+        casting.mkcc.operation = cast.OpMode.INPUT_FILE
+        casting.mkcc.videoarg = True
+        casting.mkcc.port = 5000
+        casting.mkcc.seek = "00:01:30"
+        casting.casts["Kitchen"].socket_client.host = "192.0.2.2"
+        self.enterContext(mock.patch.object(cast, "PLAYBACK_TIMEOUT", 0))
+
+        video = mock.Mock(served_file="/path/to/movie.mp4",
+                          media_type="video/mp4")
+        self.enterContext(mock.patch.dict(
+            "sys.modules", {"mkchromecast.video": video}))
+        self.enterContext(mock.patch.object(
+            mkchromecast, "video", video, create=True))
+        casting.play_cast()
+        casting.casts["Kitchen"].media_controller.play_media.assert_called_once_with(
+            "http://192.0.2.1:5000/stream", "video/mp4",
+            title="Mkchromecast", stream_type="BUFFERED", current_time=90.0)
+
+    def testPlayCastLoadsHlsPlaylist(self):
+        casting = _casting(Kitchen=mock.Mock())
+        casting.ip = "192.0.2.1"
+        casting.title = "Mkchromecast"
+        casting.r = None
+        casting._playback_listeners = {}
+        casting.mkcc.operation = cast.OpMode.AUDIOCAST
+        casting.mkcc.videoarg = False
+        casting.mkcc.hls = True
+        casting.mkcc.port = 5000
+        casting.casts["Kitchen"].socket_client.host = "192.0.2.2"
+        self.enterContext(mock.patch.object(cast, "PLAYBACK_TIMEOUT", 0))
+
+        audio = mock.Mock(media_type="audio/mpeg")
+        self.enterContext(mock.patch.dict(
+            "sys.modules", {"mkchromecast.audio": audio}))
+        self.enterContext(mock.patch.object(
+            mkchromecast, "audio", audio, create=True))
+        casting.play_cast()
+        casting.casts["Kitchen"].media_controller.play_media.assert_called_once_with(
+            "http://192.0.2.1:5000/hls/stream.m3u8",
+            "application/vnd.apple.mpegurl", title="Mkchromecast",
+            stream_type="LIVE",
+            media_info={"hlsSegmentFormat": "ts",
+                        "hlsVideoSegmentFormat": "mpeg2_ts"})
+
+    def testControlsEveryDevice(self):
+        casting = _casting(Kitchen=mock.Mock(), Den=mock.Mock())
+        casting.casts["Kitchen"].status.volume_level = 0.5
+        casting.casts["Den"].status.volume_level = 0.2
+
+        casting.volume_up()
+        casting.casts["Kitchen"].set_volume.assert_called_once_with(0.6)
+        casting.casts["Den"].set_volume.assert_called_once()
+        self.assertAlmostEqual(
+            0.3, casting.casts["Den"].set_volume.call_args.args[0])
+
+        casting.pause()
+        casting.stop_cast()
+        for device in casting.casts.values():
+            device.media_controller.pause.assert_called_once()
+            device.quit_app.assert_called_once()
+
+
+class HijackTests(unittest.TestCase):
+    def setUp(self):
+        pychromecast = self.enterContext(
+            mock.patch.object(cast, "pychromecast", create=True))
+        pychromecast.socket_client.CONNECTION_STATUS_CONNECTED = "CONNECTED"
+        pychromecast.socket_client.CONNECTION_STATUS_FAILED = "FAILED"
+        pychromecast.socket_client.CONNECTION_STATUS_LOST = "LOST"
+
+        self.wake = Event()
+        self.listener = cast._HijackListener(self.wake)
+
+        self.casting = _casting(Kitchen=mock.Mock(), Den=mock.Mock())
+        self.casting.play_cast = mock.Mock()
+        self.casting._connect = mock.Mock()
+
+    def set_display_name(self, name):
+        self.casting.casts["Kitchen"].status = types.SimpleNamespace(
+            display_name=name)
+
+    def connection(self, status: str):
+        self.listener.new_connection_status(
+            types.SimpleNamespace(status=status))
+
+    def testOtherAppTriggersRecast(self):
+        self.listener.new_cast_status(
+            types.SimpleNamespace(display_name="Default Media Receiver"))
+        self.assertFalse(self.listener.changed.is_set())
+
+        self.listener.new_cast_status(
+            types.SimpleNamespace(display_name="YouTube"))
+        self.assertTrue(self.listener.changed.is_set())
+        self.assertTrue(self.wake.is_set())
+
+        self.set_display_name("YouTube")
+        self.casting._hijack_cc_("Kitchen", self.listener)
+        self.casting.play_cast.assert_called_once_with(["Kitchen"])
+        self.casting._connect.assert_not_called()
+
+    def testNoRecastWhilePlaying(self):
+        self.set_display_name("Default Media Receiver")
+        self.casting._hijack_cc_("Kitchen", self.listener)
+        self.casting.play_cast.assert_not_called()
+
+    def testReconnectedConnectionIsReused(self):
+        self.connection("LOST")
+        self.assertFalse(self.listener.changed.is_set())
+
+        self.set_display_name(None)
+        self.connection("CONNECTED")
+        self.assertTrue(self.listener.changed.is_set())
+        self.casting._hijack_cc_("Kitchen", self.listener)
+        self.casting._connect.assert_not_called()
+        self.casting.play_cast.assert_called_once_with(["Kitchen"])
+
+    def testFailedConnectionIsReplaced(self):
+        self.connection("FAILED")
+        self.assertTrue(self.listener.changed.is_set())
+
+        reconnected = mock.Mock()
+        self.casting._connect.return_value = reconnected
+        self.casting._hijack_cc_("Kitchen", self.listener)
+        self.casting._connect.assert_called_once_with("Kitchen")
+        self.casting.play_cast.assert_called_once_with(["Kitchen"])
+        self.assertIs(reconnected, self.casting.casts["Kitchen"])
+        self.assertIs(reconnected, self.casting.cast)
+
+    def testLostDeviceIsDropped(self):
+        self.connection("FAILED")
+        self.casting._connect.return_value = None
+        self.casting._hijack_cc_("Kitchen", self.listener)
+        self.casting.play_cast.assert_not_called()
+        self.assertEqual(["Den"], list(self.casting.casts))
+        self.assertEqual("Den", self.casting.cast_to)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
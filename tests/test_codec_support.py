@@ -0,0 +1,115 @@
+# this file is part of mkchromecast.
+
+import unittest
+
+from mkchromecast import codec_support
+from mkchromecast import constants
+from mkchromecast import media_probe
+from mkchromecast.codec_support import Action
+
+
+def _info(format_name, *streams):
+    return media_probe.MediaInfo(format_name=format_name, duration=None,
+                                 bit_rate=None, streams=streams)
+
+
+def _video(**fields):
+    fields = {"codec_name": "h264", "profile": "High", "level": 40,
+              "pix_fmt": "yuv420p", "width": 1920, "height": 1080,
+              "fps": 25.0} | fields
+    return media_probe.StreamInfo(index=0, codec_type="video", **fields)
+
+
+def _audio(**fields):
+    fields = {"codec_name": "aac", "channels": 2} | fields
+    return media_probe.StreamInfo(index=1, codec_type="audio", **fields)
+
+
+_MP4 = "mov,mp4,m4a,3gp,3g2,mj2"
+_MKV = "matroska,webm"
+
+
+class CodecSupportTests(unittest.TestCase):
+    def testEveryGenerationHasCodecs(self):
+        self.assertCountEqual(constants.DEVICE_GENERATIONS,
+                              codec_support.DEVICE_CODECS)
+        self.assertIn(constants.DEFAULT_DEVICE_GENERATION,
+                      constants.DEVICE_GENERATIONS)
+
+    def testCopyOrRemuxDependsOnContainer(self):
+        video = _video()
+        self.assertEqual(Action.COPY, codec_support.video_action(
+            _info(_MP4, video), video, "gen1"))
+        self.assertEqual(Action.REMUX, codec_support.video_action(
+            _info(_MKV, video), video, "gen1"))
+
+    def testH264Limits(self):
+        cases = [
+            # (stream, generation, action)
+            (_video(level=42, fps=60.0), "gen1", Action.TRANSCODE),
+            (_video(level=42, fps=59.94), "gen3", Action.REMUX),
+            (_video(profile="High 10", pix_fmt="yuv420p10le"), "google-tv",
+             Action.TRANSCODE),
+            (_video(height=2160, level=51, fps=60.0), "ultra",
+             Action.TRANSCODE),
+            (_video(height=2160, level=51, fps=30.0), "google-tv",
+             Action.REMUX),
+        ]
+        for stream, generation, action in cases:
+            with self.subTest(stream=stream, generation=generation):
+                self.assertEqual(action, codec_support.video_action(
+                    _info(_MKV, stream), stream, generation))
+
+    def testHevcAndVp9NeedUltraOrLater(self):
+        for stream in (_video(codec_name="hevc", profile="Main 10",
+                              level=153, pix_fmt="yuv420p10le", height=2160),
+                       _video(codec_name="vp9", profile="Profile 2",
+                              level=None, pix_fmt="yuv420p10le",
+                              height=2160)):
+            info = _info(_MKV, stream)
+            with self.subTest(codec=stream.codec_name):
+                self.assertEqual(Action.TRANSCODE, codec_support.video_action(
+                    info, stream, "gen3"))
+                self.assertEqual(Action.REMUX, codec_support.video_action(
+                    info, stream, "ultra"))
+                self.assertEqual(Action.REMUX, codec_support.video_action(
+                    info, stream, "google-tv"))
+
+    def testAudio(self):
+        cases = [
+            (_audio(), Action.REMUX),
+            (_audio(codec_name="opus"), Action.REMUX),
+            (_audio(codec_name="flac"), Action.REMUX),
+            # mp4 can't hold vorbis.
+            (_audio(codec_name="vorbis"), Action.TRANSCODE),
+            (_audio(codec_name="dts"), Action.TRANSCODE),
+            (_audio(codec_name="aac", channels=6), Action.TRANSCODE),
+        ]
+        for stream, action in cases:
+            with self.subTest(stream=stream):
+                self.assertEqual(action, codec_support.audio_action(
+                    _info(_MKV, stream), stream, "gen3"))
+
+    def testMpegtsActions(self):
+        # HLS segments only take h264, with aac or mp3.
+        video = _video()
+        self.assertEqual(Action.REMUX, codec_support.video_action(
+            _info(_MP4, video), video, "ultra", container="mpegts"))
+        hevc = _video(codec_name="hevc", profile="Main")
+        self.assertEqual(Action.TRANSCODE, codec_support.video_action(
+            _info(_MP4, hevc), hevc, "ultra", container="mpegts"))
+        for codec, action in [("mp3", Action.REMUX),
+                              ("opus", Action.TRANSCODE)]:
+            audio = _audio(codec_name=codec)
+            with self.subTest(codec=codec):
+                self.assertEqual(action, codec_support.audio_action(
+                    _info(_MP4, audio), audio, "gen3", container="mpegts"))
+
+    def testDescribe(self):
+        info = _info(_MKV, _video(), _audio(codec_name="dts"))
+        self.assertEqual("video h264: remux, audio dts: transcode",
+                         codec_support.describe(info, "gen3"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
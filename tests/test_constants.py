@@ -26,6 +26,13 @@ class ConstantsTests(unittest.TestCase):
             constants.backend_options_for_platform("Linux", video=False)
         )
 
+    def testPyAVBackend(self):
+        """The in-process encoder is only for audio on Linux."""
+        self.assertIn("pyav", constants.backend_options_for_platform("Linux"))
+        self.assertNotIn(
+            "pyav", constants.backend_options_for_platform("Linux", video=True))
+        self.assertNotIn("pyav", constants.backend_options_for_platform("Darwin"))
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,171 @@
+# this file is part of mkchromecast.
+
+import json
+import pathlib
+import tempfile
+import types
+import unittest
+import uuid
+from unittest import mock
+
+from mkchromecast import discovery
+
+
+def _device(name: str, host: str = "192.0.2.1", device_uuid: str = "u1"):
+    return discovery.CachedDevice(name=name, host=host, port=8009,
+                                  uuid=device_uuid, model_name="Chromecast")
+
+
+class DeviceCacheTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.path = pathlib.Path(tmp_dir) / "state" / "devices.json"
+
+    def testRoundTrip(self):
+        cache = discovery.DeviceCache(self.path)
+        cache.update(_device("Kitchen"))
+        cache.update(_device("Living Room", device_uuid="u2"))
+        cache.save()
+
+        loaded = discovery.DeviceCache(self.path)
+        loaded.load()
+        self.assertEqual(["Kitchen", "Living Room"], loaded.names())
+        self.assertEqual(_device("Kitchen"), loaded.get("Kitchen"))
+
+    def testMissingOrCorruptFile(self):
+        cache = discovery.DeviceCache(self.path)
+        cache.load()
+        self.assertEqual([], cache.names())
+
+        self.path.parent.mkdir(parents=True)
+        for contents in ["not json", json.dumps([{"name": "x"}])]:
+            with self.subTest(contents=contents):
+                self.path.write_text(contents)
+                cache.load()
+                self.assertEqual([], cache.names())
+
+    def testUpdate(self):
+        cache = discovery.DeviceCache(self.path)
+        self.assertTrue(cache.update(_device("Kitchen")))
+        self.assertFalse(cache.update(_device("Kitchen")))
+        self.assertTrue(cache.update(_device("Kitchen", host="192.0.2.2")))
+        self.assertEqual("192.0.2.2", cache.get("Kitchen").host)
+
+        # A renamed device replaces its old entry.
+        self.assertTrue(cache.update(_device("Den")))
+        self.assertEqual(["Den"], cache.names())
+
+        self.assertTrue(cache.remove("Den"))
+        self.assertFalse(cache.remove("Den"))
+
+
+class BrowserTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.cache = discovery.DeviceCache(pathlib.Path(tmp_dir) / "d.json")
+        self.browser = discovery.DeviceBrowser(self.cache)
+        # Stands in for a running pychromecast CastBrowser.
+        self.cast_browser = types.SimpleNamespace(devices={})
+        self.browser._cast_browser = self.cast_browser
+
+    def add_cast_info(self, name: str) -> uuid.UUID:
+        device_uuid = uuid.uuid4()
+        self.cast_browser.devices[device_uuid] = types.SimpleNamespace(
+            friendly_name=name, host="192.0.2.1", port=8009,
+            model_name="Chromecast")
+        return device_uuid
+
+
+class DeviceBrowserTests(BrowserTestCase):
+    def testWarmCacheDoesNotWait(self):
+        self.cache.update(_device("Kitchen"))
+        with mock.patch.object(self.browser._found, "wait_for") as wait_for:
+            self.assertEqual(["Kitchen"], self.browser.device_names())
+        wait_for.assert_not_called()
+
+    def testLiveDevicesComeFirst(self):
+        self.cache.update(_device("Attic", device_uuid="stale"))
+        self.cache.update(_device("Kitchen", device_uuid="u2"))
+        self.assertEqual(["Attic", "Kitchen"], self.browser.device_names())
+
+        self.browser._on_update(self.add_cast_info("Kitchen"))
+        self.assertEqual(["Kitchen", "Attic"], self.browser.device_names())
+
+    def testColdCacheWaitsForDiscovery(self):
+        self.assertEqual([], self.browser.device_names(timeout=0.01))
+
+        self.browser._on_update(self.add_cast_info("Kitchen"))
+        with mock.patch("time.sleep"):
+            self.assertEqual(["Kitchen"], self.browser.device_names())
+
+        # Found devices are written through to disk.
+        reloaded = discovery.DeviceCache(self.cache._path)
+        reloaded.load()
+        self.assertEqual(["Kitchen"], reloaded.names())
+
+    def testRemovedDevicesAreForgotten(self):
+        device_uuid = self.add_cast_info("Kitchen")
+        self.browser._on_update(device_uuid)
+        cast_info = self.cast_browser.devices.pop(device_uuid)
+
+        self.browser._on_remove(device_uuid, None, cast_info)
+        self.assertEqual([], self.cache.names())
+
+    def testCastInfo(self):
+        self.add_cast_info("Kitchen")
+        self.assertEqual("Kitchen",
+                         self.browser.cast_info("Kitchen").friendly_name)
+        self.assertIsNone(self.browser.cast_info("Den", timeout=0.01))
+
+
+class RequestTimeout(Exception):
+    pass
+
+
+class GetChromecastTests(BrowserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pychromecast = self.enterContext(
+            mock.patch.object(discovery, "pychromecast", create=True))
+        self.pychromecast.error.RequestTimeout = RequestTimeout
+        self.cached_cast = self.pychromecast.get_chromecast_from_host.return_value
+
+    def testConnectsToCachedAddress(self):
+        device = _device("Kitchen", device_uuid=str(uuid.uuid4()))
+        self.cache.update(device)
+
+        cast = self.browser.get_chromecast("Kitchen", tries=2)
+        self.assertIs(self.cached_cast, cast)
+        host = self.pychromecast.get_chromecast_from_host.call_args.args[0]
+        self.assertEqual((device.host, device.port), host[:2])
+        self.pychromecast.get_chromecast_from_cast_info.assert_not_called()
+
+    def testFallsBackToDiscovery(self):
+        self.cache.update(_device("Kitchen", device_uuid=str(uuid.uuid4())))
+
+        def time_out(timeout):
+            # Discovery finds the device at its new address in the meantime.
+            self.add_cast_info("Kitchen")
+            raise RequestTimeout()
+
+        self.cached_cast.wait.side_effect = time_out
+
+        cast = self.browser.get_chromecast("Kitchen")
+        self.cached_cast.disconnect.assert_called_once()
+        self.assertIs(
+            self.pychromecast.get_chromecast_from_cast_info.return_value, cast)
+
+    def testLiveDeviceSkipsCachedAddress(self):
+        self.cache.update(_device("Kitchen", device_uuid=str(uuid.uuid4())))
+        self.add_cast_info("Kitchen")
+
+        self.browser.get_chromecast("Kitchen")
+        self.pychromecast.get_chromecast_from_host.assert_not_called()
+        self.pychromecast.get_chromecast_from_cast_info.assert_called_once()
+
+    def testUnknownDevice(self):
+        self.assertIsNone(self.browser.get_chromecast("Den", timeout=0.01))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
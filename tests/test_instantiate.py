@@ -20,9 +20,18 @@ class BasicInstantiationTest(unittest.TestCase):
         mock_args.command = None
         mock_args.resolution = None
         mock_args.chunk_size = 64
+        mock_args.name = None
+        mock_args.target_latency = None
+        mock_args.latency_profile = "balanced"
+        mock_args.min_read_size = 512
+        mock_args.max_read_size = 1024**2
         mock_args.sample_rate = 44100
         mock_args.youtube = None
         mock_args.input_file = None
+        mock_args.video_cpu_budget = constants.VIDEO_CPU_BUDGET
+        mock_args.transcode_cache = None
+        mock_args.hls = False
+        mock_args.seek = None
         mkcc = mkchromecast.Mkchromecast(mock_args)
 
     def testTrayModeInstantiation(self):
@@ -37,9 +46,18 @@ class BasicInstantiationTest(unittest.TestCase):
         mock_args.command = None
         mock_args.resolution = None
         mock_args.chunk_size = 64
+        mock_args.name = None
+        mock_args.target_latency = None
+        mock_args.latency_profile = "balanced"
+        mock_args.min_read_size = 512
+        mock_args.max_read_size = 1024**2
         mock_args.sample_rate = 44100
         mock_args.youtube = None
         mock_args.input_file = None
+        mock_args.video_cpu_budget = constants.VIDEO_CPU_BUDGET
+        mock_args.transcode_cache = None
+        mock_args.hls = False
+        mock_args.seek = None
 
         # Now, we set the args to trigger tray mode.
         mock_args.discover = False
@@ -74,5 +92,133 @@ class BasicInstantiationTest(unittest.TestCase):
         self.assertEqual(mkcc.adevice, "alsa_device")
 
 
+class MockArgsTestCase(unittest.TestCase):
+    """Instantiates Mkchromecast from mock args, with printing silenced."""
+
+    def setUp(self):
+        self.mock_print = self.enterContext(
+            mock.patch("builtins.print", autospec=True))
+
+    def create_mkcc(self, platform: str, **special_args):
+        self.enterContext(
+            mock.patch("platform.system", return_value=platform))
+
+        mock_args = mock.Mock()
+        # Here we set the minimal required args for __init__ to not sys.exit.
+        mock_args.encoder_backend = None
+        mock_args.bitrate = constants.DEFAULT_BITRATE
+        mock_args.codec = 'mp3'
+        mock_args.command = None
+        mock_args.resolution = None
+        mock_args.chunk_size = 64
+        mock_args.name = None
+        mock_args.target_latency = None
+        mock_args.latency_profile = "balanced"
+        mock_args.min_read_size = 512
+        mock_args.max_read_size = 1024**2
+        mock_args.sample_rate = 44100
+        mock_args.youtube = None
+        mock_args.input_file = None
+        mock_args.video_cpu_budget = constants.VIDEO_CPU_BUDGET
+        mock_args.transcode_cache = None
+        mock_args.hls = False
+        mock_args.seek = None
+        mock_args.tray = False
+        mock_args.video = False
+
+        mock_args.prewarm = True
+        for name, value in special_args.items():
+            setattr(mock_args, name, value)
+
+        return mkchromecast.Mkchromecast(mock_args)
+
+
+class PrewarmGatingTest(MockArgsTestCase):
+    def printed_warning(self) -> bool:
+        return any("--prewarm" in str(call.args[0])
+                   for call in self.mock_print.call_args_list)
+
+    def testJoinableCodecs(self):
+        for codec in constants.JOINABLE_CODECS:
+            with self.subTest(codec=codec):
+                self.mock_print.reset_mock()
+                mkcc = self.create_mkcc("Linux", codec=codec)
+                self.assertTrue(mkcc.prewarm)
+                self.assertFalse(self.printed_warning())
+
+    def testNodeBackend(self):
+        # The node backend forces mp3, which is joinable on its own.
+        mkcc = self.create_mkcc("Darwin", encoder_backend="node", codec="ogg")
+        self.assertEqual("mp3", mkcc.codec)
+        self.assertFalse(mkcc.prewarm)
+        self.assertTrue(self.printed_warning())
+
+    def testNotRequested(self):
+        mkcc = self.create_mkcc("Linux", prewarm=False)
+        self.assertFalse(mkcc.prewarm)
+        self.assertFalse(self.printed_warning())
+
+
+class PyAVBackendTest(MockArgsTestCase):
+    def testNeedsPyAV(self):
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            with self.assertRaises(SystemExit):
+                self.create_mkcc("Linux", encoder_backend="pyav")
+
+        with mock.patch("importlib.util.find_spec",
+                        return_value=mock.sentinel.spec):
+            mkcc = self.create_mkcc("Linux", encoder_backend="pyav")
+        self.assertEqual("pyav", mkcc.backend)
+
+
+class LatencyProfileTest(MockArgsTestCase):
+    def testProfileSetsTargetLatency(self):
+        mkcc = self.create_mkcc("Linux", latency_profile="low")
+        self.assertEqual(constants.LATENCY_PROFILES["low"],
+                         mkcc.latency_profile)
+        self.assertEqual(20, mkcc.target_latency)
+
+        mkcc = self.create_mkcc("Linux", latency_profile="balanced")
+        self.assertIsNone(mkcc.target_latency)
+
+    def testTargetLatencyOverridesProfile(self):
+        mkcc = self.create_mkcc("Linux", latency_profile="low",
+                                target_latency=75)
+        self.assertEqual(75, mkcc.target_latency)
+
+
+class DeviceNamesTest(MockArgsTestCase):
+    def testSingleDevice(self):
+        mkcc = self.create_mkcc("Linux", name="Kitchen", codec="ogg")
+        self.assertEqual(["Kitchen"], mkcc.device_names)
+        self.assertEqual("Kitchen", mkcc.device_name)
+        self.assertEqual("ogg", mkcc.codec)
+
+        mkcc = self.create_mkcc("Linux")
+        self.assertEqual([], mkcc.device_names)
+        self.assertIsNone(mkcc.device_name)
+
+    def testSeveralDevices(self):
+        mkcc = self.create_mkcc("Linux", name="Kitchen, Living Room,",
+                                codec="aac")
+        self.assertEqual(["Kitchen", "Living Room"], mkcc.device_names)
+        self.assertEqual("Kitchen", mkcc.device_name)
+        self.assertEqual("aac", mkcc.codec)
+
+    def testSeveralDevicesKeepCodec(self):
+        mkcc = self.create_mkcc("Linux", name="Kitchen,Den", codec="ogg")
+        self.assertEqual("ogg", mkcc.codec)
+
+
+class SeekTest(MockArgsTestCase):
+    def testValidSeek(self):
+        mkcc = self.create_mkcc("Linux", seek="00:01:30")
+        self.assertEqual("00:01:30", mkcc.seek)
+
+    def testMalformedSeek(self):
+        with self.assertRaises(SystemExit):
+            self.create_mkcc("Linux", seek="1m30s")
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,194 @@
+# this file is part of mkchromecast.
+
+import json
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from mkchromecast import media_probe
+
+
+_INFO = {"streams": [{"codec_type": "video", "pix_fmt": "yuv420p"}],
+         "format": {"duration": "60.0"}}
+
+
+class ProbeCacheTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.cache_path = pathlib.Path(tmp_dir) / "state" / "probes.json"
+        self.media_path = pathlib.Path(tmp_dir) / "movie.mp4"
+        self.media_path.write_bytes(b"movie")
+        self.ffprobe = self.enterContext(mock.patch.object(
+            media_probe, "run_ffprobe", autospec=True, return_value=_INFO))
+
+    def testProbesOnce(self):
+        cache = media_probe.ProbeCache(self.cache_path)
+        self.assertEqual(_INFO, cache.probe(str(self.media_path)))
+        self.assertEqual(_INFO, cache.probe(str(self.media_path)))
+        self.ffprobe.assert_called_once_with(str(self.media_path))
+
+    def testCacheSurvivesRestart(self):
+        media_probe.ProbeCache(self.cache_path).probe(str(self.media_path))
+
+        loaded = media_probe.ProbeCache(self.cache_path)
+        loaded.load()
+        self.assertEqual(_INFO, loaded.probe(str(self.media_path)))
+        self.ffprobe.assert_called_once()
+
+    def testChangedFileIsProbedAgain(self):
+        cache = media_probe.ProbeCache(self.cache_path)
+        cache.probe(str(self.media_path))
+
+        self.media_path.write_bytes(b"a longer movie")
+        cache.probe(str(self.media_path))
+        self.assertEqual(2, self.ffprobe.call_count)
+
+        stat = self.media_path.stat()
+        os.utime(self.media_path,
+                 ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        cache.probe(str(self.media_path))
+        self.assertEqual(3, self.ffprobe.call_count)
+
+    def testFailedProbesAreNotCached(self):
+        cache = media_probe.ProbeCache(self.cache_path)
+        self.ffprobe.side_effect = ValueError("unreadable")
+        with self.assertRaises(ValueError):
+            cache.probe(str(self.media_path))
+        self.assertFalse(self.cache_path.exists())
+
+        self.ffprobe.side_effect = None
+        self.assertEqual(_INFO, cache.probe(str(self.media_path)))
+        self.assertEqual(2, self.ffprobe.call_count)
+
+    def testUrlsAreNotCached(self):
+        cache = media_probe.ProbeCache(self.cache_path)
+        cache.probe("http://192.0.2.1/movie.mp4")
+        cache.probe("http://192.0.2.1/movie.mp4")
+        self.assertEqual(2, self.ffprobe.call_count)
+        self.assertFalse(self.cache_path.exists())
+
+    def testDropsLeastRecentlyUsed(self):
+        cache = media_probe.ProbeCache(self.cache_path, max_files=2)
+        paths = []
+        for name in ("a.mp4", "b.mp4", "c.mp4"):
+            path = self.media_path.with_name(name)
+            path.write_bytes(b"movie")
+            paths.append(str(path))
+
+        cache.probe(paths[0])
+        cache.probe(paths[1])
+        cache.probe(paths[0])
+        cache.probe(paths[2])
+        self.assertEqual(3, self.ffprobe.call_count)
+
+        # b.mp4 was dropped, and a.mp4 kept.
+        cache.probe(paths[0])
+        self.assertEqual(3, self.ffprobe.call_count)
+        cache.probe(paths[1])
+        self.assertEqual(4, self.ffprobe.call_count)
+
+    def testCorruptFile(self):
+        self.cache_path.parent.mkdir(parents=True)
+        self.cache_path.write_text("[not json")
+
+        cache = media_probe.ProbeCache(self.cache_path)
+        cache.load()
+        self.assertEqual(_INFO, cache.probe(str(self.media_path)))
+        with open(self.cache_path) as cache_file:
+            self.assertEqual(1, len(json.load(cache_file)))
+
+
+class RunFfprobeTests(unittest.TestCase):
+    def testUnreadableFile(self):
+        process = mock.Mock(returncode=1)
+        process.communicate.return_value = (b"{}", b"")
+        with mock.patch.object(media_probe.subprocess, "Popen",
+                               return_value=process):
+            with self.assertRaises(ValueError):
+                media_probe.run_ffprobe("/path/to/notes.txt")
+
+
+class MediaInfoTests(unittest.TestCase):
+    def testFromFfprobe(self):
+        info = media_probe.MediaInfo.from_ffprobe({
+            "format": {"format_name": "matroska,webm", "duration": "313.779",
+                       "bit_rate": "25000000"},
+            "streams": [
+                {"index": 0, "codec_type": "audio", "codec_name": "opus",
+                 "channels": 2, "sample_rate": "48000",
+                 "tags": {"language": "eng"}},
+                {"index": 1, "codec_type": "video", "codec_name": "vp9",
+                 "pix_fmt": "yuv420p10le", "width": 3840, "height": 2160,
+                 "avg_frame_rate": "60000/1001", "r_frame_rate": "0/0",
+                 "color_transfer": "smpte2084"},
+                {"index": 2, "codec_type": "subtitle",
+                 "codec_name": "subrip"},
+                {"index": 3, "codec_type": "video", "codec_name": "mjpeg"},
+            ],
+        })
+
+        self.assertEqual(313.779, info.duration)
+        self.assertEqual(25000000, info.bit_rate)
+        self.assertEqual(1, info.video.index)
+        self.assertEqual(2160, info.video.height)
+        self.assertAlmostEqual(59.94, info.video.fps, places=2)
+        self.assertEqual("HDR10", info.video.hdr_format)
+        self.assertEqual(48000, info.audio.sample_rate)
+        self.assertEqual("eng", info.audio.language)
+        self.assertEqual([2], [s.index for s in info.subtitle_streams])
+        # Cover art isn't video.
+        self.assertEqual(1, len(info.video_streams))
+
+    def testMissingFields(self):
+        info = media_probe.MediaInfo.from_ffprobe({
+            "streams": [{"index": 0, "codec_type": "video",
+                         "avg_frame_rate": "0/0", "bit_rate": "N/A",
+                         "level": -99,
+                         "side_data_list": [
+                             {"side_data_type": "DOVI configuration record"}]}],
+        })
+
+        self.assertIsNone(info.duration)
+        self.assertIsNone(info.video.fps)
+        self.assertIsNone(info.video.bit_rate)
+        self.assertIsNone(info.video.level)
+        self.assertEqual("Dolby Vision", info.video.hdr_format)
+        self.assertIsNone(info.audio)
+
+
+class MediaTypeTests(unittest.TestCase):
+    def _media_type(self, name: str, format_name: str,
+                    codec_types=("video", "audio")) -> str:
+        info = media_probe.MediaInfo.from_ffprobe({
+            "format": {"format_name": format_name},
+            "streams": [{"index": index, "codec_type": codec_type}
+                        for index, codec_type in enumerate(codec_types)],
+        })
+        with mock.patch.object(media_probe, "media_info", autospec=True,
+                               return_value=info):
+            return media_probe.media_type(name)
+
+    def testProbedContainers(self):
+        mp4 = "mov,mp4,m4a,3gp,3g2,mj2"
+        self.assertEqual("video/mp4", self._media_type("movie.mov", mp4))
+        self.assertEqual("audio/mp4",
+                         self._media_type("song.m4a", mp4, ["audio"]))
+        self.assertEqual("video/x-matroska",
+                         self._media_type("movie.mkv", "matroska,webm"))
+        self.assertEqual("video/webm",
+                         self._media_type("movie.webm", "matroska,webm"))
+        self.assertEqual("video/x-msvideo",
+                         self._media_type("movie", "avi"))
+
+    def testUnprobedFiles(self):
+        with mock.patch.object(media_probe, "media_info", autospec=True,
+                               side_effect=ValueError):
+            self.assertEqual("video/mp4", media_probe.media_type("movie.mp4"))
+            self.assertEqual("application/octet-stream",
+                             media_probe.media_type("movie"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
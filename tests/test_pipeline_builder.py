@@ -3,11 +3,30 @@
 import unittest
 from unittest import mock
 
+from mkchromecast import media_probe
 from mkchromecast import pipeline_builder
+from mkchromecast import segment_store
 from mkchromecast import stream_infra
-from mkchromecast import utils
 from mkchromecast.constants import OpMode
 
+
+def _video_stream(index=0, **fields):
+    fields = {"codec_name": "h264", "pix_fmt": "yuv420p", "width": 1920,
+              "height": 1080, "fps": 25.0} | fields
+    return media_probe.StreamInfo(index=index, codec_type="video", **fields)
+
+
+def _audio_stream(index=1, **fields):
+    fields = {"codec_name": "aac", "channels": 2} | fields
+    return media_probe.StreamInfo(index=index, codec_type="audio", **fields)
+
+
+def _media_info(*streams):
+    return media_probe.MediaInfo(format_name="mov,mp4,m4a,3gp,3g2,mj2",
+                                 duration=60.0, bit_rate=None,
+                                 streams=streams)
+
+
 class AudioBuilderTests(unittest.TestCase):
 
     def create_builder(self,
@@ -136,6 +155,20 @@ class AudioBuilderTests(unittest.TestCase):
             "-cutoff",
             self.create_builder("ffmpeg", "Linux", codec="aac", segment_time=None).command)
 
+    def testLowDelaySpecialCase(self):
+        for platform in ["Darwin", "Linux"]:
+            with self.subTest(platform=platform):
+                command = self.create_builder(
+                    "ffmpeg", platform, low_delay=True).command
+                self.assertIn("nobuffer", command)
+                self.assertIn("-flush_packets", command)
+                # Input flags have to come before the input.
+                self.assertLess(command.index("-fflags"), command.index("-i"))
+
+                command = self.create_builder("ffmpeg", platform).command
+                self.assertNotIn("-fflags", command)
+                self.assertNotIn("-flush_packets", command)
+
     def testFullLinux(self):
         exp_command = [
             "ffmpeg",
@@ -157,6 +190,36 @@ class AudioBuilderTests(unittest.TestCase):
             exp_command,
             self.create_builder("ffmpeg", "Linux").command)
 
+    def testHlsLinux(self):
+        store = segment_store.SegmentStore("/dev/shm/mkchromecast-hls-5000")
+        exp_command = [
+            "ffmpeg",
+            "-ac", "2",
+            "-ar", "44100",
+            "-frame_size", str(32*128),
+            "-fragment_size", str(32*128),
+            "-f", "pulse",
+            "-i", "Mkchromecast.monitor",
+            "-acodec", "aac",
+            "-ac", "2",
+            "-ar", "22050",
+            "-b:a", "160k",
+            "-cutoff", "18000",
+            "-f", "hls",
+            "-hls_time", "4",
+            "-hls_list_size", "6",
+            "-hls_flags", "delete_segments+independent_segments+temp_file",
+            "-hls_segment_type", "mpegts",
+            "-hls_segment_filename",
+            "/dev/shm/mkchromecast-hls-5000/segment%05d.ts",
+            "/dev/shm/mkchromecast-hls-5000/stream.m3u8",
+        ]
+
+        self.assertEqual(
+            exp_command,
+            self.create_builder("ffmpeg", "Linux", codec="aac",
+                                segment_time=4, hls_store=store).command)
+
     def testFullDarwin(self):
         exp_command = [
             "ffmpeg",
@@ -196,6 +259,20 @@ class AudioBuilderTests(unittest.TestCase):
         with self.assertRaisesRegex(Exception, "unexpected codec.*noexist"):
             _ = self.create_builder("parec", "Linux", codec="noexist").command
 
+    def testPyAV(self):
+        builder = self.create_builder("pyav", "Linux", codec="aac")
+        self.assertEqual("parec", builder.command[0])
+        self.assertEqual(
+            stream_infra.PyAVOutput(format="adts", codec="aac",
+                                    samplerate=22050, bitrate="160"),
+            builder.pyav_output)
+
+        builder = self.create_builder("pyav", "Linux", codec="flac")
+        self.assertEqual(
+            stream_infra.PyAVOutput(format="flac", codec="flac",
+                                    samplerate=22050, bitrate=None),
+            builder.pyav_output)
+
 
 class VideoBuilderTests(unittest.TestCase):
 
@@ -256,59 +333,226 @@ class VideoBuilderTests(unittest.TestCase):
         o_index = output_args.index("-vf")
         self.assertEqual(f"subtitles={sub_file}", output_args[o_index + 1])
 
+    def testMkvSubtitleMapsProbedStreams(self):
+        info = _media_info(_video_stream(index=1), _audio_stream(index=0))
+        input_args, _ = pipeline_builder.Video._input_file_subtitle(
+            "subtitles.srt", is_mkv=True, info=info)
+
+        maps = [input_args[i + 1] for i, arg in enumerate(input_args)
+                if arg == "-map"]
+        self.assertEqual(["0:1", "0:0", "1:0"], maps)
+
+    def testEmbeddedSubtitlesAreDropped(self):
+        info = _media_info(_video_stream(),
+                           media_probe.StreamInfo(index=2,
+                                                  codec_type="subtitle",
+                                                  codec_name="hdmv_pgs_subtitle"))
+        self.assertEqual(
+            ([], ["-sn"]),
+            pipeline_builder.Video._input_file_subtitle(None, is_mkv=True,
+                                                        info=info))
+
     def testAudioEncodeCommands(self):
         # Shorthand for convenience.
         aencode_fxn = pipeline_builder.Video._input_file_aencode
 
-        self.assertEqual([], aencode_fxn(True, False))
-        self.assertEqual([], aencode_fxn(False, False))
+        # Without a probe, acodec is only specified for mkv files.
+        self.assertEqual([], aencode_fxn(None, True, False))
+        self.assertEqual([], aencode_fxn(None, False, False))
 
-        self.assertIn("copy", aencode_fxn(True, True))
-        self.assertNotIn("libmp3lame", aencode_fxn(True, True))
+        self.assertIn("copy", aencode_fxn(None, True, True))
+        self.assertNotIn("libmp3lame", aencode_fxn(None, True, True))
 
-        self.assertNotIn("copy", aencode_fxn(False, True))
-        self.assertIn("libmp3lame", aencode_fxn(False, True))
+        self.assertNotIn("copy", aencode_fxn(None, False, True))
+        self.assertIn("libmp3lame", aencode_fxn(None, False, True))
 
-    def testVideoEncodeCommands(self):
-        self.enterContext(mock.patch.object(utils, "check_file_info", autospec=True))
-        utils.check_file_info.side_effect = Exception("Should not be called")
+    def testDeviceGenerationDecidesCopy(self):
+        # Shorthand for convenience.
+        vencode_fxn = pipeline_builder.Video._input_file_vencode
+        aencode_fxn = pipeline_builder.Video._input_file_aencode
+
+        info = _media_info(
+            _video_stream(codec_name="hevc", profile="Main 10",
+                          pix_fmt="yuv420p10le", height=2160),
+            _audio_stream(codec_name="opus"))
+        self.assertIn("libx264", vencode_fxn(info, res=None, generation="gen3"))
+        self.assertIn("copy", vencode_fxn(info, res=None, generation="ultra"))
+        self.assertIn("copy", vencode_fxn(info, res="2160p",
+                                          generation="ultra"))
+
+        # Older ffmpeg only puts opus in mp4 experimentally.
+        self.assertEqual(["-codec:a", "copy", "-strict", "experimental"],
+                         aencode_fxn(info, False, True, "ultra"))
+
+    def testProbedAudioEncodeCommands(self):
+        # Shorthand for convenience.
+        aencode_fxn = pipeline_builder.Video._input_file_aencode
+
+        for codec in ("aac", "mp3"):
+            info = _media_info(_video_stream(), _audio_stream(codec_name=codec))
+            self.assertIn("copy", aencode_fxn(info, False, True))
+            self.assertIn("copy", aencode_fxn(info, False, False))
+
+        info = _media_info(_video_stream(), _audio_stream(codec_name="dts"))
+        self.assertIn("libmp3lame", aencode_fxn(info, True, True))
+        self.assertIn("libmp3lame", aencode_fxn(info, False, False))
 
+        self.assertEqual([], aencode_fxn(_media_info(_video_stream()),
+                                         False, True))
+
+    def testVideoEncodeCommands(self):
         # Shorthand for convenience.
         vencode_fxn = pipeline_builder.Video._input_file_vencode
 
-        # Whenever resolution is specified, we should see the reencode strategy.
-        self.assertIn("libx264", vencode_fxn("input.mp4", res="1080p"))
-        self.assertIn("libx264", vencode_fxn("input.mkv", res="1080p"))
-        self.assertNotIn("copy", vencode_fxn("input.mkv", res="1080p"))
+        # Whenever resolution is specified without a probe, we should see the
+        # reencode strategy.
+        self.assertIn("libx264", vencode_fxn(None, res="1080p"))
+        self.assertNotIn("copy", vencode_fxn(None, res="1080p"))
 
-        # We should always copy for non-mkv without resolution specified.
-        self.assertIn("copy", vencode_fxn("input.mp4", res=None))
-        self.assertNotIn("libx264", vencode_fxn("input.mp4", res=None))
+        # We should always copy without a probe or resolution specified.
+        self.assertIn("copy", vencode_fxn(None, res=None))
+        self.assertNotIn("libx264", vencode_fxn(None, res=None))
 
-        # For mkv without resolution, we should only reencode yuv420p10le.
-        utils.check_file_info.side_effect = None
-        utils.check_file_info.return_value = "yuv420p"
-        self.assertIn("copy", vencode_fxn("input.mkv", res=None))
-        utils.check_file_info.assert_called_once()
+        # Without resolution, we should only reencode yuv420p10le.
+        info = _media_info(_video_stream(pix_fmt="yuv420p"))
+        self.assertIn("copy", vencode_fxn(info, res=None))
 
-        utils.check_file_info.reset_mock()
-        utils.check_file_info.return_value = "yuv420p10le"
-        self.assertIn("libx264", vencode_fxn("input.mkv", res=None))
-        utils.check_file_info.assert_called_once()
+        info = _media_info(_video_stream(pix_fmt="yuv420p10le"))
+        self.assertIn("libx264", vencode_fxn(info, res=None))
+
+        # Files without video are copied.
+        self.assertIn("copy", vencode_fxn(_media_info(_audio_stream()),
+                                          res=None))
+
+    def testVideoEncodeRescaleCommands(self):
+        # Shorthand for convenience.
+        vencode_fxn = pipeline_builder.Video._input_file_vencode
+
+        # A source that already matches the resolution is copied.
+        info = _media_info(_video_stream(height=1080))
+        self.assertIn("copy", vencode_fxn(info, res="1080p"))
+
+        # Unless it's filtered, for instance to burn in subtitles.
+        self.assertIn("libx264", vencode_fxn(info, res="1080p", filtered=True))
+
+        # Anything else is reencoded.
+        self.assertIn("libx264", vencode_fxn(info, res="720p"))
+        for mismatch in ({"codec_name": "hevc"}, {"pix_fmt": "yuv420p10le"}):
+            info = _media_info(_video_stream(height=1080, **mismatch))
+            self.assertIn("libx264", vencode_fxn(info, res="1080p"))
+            self.assertNotIn("copy", vencode_fxn(info, res="1080p"))
+
+        self.assertIn("libx264", vencode_fxn(_media_info(_audio_stream()),
+                                             res="1080p"))
+
+    def testX264LowLatencySettings(self):
+        x264 = pipeline_builder.x264_settings(1920, 1080, 25, low_latency=True,
+                                              cpu_budget=0.75, cores=8)
+        self.assertEqual("faster", x264.preset)
+        self.assertEqual(6, x264.threads)
+        self.assertEqual(6, x264.slices)
+        self.assertEqual(0, x264.lookahead)
+        self.assertIn("sliced-threads=1", x264.args[-1])
+
+        # Slices need a few macroblock rows each.
+        x264 = pipeline_builder.x264_settings(854, 64, 25, low_latency=True,
+                                              cores=64)
+        self.assertEqual(1, x264.slices)
+
+    def testX264FrameThreadedSettings(self):
+        x264 = pipeline_builder.x264_settings(1280, 720, 30, low_latency=False,
+                                              cpu_budget=0.5, cores=8)
+        self.assertEqual("faster", x264.preset)
+        self.assertEqual(4, x264.threads)
+        self.assertEqual(1, x264.slices)
+        self.assertEqual(30, x264.lookahead)
+        self.assertIn("sliced-threads=0", x264.args[-1])
+
+    def testX264PresetFollowsPixelRate(self):
+        presets = [
+            pipeline_builder.x264_settings(3840, 2160, fps, low_latency=True,
+                                           cpu_budget=1.0, cores=4).preset
+            for fps in (5, 12, 30)]
+        self.assertEqual(["veryfast", "superfast", "ultrafast"], presets)
+
+        # A single core gets at least one thread.
+        x264 = pipeline_builder.x264_settings(1920, 1080, 25, low_latency=True,
+                                              cpu_budget=0.1, cores=1)
+        self.assertEqual(1, x264.threads)
+        self.assertEqual("ultrafast", x264.preset)
+
+    def testScreencastCommand(self):
+        self.enterContext(mock.patch.object(pipeline_builder, "cpu_cores",
+                                            return_value=8))
+        builder = self.create_builder(operation=OpMode.SCREENCAST,
+                                      screencast=True, resolution="720p")
+        command = builder.command
+
+        self.assertEqual(1280, builder.x264.width)
+        self.assertEqual(25.0, builder.target_fps)
+        self.assertTrue(builder.reports_progress)
+        self.assertEqual(builder.x264.args,
+                         command[command.index("-preset"):
+                                 command.index("-preset") + 6])
+        self.assertIn("zerolatency", command)
+
+        builder = self.create_builder(operation=OpMode.SCREENCAST,
+                                      screencast=True, vcodec="h264_nvenc")
+        self.assertNotIn("-preset", builder.command)
+        self.assertIsNone(builder.x264)
+
+    def testHlsCommands(self):
+        self.enterContext(mock.patch.object(pipeline_builder, "cpu_cores",
+                                            return_value=8))
+        store = segment_store.SegmentStore("/dev/shm/mkchromecast-hls-5000")
+
+        command = self.create_builder(operation=OpMode.SCREENCAST,
+                                      screencast=True, hls_store=store).command
+        # MPEG-TS can't hold vorbis.
+        self.assertEqual(["-acodec", "aac"],
+                         command[command.index("-acodec"):][:2])
+        self.assertEqual(["-force_key_frames", "expr:gte(t,n_forced*2)"],
+                         command[command.index("-force_key_frames"):][:2])
+        self.assertEqual(str(store.playlist), command[-1])
+        self.assertNotIn("pipe:1", command)
+
+        # HLS segments can only take h264 video and aac or mp3 audio.
+        self.enterContext(mock.patch.object(
+            media_probe, "media_info", autospec=True,
+            return_value=_media_info(
+                _video_stream(codec_name="hevc", profile="Main"),
+                _audio_stream(codec_name="opus"))))
+        builder = self.create_builder(operation=OpMode.INPUT_FILE,
+                                      device_generation="ultra",
+                                      hls_store=store, segment_time=4)
+        command = builder.command
+        self.assertIn("libx264", command)
+        self.assertIn("libmp3lame", command)
+        self.assertIn("expr:gte(t,n_forced*4)", command)
+        self.assertIsNone(builder.file_action)
 
     def testSpotCheckReencodeFullCommand(self):
+        self.enterContext(mock.patch.object(pipeline_builder, "cpu_cores",
+                                            return_value=8))
+        self.enterContext(mock.patch.object(
+            media_probe, "media_info", autospec=True,
+            return_value=_media_info(_video_stream(height=720, fps=24.0),
+                                     _audio_stream(codec_name="aac"))))
         exp_command = [
             "ffmpeg",
+            "-nostats", "-progress", "pipe:2",
             "-re",
             "-i", "input_file.mp4",
             "-map_chapters", "-1",
             "-vcodec", "libx264",
-            "-preset", "veryfast",
-            "-tune", "zerolatency",
+            "-preset", "faster",
+            "-threads", "6",
+            "-x264-params", "rc-lookahead=24:sliced-threads=0",
             "-maxrate", "10000k",
             "-bufsize", "20000k",
             "-pix_fmt", "yuv420p",
             "-g", "60",
+            "-codec:a", "copy",
             "-f", "mp4",
             "-movflags", "frag_keyframe+empty_moov",
             "-vf", "scale=1920x1080",
@@ -319,10 +563,43 @@ class VideoBuilderTests(unittest.TestCase):
                                       input_file="input_file.mp4",
                                       resolution="1080p")
         self.assertEqual(exp_command, builder.command)
+        self.assertEqual(1920, builder.x264.width)
+        self.assertIsNone(builder.target_fps)
+        media_probe.media_info.assert_called_once_with("input_file.mp4")
+
+    def testSpotCheckMatchingResolutionFullCommand(self):
+        self.enterContext(mock.patch.object(
+            media_probe, "media_info", autospec=True,
+            return_value=_media_info(_video_stream(height=1080),
+                                     _audio_stream(codec_name="ac3"))))
+        exp_command = [
+            "ffmpeg",
+            "-nostats", "-progress", "pipe:2",
+            "-re",
+            "-i", "input_file.mp4",
+            "-map_chapters", "-1",
+            "-vcodec", "copy",
+            "-codec:a", "libmp3lame",
+            "-q:a", "0",
+            "-f", "mp4",
+            "-movflags", "frag_keyframe+empty_moov",
+            "pipe:1",
+        ]
+
+        builder = self.create_builder(operation=OpMode.INPUT_FILE,
+                                      input_file="input_file.mp4",
+                                      resolution="1080p")
+        self.assertEqual(exp_command, builder.command)
+        self.assertIsNone(builder.x264)
 
     def testSpotCheckCopyFullCommand(self):
+        # Files that can't be probed are copied.
+        self.enterContext(mock.patch.object(
+            media_probe, "media_info", autospec=True,
+            side_effect=ValueError("Invalid data")))
         exp_command = [
             "ffmpeg",
+            "-nostats", "-progress", "pipe:2",
             "-stream_loop", "-1",
             "-ss", "hh:mm:ss",
             "-re",
@@ -340,6 +617,62 @@ class VideoBuilderTests(unittest.TestCase):
                                       loop=True,
                                       seek="hh:mm:ss")
         self.assertEqual(exp_command, builder.command)
+        self.assertIsNone(builder.x264)
+        self.assertIsNone(builder.file_action)
+
+    def testFileAction(self):
+        media_info = self.enterContext(mock.patch.object(
+            media_probe, "media_info", autospec=True))
+        Action = pipeline_builder.codec_support.Action
+
+        def file_action(info, **settings):
+            media_info.return_value = info
+            builder = self.create_builder(operation=OpMode.INPUT_FILE,
+                                          **settings)
+            builder.command
+            return builder.file_action
+
+        mp4 = _media_info(_video_stream(), _audio_stream())
+        self.assertEqual(Action.COPY, file_action(mp4))
+        mkv = media_probe.MediaInfo(format_name="matroska,webm", duration=60.0,
+                                    bit_rate=None, streams=mp4.streams)
+        self.assertEqual(Action.REMUX, file_action(mkv))
+
+        # Anything else for ffmpeg to do needs the live stream.
+        self.assertIsNone(file_action(mp4, loop=True))
+        self.assertIsNone(file_action(mp4, subtitles="subs.srt"))
+        self.assertIsNone(file_action(mp4, resolution="720p"))
+        self.assertIsNone(file_action(
+            _media_info(_video_stream(), _audio_stream(codec_name="ac3"))))
+        self.assertIsNone(file_action(
+            _media_info(_video_stream(pix_fmt="yuv420p10le"))))
+
+    def testRemuxCommand(self):
+        self.enterContext(mock.patch.object(
+            media_probe, "media_info", autospec=True,
+            return_value=media_probe.MediaInfo(
+                format_name="matroska,webm", duration=60.0, bit_rate=None,
+                streams=(_audio_stream(index=0, codec_name="opus"),
+                         _video_stream(index=1)))))
+        builder = self.create_builder(operation=OpMode.INPUT_FILE,
+                                      input_file="input_file.mkv",
+                                      seek="00:01:00")
+        builder.command
+        exp_command = [
+            "ffmpeg",
+            "-nostats",
+            "-y",
+            "-i", "input_file.mkv",
+            "-map", "0:1",
+            "-map", "0:0",
+            "-strict", "experimental",
+            "-map_chapters", "-1",
+            "-codec", "copy",
+            "-f", "mp4",
+            "-movflags", "frag_keyframe+global_sidx",
+            "remuxed.mp4",
+        ]
+        self.assertEqual(exp_command, builder.remux_command("remuxed.mp4"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+# this file is part of mkchromecast.
+
+import ctypes
+import unittest
+from unittest import mock
+
+from mkchromecast import pulse_capture
+
+
+class PulseCaptureTests(unittest.TestCase):
+    def setUp(self):
+        self.library = mock.Mock()
+        self.library.pa_simple_new.return_value = 1234
+        self.library.pa_strerror.return_value = b"Connection refused"
+        self.enterContext(mock.patch.object(pulse_capture, "_library",
+                                            self.library))
+        self.fragments = iter([b"abcdefgh", b"ijklmnop"])
+
+        def read(handle, buffer, size, error):
+            ctypes.memmove(buffer, next(self.fragments), size)
+            return 0
+
+        self.library.pa_simple_read.side_effect = read
+
+    def testReadsIntoReusedBuffer(self):
+        with pulse_capture.PulseCapture(fragment_size=8) as capture:
+            first = capture.read_fragment()
+            self.assertEqual(b"abcdefgh", bytes(first))
+            second = capture.read_fragment()
+            self.assertEqual(b"ijklmnop", bytes(second))
+            # The same memory, overwritten.
+            self.assertEqual(b"ijklmnop", bytes(first))
+
+        spec = self.library.pa_simple_new.call_args.args[5]._obj
+        self.assertEqual((3, 44100, 2),
+                         (spec.format, spec.rate, spec.channels))
+        attr = self.library.pa_simple_new.call_args.args[7]._obj
+        self.assertEqual(8, attr.fragsize)
+
+    def testFragmentsHoldWholeFrames(self):
+        self.assertEqual(
+            8, pulse_capture.PulseCapture(fragment_size=10).fragment_size)
+        self.assertEqual(
+            4, pulse_capture.PulseCapture(fragment_size=1).fragment_size)
+
+    def testClosedCaptureIsEmpty(self):
+        capture = pulse_capture.PulseCapture(fragment_size=8)
+        capture.close()
+        capture.close()
+        self.assertEqual(b"", bytes(capture.read_fragment()))
+        self.library.pa_simple_free.assert_called_once_with(1234)
+
+    def testErrors(self):
+        self.library.pa_simple_read.side_effect = None
+        self.library.pa_simple_read.return_value = -1
+        capture = pulse_capture.PulseCapture(fragment_size=8)
+        with self.assertRaisesRegex(OSError, "Connection refused"):
+            capture.read_fragment()
+
+        self.library.pa_simple_new.return_value = None
+        with self.assertRaisesRegex(OSError, "Mkchromecast.monitor"):
+            pulse_capture.PulseCapture(fragment_size=8)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,161 @@
+# this file is part of mkchromecast.
+
+import subprocess
+import unittest
+from unittest import mock
+
+from mkchromecast import pulseaudio
+
+
+class _Disconnected(Exception):
+    pass
+
+
+class _IndexError(Exception):
+    pass
+
+
+def _pulsectl(pulse: mock.Mock) -> mock.Mock:
+    """A pulsectl module whose connections are `pulse`."""
+    return mock.Mock(Pulse=mock.Mock(return_value=pulse),
+                     PulseError=Exception,
+                     PulseIndexError=_IndexError)
+
+
+def _completed(stdout: bytes) -> subprocess.CompletedProcess:
+    return subprocess.CompletedProcess([], 0, stdout=stdout, stderr=b"")
+
+
+_PACTL_SINKS = b"""\
+Sink #0
+\tState: SUSPENDED
+\tName: alsa_output.pci-0000_00_1f.3.analog-stereo
+\tOwner Module: 7
+Sink #3
+\tState: IDLE
+\tName: Mkchromecast
+\tDescription: Mkchromecast
+\tOwner Module: 26
+Sink #4
+\tState: IDLE
+\tName: Mkchromecast.2
+\tOwner Module: 27
+"""
+
+
+class NativeControlTests(unittest.TestCase):
+    def setUp(self):
+        self.pulse = mock.Mock()
+        self.enterContext(mock.patch.multiple(
+            pulseaudio, pulsectl=_pulsectl(self.pulse), has_pulsectl=True,
+            _DISCONNECTED=(_Disconnected,), _FAILED=(Exception,),
+            _control=None, _sink_num=None, create=True))
+        self.run = self.enterContext(
+            mock.patch.object(pulseaudio.subprocess, "run", autospec=True))
+
+    def testCreateAndRemoveSink(self):
+        self.pulse.module_load.return_value = 26
+        pulseaudio.create_sink()
+        pulseaudio.remove_sink()
+
+        self.pulse.module_load.assert_called_once_with(
+            "module-null-sink",
+            ["sink_name=Mkchromecast",
+             "sink_properties=device.description=Mkchromecast"])
+        self.pulse.module_unload.assert_called_once_with(26)
+        self.run.assert_not_called()
+
+    def testCheckSink(self):
+        self.assertTrue(pulseaudio.check_sink())
+        self.pulse.get_sink_by_name.side_effect = _IndexError
+        self.assertFalse(pulseaudio.check_sink())
+        # The connection is kept.
+        self.assertEqual(1, pulseaudio.pulsectl.Pulse.call_count)
+
+    def testGetSinkList(self):
+        def sink(name, owner_module):
+            info = mock.Mock(owner_module=owner_module)
+            info.name = name
+            return info
+
+        self.pulse.sink_list.return_value = [
+            sink("alsa_output.pci-0000_00_1f.3.analog-stereo", 7),
+            sink("Mkchromecast", 26),
+            sink("Mkchromecast.2", 27)]
+        pulseaudio.get_sink_list()
+        self.assertEqual([26, 27], pulseaudio._sink_num)
+
+    def testCreateSinkFails(self):
+        self.pulse.module_load.side_effect = Exception("Failure: No such entity")
+        with mock.patch("builtins.print") as mock_print:
+            pulseaudio.create_sink()
+        self.assertIsNone(pulseaudio._sink_num)
+        self.assertIn("Failure", str(mock_print.call_args.args[0]))
+
+    def testForgetsConnectionAfterFork(self):
+        pulseaudio.check_sink()
+        pulseaudio._reset_control()
+        pulseaudio.check_sink()
+        self.assertEqual(2, pulseaudio.pulsectl.Pulse.call_count)
+
+    def testReconnects(self):
+        self.pulse.get_sink_by_name.side_effect = [_Disconnected, None]
+        self.assertTrue(pulseaudio.check_sink())
+        self.assertEqual(2, pulseaudio.pulsectl.Pulse.call_count)
+
+    def testFallsBackToPactl(self):
+        pulseaudio.pulsectl.Pulse.side_effect = Exception("No server")
+        self.run.return_value = _completed(
+            b"3\tMkchromecast\tmodule-null-sink.c\ts16le 2ch 44100Hz\tIDLE\n")
+        self.assertTrue(pulseaudio.check_sink())
+        self.run.assert_called_once()
+
+
+class PactlControlTests(unittest.TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.multiple(
+            pulseaudio, has_pulsectl=False, _control=None, _sink_num=None))
+        self.run = self.enterContext(
+            mock.patch.object(pulseaudio.subprocess, "run", autospec=True))
+
+    def testCreateAndRemoveSink(self):
+        self.run.return_value = _completed(b"26\n")
+        pulseaudio.create_sink()
+        pulseaudio.remove_sink()
+        self.assertEqual(["pactl", "unload-module", "26"],
+                         self.run.call_args.args[0])
+
+    def testSinkFailuresAreNotFatal(self):
+        self.enterContext(mock.patch("builtins.print"))
+        self.run.side_effect = subprocess.CalledProcessError(1, ["pactl"])
+        pulseaudio.create_sink()
+        self.assertIsNone(pulseaudio._sink_num)
+
+        self.run.side_effect = None
+        self.run.return_value = _completed(b"Failure: Bad argument\n")
+        pulseaudio.create_sink()
+        self.assertIsNone(pulseaudio._sink_num)
+
+        # Every sink is still tried.
+        self.run.reset_mock()
+        self.run.side_effect = subprocess.CalledProcessError(1, ["pactl"])
+        pulseaudio._sink_num = [26, 27]
+        pulseaudio.remove_sink()
+        self.assertEqual(2, self.run.call_count)
+
+    def testCheckSink(self):
+        self.run.return_value = _completed(
+            b"0\talsa_output.pci-0000_00_1f.3.analog-stereo\tmodule-alsa-card.c"
+            b"\ts16le 2ch 44100Hz\tSUSPENDED\n")
+        self.assertFalse(pulseaudio.check_sink())
+        self.run.side_effect = FileNotFoundError
+        self.assertIsNone(pulseaudio.check_sink())
+
+    def testGetSinkList(self):
+        self.run.return_value = _completed(_PACTL_SINKS)
+        pulseaudio.get_sink_list()
+        self.assertEqual([26, 27], pulseaudio._sink_num)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,59 @@
+# this file is part of mkchromecast.
+
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from mkchromecast import segment_store
+
+
+class SegmentStoreTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = pathlib.Path(
+            self.enterContext(tempfile.TemporaryDirectory()))
+        self.store = segment_store.SegmentStore(tmp_dir / "hls")
+
+    def testResetEmptiesStore(self):
+        self.store.reset()
+        (self.store.directory / "segment00001.ts").write_bytes(b"old")
+        self.store.reset()
+        self.assertEqual([], list(self.store.directory.iterdir()))
+
+    def testOnlyServesSegmentsAndPlaylist(self):
+        self.store.reset()
+        for name in ["stream.m3u8", "segment00001.ts", "segment00002.ts.tmp",
+                     "notes.txt"]:
+            (self.store.directory / name).write_bytes(b"data")
+
+        self.assertEqual(self.store.playlist,
+                         self.store.path_for("stream.m3u8"))
+        self.assertIsNotNone(self.store.path_for("segment00001.ts"))
+        # Not written yet, or not ours.
+        self.assertIsNone(self.store.path_for("segment00002.ts.tmp"))
+        self.assertIsNone(self.store.path_for("segment00003.ts"))
+        self.assertIsNone(self.store.path_for("notes.txt"))
+        self.assertIsNone(self.store.path_for("../hls/stream.m3u8"))
+
+    def testMediaTypes(self):
+        self.assertEqual("application/vnd.apple.mpegurl",
+                         self.store.media_type("stream.m3u8"))
+        self.assertEqual("video/mp2t",
+                         self.store.media_type("segment00001.ts"))
+
+    def testWaitForPlaylist(self):
+        self.store.reset()
+        self.assertFalse(self.store.wait_for_playlist(timeout=0))
+        self.store.playlist.write_text("#EXTM3U\n")
+        self.assertTrue(self.store.wait_for_playlist(timeout=0))
+
+    def testStorePerPort(self):
+        with mock.patch.object(segment_store.os.path, "isdir",
+                               return_value=True):
+            store = segment_store.SegmentStore.for_port(5000)
+        self.assertEqual(pathlib.Path("/dev/shm/mkchromecast-hls-5000"),
+                         store.directory)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
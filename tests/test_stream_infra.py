@@ -0,0 +1,810 @@
+# this file is part of mkchromecast.
+
+import asyncio
+import errno
+import http.client
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from mkchromecast import segment_store
+from mkchromecast import stream_infra
+from mkchromecast import transcode_cache
+
+
+class FakePipeline(stream_infra.Pipeline):
+    """Stands in for a Pipeline whose stdout is the read end of an os.pipe."""
+
+    def __init__(self):
+        read_fd, self.write_fd = os.pipe()
+        super().__init__(
+            [mock.Mock(stdout=os.fdopen(read_fd, "rb", buffering=0))])
+        self.stopped = False
+        # Like Pipeline, this may be stopped from several threads at once.
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes) -> None:
+        os.write(self.write_fd, data)
+
+    def finish(self) -> None:
+        """Simulates the pipeline exiting on its own."""
+        with self._lock:
+            if self.write_fd is not None:
+                os.close(self.write_fd)
+                self.write_fd = None
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.finish()
+
+    def close(self) -> None:
+        self.stop()
+        self.stdout.close()
+
+
+def _ogg_page(granule: int, body: bytes) -> bytes:
+    """Returns an Ogg page with a single segment, and no valid checksum."""
+    return (b"OggS\x00\x00" + granule.to_bytes(8, "little")
+            + bytes(12) + b"\x01" + bytes([len(body)]) + body)
+
+
+class StreamBroadcasterTests(unittest.TestCase):
+    def setUp(self):
+        self.pipelines: list[FakePipeline] = []
+
+    def tearDown(self):
+        # Unblock any reader threads that are still running, and give them a
+        # chance to clean up after themselves.
+        for pipeline in self.pipelines:
+            pipeline.finish()
+        deadline = time.monotonic() + 5
+        while (not all(p.stdout.closed for p in self.pipelines)
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+
+    def start_pipeline(self) -> FakePipeline:
+        pipeline = FakePipeline()
+        self.pipelines.append(pipeline)
+        return pipeline
+
+    def testSubscribersSharePipeline(self):
+        start = mock.Mock(side_effect=self.start_pipeline)
+        broadcaster = stream_infra.StreamBroadcaster(
+            start, sizer=stream_infra.ReadSizer(1024))
+
+        first = broadcaster.subscribe()
+        second = broadcaster.subscribe()
+        start.assert_called_once()
+
+        self.pipelines[0].write(b"hello")
+        self.assertEqual(b"hello", next(first))
+        self.assertEqual(b"hello", next(second))
+
+        self.pipelines[0].finish()
+        self.assertEqual([], list(first))
+        self.assertEqual([], list(second))
+
+    def testRestartsAfterPipelineExits(self):
+        start = mock.Mock(side_effect=self.start_pipeline)
+        broadcaster = stream_infra.StreamBroadcaster(
+            start, sizer=stream_infra.ReadSizer(1024))
+
+        stream = broadcaster.subscribe()
+        self.pipelines[0].finish()
+        self.assertEqual([], list(stream))
+
+        stream = broadcaster.subscribe()
+        self.assertEqual(2, start.call_count)
+        self.pipelines[1].write(b"again")
+        self.assertEqual(b"again", next(stream))
+        self.pipelines[1].finish()
+
+    def testLaggingSubscriberSkipsAhead(self):
+        broadcaster = stream_infra.StreamBroadcaster(
+            self.start_pipeline, sizer=stream_infra.ReadSizer(1), max_chunks=2)
+
+        stream = broadcaster.subscribe()
+        self.pipelines[0].write(b"abcd")
+        self.pipelines[0].finish()
+        with broadcaster._cond:
+            broadcaster._cond.wait_for(lambda: broadcaster._pipeline is None,
+                                       timeout=5)
+
+        # Only the last two single-byte chunks fit in the ring.
+        self.assertEqual(b"cd", b"".join(stream))
+
+    def testBacklogIsReplayed(self):
+        broadcaster = stream_infra.StreamBroadcaster(
+            self.start_pipeline, sizer=stream_infra.ReadSizer(2))
+        broadcaster.start()
+
+        self.pipelines[0].write(b"aabbcc")
+        with broadcaster._cond:
+            broadcaster._cond.wait_for(lambda: broadcaster._ring.next_seq == 3,
+                                       timeout=5)
+
+        # The backlog is trimmed to the byte budget.
+        with_backlog = broadcaster.subscribe(backlog_bytes=3)
+        whole_chunks = broadcaster.subscribe(backlog_bytes=4)
+        live = broadcaster.subscribe()
+        self.pipelines[0].finish()
+
+        self.assertEqual(b"bcc", b"".join(with_backlog))
+        self.assertEqual(b"bbcc", b"".join(whole_chunks))
+        self.assertEqual(b"", b"".join(live))
+
+    def testBacklogStartsAtFrameSync(self):
+        broadcaster = stream_infra.StreamBroadcaster(
+            self.start_pipeline,
+            sizer=stream_infra.ReadSizer(4),
+            framer=stream_infra.MpegFramer())
+        broadcaster.start()
+
+        self.pipelines[0].write(b"\xff\xfbab" b"c\xff\xfbd" b"efgh")
+        with broadcaster._cond:
+            broadcaster._cond.wait_for(lambda: broadcaster._ring.next_seq == 3,
+                                       timeout=5)
+
+        # Within budget, but skips ahead to the frame sync.
+        within_chunk = broadcaster.subscribe(backlog_bytes=7)
+        # A whole chunk that doesn't start with a frame sync.
+        whole_chunks = broadcaster.subscribe(backlog_bytes=8)
+        # No frame sync within the budget at all, so this backs up to the
+        # last one.
+        no_sync = broadcaster.subscribe(backlog_bytes=2)
+        live = broadcaster.subscribe()
+        self.pipelines[0].finish()
+
+        self.assertEqual(b"\xff\xfbdefgh", b"".join(within_chunk))
+        self.assertEqual(b"\xff\xfbdefgh", b"".join(whole_chunks))
+        self.assertEqual(b"\xff\xfbdefgh", b"".join(no_sync))
+        self.assertEqual(b"\xff\xfbdefgh", b"".join(live))
+
+    def testLateSubscriberGetsHeader(self):
+        broadcaster = stream_infra.StreamBroadcaster(
+            self.start_pipeline,
+            sizer=stream_infra.ReadSizer(1024),
+            framer=stream_infra.OggFramer())
+        first = broadcaster.subscribe()
+
+        header = _ogg_page(0, b"head")
+        audio = _ogg_page(960, b"one") + _ogg_page(1920, b"two")
+        self.pipelines[0].write(header + audio)
+        self.assertEqual(header, next(first))
+        self.assertEqual(audio, next(first))
+
+        late = broadcaster.subscribe()
+        self.pipelines[0].finish()
+        self.assertEqual(header + _ogg_page(1920, b"two"), b"".join(late))
+
+    def testLastSubscriberStopsPipeline(self):
+        broadcaster = stream_infra.StreamBroadcaster(
+            self.start_pipeline, sizer=stream_infra.ReadSizer(1024))
+
+        first = broadcaster.subscribe()
+        second = broadcaster.subscribe()
+        self.pipelines[0].write(b"data")
+        next(first)
+        next(second)
+
+        first.close()
+        self.assertFalse(self.pipelines[0].stopped)
+        second.close()
+        self.assertTrue(self.pipelines[0].stopped)
+
+    def testKeepRunningWithoutSubscribers(self):
+        broadcaster = stream_infra.StreamBroadcaster(
+            self.start_pipeline, sizer=stream_infra.ReadSizer(1024))
+        broadcaster.keep_running = True
+
+        stream = broadcaster.subscribe()
+        self.pipelines[0].write(b"data")
+        next(stream)
+        stream.close()
+        self.assertFalse(self.pipelines[0].stopped)
+
+        broadcaster.subscribe().close()
+        self.assertEqual(1, len(self.pipelines))
+        self.pipelines[0].finish()
+
+
+class AsyncStreamBroadcasterTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.pipelines: list[FakePipeline] = []
+
+    def tearDown(self):
+        for pipeline in self.pipelines:
+            pipeline.finish()
+
+    def start_pipeline(self) -> FakePipeline:
+        pipeline = FakePipeline()
+        self.pipelines.append(pipeline)
+        return pipeline
+
+    async def testSubscribersSharePipeline(self):
+        start = mock.Mock(side_effect=self.start_pipeline)
+        broadcaster = stream_infra.AsyncStreamBroadcaster(start)
+
+        first = broadcaster.subscribe()
+        second = broadcaster.subscribe()
+        first_chunk = asyncio.ensure_future(anext(first))
+        second_chunk = asyncio.ensure_future(anext(second))
+        await asyncio.sleep(0)
+        start.assert_called_once()
+
+        self.pipelines[0].write(b"hello")
+        self.assertEqual(b"hello", await first_chunk)
+        self.assertEqual(b"hello", await second_chunk)
+
+        self.pipelines[0].finish()
+        self.assertEqual([], [chunk async for chunk in first])
+        self.assertEqual([], [chunk async for chunk in second])
+
+    async def testLastSubscriberStopsPipeline(self):
+        broadcaster = stream_infra.AsyncStreamBroadcaster(self.start_pipeline)
+
+        stream = broadcaster.subscribe()
+        chunk = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        self.pipelines[0].write(b"hello")
+        self.assertEqual(b"hello", await chunk)
+
+        await stream.aclose()
+        self.assertIsNone(broadcaster._pipeline)
+        for _ in range(100):
+            if self.pipelines[0].stopped:
+                break
+            await asyncio.sleep(0.01)
+        self.assertTrue(self.pipelines[0].stopped)
+
+    async def testKeepRunningWithoutSubscribers(self):
+        broadcaster = stream_infra.AsyncStreamBroadcaster(self.start_pipeline)
+        broadcaster.keep_running = True
+        await broadcaster.start()
+
+        self.pipelines[0].write(b"abc")
+        while broadcaster._ring.next_seq < 1:
+            await asyncio.sleep(0.01)
+
+        stream = broadcaster.subscribe(backlog_bytes=3)
+        self.assertEqual(b"abc", await anext(stream))
+        await stream.aclose()
+        self.assertFalse(self.pipelines[0].stopped)
+
+
+class AdaptiveReadSizerTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+
+    def clock(self) -> float:
+        return self.now
+
+    def feed(self, sizer, rate: int, seconds: float) -> None:
+        """Simulates reads of a pipeline producing `rate` bytes per second."""
+        for _ in range(int(seconds * 10)):
+            self.now += 0.1
+            sizer.update(rate // 10)
+
+    def testFollowsThroughput(self):
+        sizer = stream_infra.AdaptiveReadSizer(
+            4096, min_size=512, max_size=1 << 20, target_latency_ms=100,
+            clock=self.clock)
+        self.assertEqual(4096, sizer.size)
+
+        # 10 Mbit/s produces about 128 KiB per 100 ms.
+        self.feed(sizer, 10_000_000 // 8, seconds=5)
+        self.assertEqual(128 * 1024, sizer.size)
+
+        # 32 kbit/s produces about 400 bytes per 100 ms.
+        self.feed(sizer, 32_000 // 8, seconds=10)
+        self.assertEqual(512, sizer.size)
+
+    def testClampsToBounds(self):
+        sizer = stream_infra.AdaptiveReadSizer(
+            1 << 30, min_size=1024, max_size=8192, target_latency_ms=100,
+            clock=self.clock)
+        self.assertEqual(8192, sizer.size)
+
+        self.feed(sizer, 100, seconds=2)
+        self.assertEqual(1024, sizer.size)
+        self.feed(sizer, 100_000_000, seconds=2)
+        self.assertEqual(8192, sizer.size)
+
+    def testPrintsSizeChangesWhenDebugging(self):
+        sizer = stream_infra.AdaptiveReadSizer(
+            4096, min_size=512, max_size=1 << 20, target_latency_ms=100,
+            debug=True, clock=self.clock)
+        with mock.patch("builtins.print") as mock_print:
+            self.feed(sizer, 10_000_000 // 8, seconds=1)
+        mock_print.assert_called()
+        self.assertIn("read size", mock_print.call_args.args[0])
+
+
+class ChunkRingTests(unittest.TestCase):
+    def testReadFrom(self):
+        ring = stream_infra.ChunkRing(max_chunks=2)
+        for chunk in (b"a", b"b", b"c"):
+            ring.append(chunk)
+
+        self.assertEqual(([b"c"], 3), ring.read_from(2))
+        # Cursors that have fallen out of the ring skip ahead.
+        self.assertEqual(([b"b", b"c"], 3), ring.read_from(0))
+        self.assertEqual(([], 3), ring.read_from(3))
+
+    def testBacklogStart(self):
+        ring = stream_infra.ChunkRing(max_chunks=4)
+        for chunk in (b"aa", b"bb", b"cc"):
+            ring.append(chunk)
+
+        self.assertEqual((3, b""), ring.backlog_start(0))
+        self.assertEqual((2, b""), ring.backlog_start(2))
+        self.assertEqual((2, b"b"), ring.backlog_start(3))
+        self.assertEqual((0, b""), ring.backlog_start(100))
+
+
+    def testBacklogStartsAtBoundary(self):
+        ring = stream_infra.ChunkRing(max_chunks=4,
+                                      framer=stream_infra.MpegFramer())
+        for chunk in (b"\xff\xfbab", b"cdef", b"gh\xff\xfb"):
+            ring.append(chunk)
+
+        self.assertEqual((3, b"\xff\xfb"), ring.backlog_start(0))
+        self.assertEqual((3, b"\xff\xfb"), ring.backlog_start(3))
+        self.assertEqual((0, b""), ring.backlog_start(12))
+        self.assertEqual((3, b"\xff\xfb"), ring.backlog_start(10))
+
+        # Without any sync point, readers start with the live output.
+        ring = stream_infra.ChunkRing(max_chunks=4,
+                                      framer=stream_infra.MpegFramer())
+        ring.append(b"abcd")
+        self.assertEqual((1, b""), ring.backlog_start(2))
+
+
+class FramerTests(unittest.TestCase):
+    def testOggHeader(self):
+        framer = stream_infra.OggFramer()
+        header = _ogg_page(0, b"OpusHead") + _ogg_page(0, b"OpusTags")
+        audio = _ogg_page(960, b"audio")
+
+        # The header is held back until it's complete.
+        self.assertEqual(b"", framer.feed(header[:30]))
+        self.assertEqual(audio, framer.feed(header[30:] + audio))
+        self.assertEqual(header, framer.header)
+        self.assertEqual(audio, framer.feed(audio))
+        self.assertEqual(5, framer.find_sync(b"audioOggS"))
+
+        framer.reset()
+        self.assertEqual(b"", framer.header)
+        self.assertEqual(b"", framer.feed(header))
+
+    def testWavHeaderAndAlignment(self):
+        framer = stream_infra.WavFramer()
+        fmt = (b"fmt \x10\x00\x00\x00" + b"\x01\x00\x02\x00"
+               + (44100).to_bytes(4, "little") + (44100 * 6).to_bytes(4, "little")
+               + b"\x06\x00\x18\x00")
+        header = (b"RIFF\xff\xff\xff\xffWAVE" + fmt
+                  + b"LIST\x03\x00\x00\x00abc\x00"
+                  + b"data\xff\xff\xff\xff")
+
+        # Chunks only ever hold whole 6 byte sample frames.
+        self.assertEqual(b"", framer.feed(header + b"abcd"))
+        self.assertEqual(header, framer.header)
+        self.assertEqual(b"abcdefghijkl", framer.feed(b"efghijklm"))
+        self.assertEqual(b"mnopqr", framer.feed(b"nopqr"))
+
+        self.assertEqual(6, framer.find_sync(b"abcdefghijkl", 1))
+        self.assertEqual(-1, framer.find_sync(b"abcdefghijkl", 7))
+        self.assertEqual(6, framer.last_sync(b"abcdefghijkl", 12))
+        self.assertEqual(0, framer.last_sync(b"abcdefghijkl", 6))
+
+    def testFlacHeader(self):
+        framer = stream_infra.FlacFramer()
+        header = (b"fLaC" + b"\x00\x00\x00\x02ab"
+                  + b"\x81\x00\x00\x01c")
+        self.assertEqual(b"\xff\xf8", framer.feed(header + b"\xff\xf8"))
+        self.assertEqual(header, framer.header)
+        self.assertEqual(2, framer.find_sync(b"ab\xff\xf9"))
+        self.assertEqual(-1, framer.find_sync(b"ab\xff\xfb"))
+
+    def testStreamWithoutHeader(self):
+        for framer in (stream_infra.OggFramer(), stream_infra.WavFramer(),
+                       stream_infra.FlacFramer()):
+            with self.subTest(framer=type(framer).__name__):
+                self.assertEqual(b"not a header",
+                                 framer.feed(b"not a header"))
+                self.assertEqual(b"", framer.header)
+
+    def testFramerForCodec(self):
+        for codec in ["mp3", "aac", "ogg", "opus", "wav", "flac"]:
+            with self.subTest(codec=codec):
+                framer = stream_infra.framer_for_codec(codec)
+                self.assertIsInstance(framer, stream_infra.StreamFramer)
+                self.assertIsNot(framer, stream_infra.framer_for_codec(codec))
+
+
+class FrameSyncTests(unittest.TestCase):
+    def testFindFrameSync(self):
+        find = stream_infra.find_frame_sync
+        # MP3 (MPEG-1 layer III) and ADTS frame headers.
+        self.assertEqual(2, find(b"ab\xff\xfb\x90"))
+        self.assertEqual(1, find(b"a\xff\xf1\x50"))
+        # A lone 0xff, or one that isn't followed by the remaining sync bits.
+        self.assertEqual(-1, find(b"ab\xff"))
+        self.assertEqual(-1, find(b"\xff\x10\xff\x7f"))
+        self.assertEqual(3, find(b"\xff\xfb\x00\xff\xfb", start=1))
+
+    def testPrewarmBacklogBytes(self):
+        # 192 kbps is 24000 bytes per second.
+        self.assertEqual(7200, stream_infra.prewarm_backlog_bytes(192, 300))
+        self.assertEqual(0, stream_infra.prewarm_backlog_bytes(192, 0))
+        self.assertEqual(24000, stream_infra.prewarm_backlog_bytes(192, 1000))
+
+    def testStreamBitrate(self):
+        self.assertEqual(192, stream_infra.stream_bitrate("mp3", 192, 44100))
+        self.assertEqual(2116, stream_infra.stream_bitrate("wav", 192, 44100))
+        self.assertEqual(846, stream_infra.stream_bitrate("flac", 192, 44100))
+
+
+class ReadPipelineTests(unittest.TestCase):
+    def testClosesPipelineWhenClientLeaves(self):
+        pipeline = FakePipeline()
+        stream = stream_infra.read_pipeline(
+            pipeline, sizer=stream_infra.ReadSizer(1024))
+
+        pipeline.write(b"data")
+        self.assertEqual(b"data", next(stream))
+        stream.close()
+        self.assertTrue(pipeline.stopped)
+        self.assertTrue(pipeline.stdout.closed)
+
+
+class FakeCapture:
+    """Stands in for a PulseCapture, with the fragments that it reads."""
+
+    def __init__(self, fragments: list[bytes]):
+        self._fragments = fragments
+        self.closed = False
+
+    def read_fragment(self) -> bytes:
+        if self.closed or not self._fragments:
+            return b""
+        return self._fragments.pop(0)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class PulseCapturePipelineTests(unittest.TestCase):
+    def testFeedsEncoder(self):
+        capture = FakeCapture([b"abcd", b"efgh"])
+        encoder = subprocess.Popen(["cat"], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+        pipeline = stream_infra.PulseCapturePipeline(capture, encoder)
+
+        self.assertEqual(b"abcdefgh", b"".join(stream_infra.read_pipeline(
+            pipeline, stream_infra.ReadSizer(1024))))
+        self.assertTrue(capture.closed)
+
+    def testStopClosesCapture(self):
+        capture = FakeCapture([b"abcd"] * 1000)
+        encoder = subprocess.Popen(["sleep", "10"], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+        pipeline = stream_infra.PulseCapturePipeline(capture, encoder)
+        pipeline.close()
+        self.assertTrue(capture.closed)
+        self.assertIsNotNone(encoder.poll())
+
+
+class SpliceToSocketTests(unittest.TestCase):
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        os.close(self.read_fd)
+        self.sender.close()
+        self.receiver.close()
+
+    def transfer(self, data: bytes) -> bytes:
+        os.write(self.write_fd, data)
+        os.close(self.write_fd)
+        stream_infra.splice_to_socket(
+            self.read_fd, self.sender, sizer=stream_infra.ReadSizer(3))
+        self.sender.shutdown(socket.SHUT_WR)
+
+        received = b""
+        while chunk := self.receiver.recv(1024):
+            received += chunk
+        return received
+
+    def testTransfersEverything(self):
+        self.assertEqual(b"0123456789", self.transfer(b"0123456789"))
+
+    def testFallsBackWithoutSplice(self):
+        if hasattr(os, "splice"):
+            self.enterContext(mock.patch.object(
+                os, "splice", side_effect=OSError(errno.EINVAL, "no splice")))
+        self.assertEqual(b"0123456789", self.transfer(b"0123456789"))
+
+
+class StaticFileTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.path = os.path.join(tmp_dir, "movie.mp4")
+        with open(self.path, "wb") as movie:
+            movie.write(b"0123456789")
+        self.static_file = self.enterContext(
+            stream_infra.StaticFile(self.path, "video/mp4"))
+        self.sender, self.receiver = socket.socketpair()
+        self.addCleanup(self.sender.close)
+        self.addCleanup(self.receiver.close)
+
+    def send(self, offset: int, length: int) -> bytes:
+        self.static_file.send(self.sender, offset, length)
+        self.sender.shutdown(socket.SHUT_WR)
+
+        received = b""
+        while chunk := self.receiver.recv(1024):
+            received += chunk
+        return received
+
+    def testSendsRange(self):
+        self.assertEqual(b"3456", self.send(3, 4))
+
+    def testFallsBackWithoutSendfile(self):
+        if hasattr(os, "sendfile"):
+            self.enterContext(mock.patch.object(
+                os, "sendfile", side_effect=OSError(errno.EINVAL, "no sendfile")))
+        self.assertEqual(b"3456", self.send(3, 4))
+
+    def testStatsOnce(self):
+        with open(self.path, "ab") as movie:
+            movie.write(b"abc")
+        headers, offset, length = self.static_file.response(None)
+        self.assertIn(b"Content-Length: 10\r\n", headers)
+        self.assertEqual((0, 10), (offset, length))
+
+    def testServesRemovedFile(self):
+        os.remove(self.path)
+        self.assertEqual(b"0123456789", self.send(0, 10))
+
+
+class ByteRangeTests(unittest.TestCase):
+    def testParse(self):
+        for header, expected in [
+                (None, None),
+                ("bytes=0-", (0, 100)),
+                ("bytes=10-19", (10, 10)),
+                ("bytes=90-200", (90, 10)),
+                ("bytes=-30", (70, 30)),
+                ("bytes=-300", (0, 100)),
+                # The whole file is sent for anything we don't handle.
+                ("bytes=0-9,20-29", None),
+                ("items=0-9", None),
+                ("bytes=nine-", None),
+                ("bytes=20-10", None)]:
+            with self.subTest(header=header):
+                self.assertEqual(expected,
+                                 stream_infra.parse_byte_range(header, 100))
+
+    def testUnsatisfiable(self):
+        for header in "bytes=100-", "bytes=-0":
+            with self.subTest(header=header):
+                with self.assertRaises(ValueError):
+                    stream_infra.parse_byte_range(header, 100)
+
+
+class ZeroCopyFileTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        path = os.path.join(tmp_dir, "movie.mp4")
+        with open(path, "wb") as movie:
+            movie.write(b"0123456789")
+        static_file = self.enterContext(
+            stream_infra.StaticFile(path, "video/x-matroska"))
+        self.enterContext(mock.patch.multiple(
+            stream_infra.FlaskServer, _static_file=static_file,
+            _media_type="video/x-matroska", create=True))
+
+        server = stream_infra._ZeroCopyTCPServer(
+            ("127.0.0.1", 0), stream_infra._ZeroCopyRequestHandler)
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        self.port = server.server_address[1]
+
+    def request(self, headers: dict[str, str], path: str = "/stream"):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        self.addCleanup(connection.close)
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def testWholeFile(self):
+        response, body = self.request({})
+        self.assertEqual(200, response.status)
+        self.assertEqual("bytes", response.getheader("Accept-Ranges"))
+        self.assertEqual("video/x-matroska", response.getheader("Content-Type"))
+        self.assertEqual(b"0123456789", body)
+
+    def testRange(self):
+        response, body = self.request({"Range": "bytes=4-6"})
+        self.assertEqual(206, response.status)
+        self.assertEqual("bytes 4-6/10", response.getheader("Content-Range"))
+        self.assertEqual(b"456", body)
+
+    def testUnsatisfiableRange(self):
+        response, body = self.request({"Range": "bytes=10-"})
+        self.assertEqual(416, response.status)
+        self.assertEqual("bytes */10", response.getheader("Content-Range"))
+        self.assertEqual(b"", body)
+
+    def testHlsSegments(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        store = segment_store.SegmentStore(os.path.join(tmp_dir, "hls"))
+        store.reset()
+        store.playlist.write_text("#EXTM3U\n")
+        (store.directory / "segment00001.ts").write_bytes(b"segment")
+        self.enterContext(mock.patch.multiple(
+            stream_infra.FlaskServer, _segment_store=store,
+            _playlist_timeout=0))
+
+        response, body = self.request({}, "/hls/stream.m3u8")
+        self.assertEqual(200, response.status)
+        self.assertEqual("application/vnd.apple.mpegurl",
+                         response.getheader("Content-Type"))
+        self.assertEqual(b"#EXTM3U\n", body)
+
+        response, body = self.request({}, "/hls/segment00001.ts")
+        self.assertEqual("video/mp2t", response.getheader("Content-Type"))
+        self.assertEqual(b"segment", body)
+
+        response, _ = self.request({}, "/hls/segment00002.ts")
+        self.assertEqual(404, response.status)
+
+        # Another encoder isn't started for /stream.
+        response, _ = self.request({}, "/stream")
+        self.assertEqual(404, response.status)
+
+        self.enterContext(mock.patch.multiple(
+            stream_infra.FlaskServer, _app=mock.sentinel.app,
+            _video_mode=True))
+        _, body = self.request({}, "/")
+        self.assertIn(b'src="/hls/stream.m3u8"', body)
+
+        stream_infra.FlaskServer.stop_segmenter()
+        self.assertFalse(store.directory.exists())
+
+    def testRemovedHlsSegment(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        # ffmpeg removes old segments, perhaps right after they're looked up.
+        self.enterContext(mock.patch.object(
+            stream_infra.FlaskServer, "_segment_path",
+            return_value=os.path.join(tmp_dir, "segment00001.ts")))
+
+        response, _ = self.request({}, "/hls/segment00001.ts")
+        self.assertEqual(404, response.status)
+
+
+class TranscodeCachePipelineTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.cache = transcode_cache.TranscodeCache(tmp_dir, max_bytes=1024)
+
+    def _encode(self, script: str) -> stream_infra.CachingPipeline:
+        process = subprocess.Popen(["sh", "-c", script],
+                                   stdout=subprocess.PIPE)
+        return stream_infra.CachingPipeline(process, self.cache.create("key"))
+
+    def testCachesFinishedTranscode(self):
+        pipeline = self._encode("printf fragmented; printf ' mp4'")
+        data = b"".join(pipeline.read_chunks(stream_infra.ReadSizer(4)))
+        pipeline.close()
+        self.assertEqual(b"fragmented mp4", data)
+
+        cached = stream_infra.CachedFilePipeline(self.cache.lookup("key"))
+        # Readers of stdout get the same bytes.
+        self.assertEqual(data, cached.stdout.read())
+        cached.close()
+
+    def testDropsFailedTranscode(self):
+        pipeline = self._encode("printf partial; exit 1")
+        list(pipeline.read_chunks(stream_infra.ReadSizer(4)))
+        pipeline.close()
+        self.assertIsNone(self.cache.lookup("key"))
+
+    def testDropsUnfinishedTranscode(self):
+        pipeline = self._encode("printf partial; sleep 10")
+        chunks = pipeline.read_chunks(stream_infra.ReadSizer(4))
+        next(chunks)
+        chunks.close()
+        pipeline.close()
+        self.assertIsNone(self.cache.lookup("key"))
+
+
+class EncodeProgressTests(unittest.TestCase):
+
+    def testLogsRateAndPassesThroughLogs(self):
+        self.enterContext(
+            mock.patch.object(stream_infra, "ENCODE_PROGRESS_INTERVAL", 10.0))
+        self.enterContext(mock.patch.object(
+            stream_infra.time, "monotonic", side_effect=[0.0, 5.0, 10.0]))
+        stream = mock.MagicMock()
+        stream.__iter__.return_value = [
+            b"[libx264 @ 0x1] using cpu capabilities: AVX2\n",
+            b"frame=50\n", b"fps=25.0\n", b"progress=continue\n",
+            b"frame=200\n",
+        ]
+
+        with mock.patch("builtins.print") as print_mock:
+            stream_infra.log_encode_progress(stream, target_fps=25.0)
+
+        printed = [" ".join(map(str, call.args))
+                   for call in print_mock.call_args_list]
+        self.assertIn("using cpu capabilities", printed[0])
+        self.assertIn("20.0 fps", printed[1])
+        # 20 fps can't keep up with 25 fps.
+        self.assertIn("can't keep up", printed[2])
+        self.assertEqual(3, len(printed))
+        stream.close.assert_called_once()
+
+
+@unittest.skipUnless(stream_infra.has_pyav, "PyAV is not installed")
+class PyAVPipelineTests(unittest.TestCase):
+    def testEncodesCapture(self):
+        # One second of silence stands in for parec.
+        capture = subprocess.Popen(["head", "-c", "176400", "/dev/zero"],
+                                   stdout=subprocess.PIPE)
+        pipeline = stream_infra.PyAVPipeline(
+            capture, stream_infra.PyAVOutput(format="mp3", codec="libmp3lame",
+                                             samplerate=44100, bitrate=128))
+        encoded = b"".join(stream_infra.read_pipeline(
+            pipeline, stream_infra.ReadSizer(4096)))
+
+        self.assertNotEqual(-1, stream_infra.find_frame_sync(encoded))
+        # About a second at 128 kbps.
+        self.assertAlmostEqual(16000, len(encoded), delta=2000)
+
+    def testEncodesInProcessCapture(self):
+        capture = FakeCapture([bytes(17640)] * 10)
+        pipeline = stream_infra.PyAVPipeline(
+            capture, stream_infra.PyAVOutput(format="mp3", codec="libmp3lame",
+                                             samplerate=44100, bitrate=128))
+        encoded = b"".join(stream_infra.read_pipeline(
+            pipeline, stream_infra.ReadSizer(4096)))
+
+        self.assertAlmostEqual(16000, len(encoded), delta=2000)
+        self.assertTrue(capture.closed)
+
+
+class WaitForExitTests(unittest.TestCase):
+    def testReturnsWhenProcessExits(self):
+        proc = subprocess.Popen(["sleep", "0.2"])
+        self.addCleanup(proc.wait)
+
+        waiter = threading.Thread(target=stream_infra.wait_for_exit,
+                                  args=(proc.pid,))
+        waiter.start()
+        waiter.join(timeout=0.1)
+        self.assertTrue(waiter.is_alive())
+
+        waiter.join(timeout=5)
+        self.assertFalse(waiter.is_alive())
+
+    def testReturnsForMissingProcess(self):
+        proc = subprocess.Popen(["true"])
+        proc.wait()
+
+        # Should return right away, since the pid no longer exists.
+        stream_infra.wait_for_exit(proc.pid)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
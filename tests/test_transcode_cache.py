@@ -0,0 +1,99 @@
+# this file is part of mkchromecast.
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from mkchromecast import transcode_cache
+
+
+class TranscodeCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = pathlib.Path(
+            self.enterContext(tempfile.TemporaryDirectory()))
+        self.cache = transcode_cache.TranscodeCache(
+            self.tmp_dir / "transcodes", max_bytes=100)
+
+    def _cache(self, key: str, data: bytes) -> None:
+        writer = self.cache.create(key)
+        writer.write(data)
+        writer.commit()
+
+    def testCommit(self):
+        self.assertIsNone(self.cache.lookup("a"))
+
+        writer = self.cache.create("a")
+        writer.write(b"fragmented ")
+        writer.write(b"mp4")
+        # Nothing shows up until it's committed.
+        self.assertIsNone(self.cache.lookup("a"))
+        writer.commit()
+
+        self.assertEqual(b"fragmented mp4",
+                         self.cache.lookup("a").read_bytes())
+
+    def testAbortLeavesNothing(self):
+        writer = self.cache.create("a")
+        writer.write(b"partial")
+        writer.abort()
+        writer.commit()
+
+        self.assertIsNone(self.cache.lookup("a"))
+        self.assertEqual([], list((self.tmp_dir / "transcodes").iterdir()))
+
+    def testTooLargeForTheCache(self):
+        writer = self.cache.create("a")
+        writer.write(b"x" * 60)
+        writer.write(b"x" * 60)
+        writer.commit()
+        self.assertIsNone(self.cache.lookup("a"))
+
+    def testCommitFinishedFile(self):
+        # As written by a remux, which needs a seekable output file.
+        self.cache.directory.mkdir()
+        partial = self.cache.partial_path("a")
+        partial.write_bytes(b"remuxed mp4")
+        self.assertEqual(self.cache.path_for("a"),
+                         self.cache.commit("a", partial))
+        self.assertEqual(b"remuxed mp4", self.cache.lookup("a").read_bytes())
+
+        partial = self.cache.partial_path("b")
+        partial.write_bytes(b"x" * 101)
+        self.assertIsNone(self.cache.commit("b", partial))
+        self.assertFalse(partial.exists())
+
+    def testEvictsLeastRecentlyUsed(self):
+        for age, key in enumerate("abc"):
+            self._cache(key, b"x" * 40)
+            # Spreads the mtimes, which are coarse on some filesystems.
+            path = self.cache.path_for(key)
+            os.utime(path, ns=(0, (age + 1) * 10**9))
+
+        # b and c are over the size, and a was the least recently used.
+        self.assertIsNone(self.cache.lookup("a"))
+
+        os.utime(self.cache.path_for("b"), ns=(0, 10 * 10**9))
+        self._cache("d", b"x" * 40)
+        self.assertIsNone(self.cache.lookup("c"))
+        self.assertIsNotNone(self.cache.lookup("b"))
+        self.assertIsNotNone(self.cache.lookup("d"))
+
+    def testKey(self):
+        media = self.tmp_dir / "movie.mkv"
+        media.write_bytes(b"movie")
+        command = ["ffmpeg", "-i", str(media), "-vcodec", "libx264"]
+
+        key = self.cache.key(str(media), command)
+        self.assertEqual(key, self.cache.key(str(media), command))
+        self.assertNotEqual(key, self.cache.key(str(media), command + ["-g"]))
+
+        media.write_bytes(b"another movie")
+        self.assertNotEqual(key, self.cache.key(str(media), command))
+
+        self.assertIsNone(self.cache.key("http://192.0.2.1/movie.mkv",
+                                         command))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,5 +1,6 @@
 # this file is part of mkchromecast.
 
+import os
 import unittest
 from unittest import mock
 
@@ -52,5 +53,31 @@ class ClampBitrateTests(unittest.TestCase):
                 self.assertIn(str(bitrate - 1), print_str)
 
 
+class SeekSecondsTests(unittest.TestCase):
+    def testFormats(self):
+        self.assertEqual(5400.0, utils.seek_seconds("01:30:00"))
+        self.assertEqual(90.5, utils.seek_seconds("1:30.5"))
+        self.assertEqual(42.0, utils.seek_seconds("42"))
+
+    def testMalformed(self):
+        with self.assertRaises(ValueError):
+            utils.seek_seconds("1h30m")
+        with self.assertRaises(ValueError):
+            utils.seek_seconds("-10")
+        with self.assertRaises(ValueError):
+            utils.seek_seconds("nan")
+
+
+class RemuxedFileTests(unittest.TestCase):
+    def testRemovedOnExit(self):
+        self.enterContext(mock.patch.object(utils, "_remuxed_file", None))
+        path = utils.remuxed_file()
+        self.assertEqual(path, utils.remuxed_file())
+        self.assertTrue(os.path.exists(path))
+
+        utils.del_tmp()
+        self.assertFalse(os.path.exists(path))
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)